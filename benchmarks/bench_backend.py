@@ -0,0 +1,130 @@
+'''
+Brief:
+    Benchmark suite for pyrw driven by the simulated rw.exe in pyrw.fake. Runs on any OS without hardware or admin.
+        Run with: python benchmarks/bench_backend.py [--latency-ms N] [--json results.json]
+
+Author(s):
+    Charles Machalow
+'''
+import argparse
+import json
+import os
+import sys
+
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pyrw.fake import FakeReadWriteEverything, SimulatedSystem
+from pyrw.wait import monotonic
+
+READ_SIZES = [16, 4096, 64 * 1024, 1024 * 1024]
+TOPOLOGY_SIZES = [16, 64, 256]
+ADMIN_QUEUE_DEPTHS = [32, 256, 4096]
+NVME_BAR_BASE = 0xE0000000
+NVME_BAR_STRIDE = 0x100000
+
+def makeTopology(numFunctions, nvmeEvery=4, adminQueueEntries=32):
+    '''
+    Brief:
+        Makes a SimulatedSystem with the given number of PCI functions. Every nvmeEvery'th one is an NVMe device.
+    '''
+    system = SimulatedSystem()
+    for idx in range(numFunctions):
+        location = (idx // 8, idx % 8, 0)
+        if idx % nvmeEvery == 0:
+            system.addNVMeDevice(location, NVME_BAR_BASE + idx * NVME_BAR_STRIDE, adminQueueEntries)
+        else:
+            system.addGenericDevice(location)
+    return system
+
+def timeIt(func, repeat):
+    '''
+    Brief:
+        Calls func repeat times. Returns the mean seconds per call.
+    '''
+    start = monotonic()
+    for _ in range(repeat):
+        func()
+    return (monotonic() - start) / repeat
+
+def benchReadMemory(latency, repeat):
+    '''
+    Brief:
+        readMemory latency/throughput at several sizes
+    '''
+    rwe = FakeReadWriteEverything(makeTopology(1), latency)
+    ret = []
+    for size in READ_SIZES:
+        t = timeIt(lambda: rwe.readMemory(NVME_BAR_BASE, size), repeat)
+        ret.append({'name': 'readMemory %d bytes' % size, 'seconds': t, 'MBps': size / t / 1e6})
+    return ret
+
+def benchGetNVMeDevices(latency, repeat):
+    '''
+    Brief:
+        getNVMeDevices on topologies of several sizes
+    '''
+    ret = []
+    for size in TOPOLOGY_SIZES:
+        rwe = FakeReadWriteEverything(makeTopology(size), latency)
+        stats = rwe.enableInstrumentation()
+        t = timeIt(rwe.getNVMeDevices, repeat)
+        ret.append({'name': 'getNVMeDevices %d functions' % size, 'seconds': t, 'launches': stats.subprocessLaunches // repeat})
+    return ret
+
+def benchGetAdminQueueEntries(latency, repeat):
+    '''
+    Brief:
+        getAdminQueueEntries at several admin queue depths
+    '''
+    ret = []
+    for depth in ADMIN_QUEUE_DEPTHS:
+        rwe = FakeReadWriteEverything(makeTopology(1, adminQueueEntries=depth), latency)
+        nvme = rwe.getNVMeDevices()[0]
+        t = timeIt(nvme.getAdminQueueEntries, repeat)
+        ret.append({'name': 'getAdminQueueEntries depth %d' % depth, 'seconds': t})
+    return ret
+
+def benchConcurrentReadWrite(latency, repeat, threads=16, operations=256):
+    '''
+    Brief:
+        Many threads doing write/read-back pairs on one shared ReadWriteEverything. Fails if any data comes back wrong.
+    '''
+    rwe = FakeReadWriteEverything(makeTopology(1), latency)
+
+    def work(idx):
+        address = NVME_BAR_BASE + 0x10000 + idx * 64
+        data = os.urandom(64)
+        rwe.writeMemory(address, data)
+        return rwe.readMemory(address, 64) == data
+
+    start = monotonic()
+    for _ in range(repeat):
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            if not all(executor.map(work, range(operations))):
+                raise RuntimeError("Data corruption with %d threads" % threads)
+    t = (monotonic() - start) / repeat
+    return [{'name': 'concurrent write/read %d ops x %d threads' % (operations, threads), 'seconds': t}]
+
+def main():
+    parser = argparse.ArgumentParser(description='pyrw benchmarks against a simulated rw.exe')
+    parser.add_argument('--latency-ms', type=float, default=0, help='simulated process launch latency per rw.exe call')
+    parser.add_argument('--repeat', type=int, default=5, help='times to repeat each measurement')
+    parser.add_argument('--json', help='also write the results to this JSON file')
+    args = parser.parse_args()
+
+    latency = args.latency_ms / 1000.0
+    results = []
+    for bench in (benchReadMemory, benchGetNVMeDevices, benchGetAdminQueueEntries, benchConcurrentReadWrite):
+        for result in bench(latency, args.repeat):
+            extra = ', '.join('%s=%s' % (k, ('%.1f' % v) if isinstance(v, float) else v) for k, v in result.items() if k not in ('name', 'seconds'))
+            print('%-50s %12.3f ms  %s' % (result['name'], result['seconds'] * 1000, extra))
+            results.append(result)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'latencySeconds': latency, 'repeat': args.repeat, 'results': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+'''
+Brief:
+    Micro-benchmarks for rwe_parser decoding against the original pure-Python implementations.
+        Run with: python benchmarks/bench_parser.py
+
+Author(s):
+    Charles Machalow
+'''
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pyrw.rwe_parser import bytesToDWordList, bytesToIntList, getBinaryFromHexDump, numpy
+
+def originalBytesToDWordList(b):
+    '''
+    Brief:
+        The original per-element add/shift implementation
+    '''
+    ret = []
+    for idx in range(0, len(b), 4):
+        d = b[idx] + (b[idx + 1] << 8) + (b[idx + 2] << 16) + (b[idx + 3] << 24)
+        ret.append(d)
+
+    return ret
+
+def originalGetBinaryFromHexDump(hexDumpStr):
+    '''
+    Brief:
+        The original int(c, 16)-per-byte implementation
+    '''
+    lines = hexDumpStr.splitlines()
+    lines = [line for line in lines if line[0] != ' ']
+    lines = [line for line in lines if line[1] != 'u']
+    lines = [line for line in lines if line[2] != 'r']
+    ret = []
+    for line in lines:
+        line = line.split(' ', 1)[1]
+        line = line.split('\t')[0]
+        ret += [int(c, 16) for c in line.split()]
+
+    return bytearray(ret)
+
+def makeHexDump(data):
+    '''
+    Brief:
+        Makes a RWE-style hex dump of the given data
+    '''
+    lines = []
+    for idx in range(0, len(data), 16):
+        row = data[idx:idx + 16]
+        lines.append('%04X %s\t%s' % (idx, ' '.join('%02X' % c for c in row), '.' * len(row)))
+    return '\n'.join(lines)
+
+def bench(name, func, number):
+    '''
+    Brief:
+        Times func and prints the average time per call
+    '''
+    t = timeit.timeit(func, number=number) / number
+    print('%-45s %10.1f us' % (name, t * 1e6))
+    return t
+
+def main():
+    for size in (256, 4096, 64 * 1024, 1024 * 1024):
+        data = os.urandom(size)
+        number = max(3, 2000000 // size)
+        print('--- %d bytes ---' % size)
+        old = bench('original bytesToDWordList', lambda: originalBytesToDWordList(data), number)
+        new = bench('bytesToDWordList', lambda: bytesToDWordList(data), number)
+        print('%-45s %10.1fx' % ('speedup', old / new))
+        bench('bytesToIntList (QWords)', lambda: bytesToIntList(data, 8), number)
+        if numpy is not None:
+            bench('bytesToDWordList (numpy)', lambda: bytesToDWordList(data, asNumpy=True), number)
+
+        if size <= 64 * 1024:
+            dump = makeHexDump(bytearray(data))
+            assert getBinaryFromHexDump(dump) == originalGetBinaryFromHexDump(dump) == bytearray(data)
+            old = bench('original getBinaryFromHexDump', lambda: originalGetBinaryFromHexDump(dump), number)
+            new = bench('getBinaryFromHexDump', lambda: getBinaryFromHexDump(dump), number)
+            print('%-45s %10.1fx' % ('speedup', old / new))
+
+if __name__ == '__main__':
+    main()
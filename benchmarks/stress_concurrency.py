@@ -0,0 +1,89 @@
+'''
+Brief:
+    Concurrency stress test for ReadWriteEverything: many threads share one instance and do write/read-back pairs,
+        each launching the stub rw.exe (benchmarks/stub_rw.py) as a real process with real scratch files.
+        Fails if any data comes back wrong or any scratch folder is left behind.
+        Run with: python benchmarks/stress_concurrency.py [--threads N] [--operations N]
+
+Author(s):
+    Charles Machalow
+'''
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pyrw.backend import Backend
+from pyrw.rwe import ReadWriteEverything
+from pyrw.wait import monotonic
+
+from stub_rw import MEMORY_ENVIRONMENT_VARIABLE
+
+STUB_PATH = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'stub_rw.py')
+BLOCK_SIZE = 64
+
+class StubReadWriteEverything(ReadWriteEverything):
+    '''
+    Brief:
+        ReadWriteEverything that launches the stub rw.exe with the current Python instead of rw.exe.
+            Doesn't need Windows or admin.
+    '''
+    def __init__(self, scratchDir=None):
+        Backend.__init__(self)
+        self.scratchDir = scratchDir
+        self.recorder = None
+        self.exePath = STUB_PATH
+        self.version = 'RW - Read Write Utility (stub)'
+        self._validated = True
+
+    def getRawCommandLine(self, cmd):
+        return '"%s" "%s" %s' % (sys.executable, self.exePath, cmd)
+
+def stress(threads, operations):
+    '''
+    Brief:
+        Runs operations write/read-back pairs (each to its own block) across threads. Returns the elapsed seconds.
+            Raises RuntimeError on wrong data or leftover scratch folders.
+    '''
+    folder = tempfile.mkdtemp(prefix='pyrw_stress_')
+    try:
+        os.environ[MEMORY_ENVIRONMENT_VARIABLE] = os.path.join(folder, 'memory.bin')
+        scratchDir = os.path.join(folder, 'scratch')
+        os.makedirs(scratchDir)
+        rwe = StubReadWriteEverything(scratchDir)
+
+        def work(idx):
+            address = idx * BLOCK_SIZE
+            data = os.urandom(BLOCK_SIZE)
+            rwe.writeMemory(address, data)
+            return rwe.readMemory(address, BLOCK_SIZE) == data
+
+        start = monotonic()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            failures = sum(1 for ok in executor.map(work, range(operations)) if not ok)
+        elapsed = monotonic() - start
+
+        if failures:
+            raise RuntimeError("%d of %d write/read-back pairs came back wrong with %d threads" % (failures, operations, threads))
+        if os.listdir(scratchDir):
+            raise RuntimeError("Scratch folders were left behind: %s" % os.listdir(scratchDir))
+        return elapsed
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description='pyrw concurrency stress test against a stub rw.exe')
+    parser.add_argument('--threads', type=int, default=32, help='threads sharing one ReadWriteEverything')
+    parser.add_argument('--operations', type=int, default=200, help='write/read-back pairs')
+    args = parser.parse_args()
+
+    elapsed = stress(args.threads, args.operations)
+    print('%d write/read-back pairs x %d threads: OK in %.1f s' % (args.operations, args.threads, elapsed))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+'''
+Brief:
+    A stub rw.exe for tests: a real process that runs the /Command="..." script it is given against a SimulatedSystem
+        whose physical memory is a file (PYRW_STUB_MEMORY), so data written by one launch can be read back by the next.
+        Run as: python benchmarks/stub_rw.py /Min /Nologo /Stdout /Command="COUT Hello World;rwexit"
+
+Author(s):
+    Charles Machalow
+'''
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pyrw.fake import SimulatedSystem
+
+COMMAND_PREFIX = '/Command='
+MEMORY_ENVIRONMENT_VARIABLE = 'PYRW_STUB_MEMORY'
+
+class FileBackedSystem(SimulatedSystem):
+    '''
+    Brief:
+        SimulatedSystem whose physical memory is the given file (address == file offset, reads past the end are zeros)
+    '''
+    def __init__(self, memoryPath):
+        '''
+        Brief:
+            Initializer for the system. Creates the memory file if it doesn't exist.
+        '''
+        SimulatedSystem.__init__(self)
+        self.memoryPath = memoryPath
+        if not os.path.isfile(memoryPath):
+            open(memoryPath, 'ab').close()
+
+    def readMemory(self, address, numBytes):
+        with open(self.memoryPath, 'rb') as f:
+            f.seek(address)
+            data = f.read(numBytes)
+        return data + bytes(bytearray(numBytes - len(data)))
+
+    def writeMemory(self, address, data):
+        with open(self.memoryPath, 'r+b') as f:
+            f.seek(address)
+            f.write(bytearray(data))
+
+def main(argv):
+    command = ' '.join(argv)
+    if COMMAND_PREFIX not in command:
+        return 0
+
+    system = FileBackedSystem(os.environ[MEMORY_ENVIRONMENT_VARIABLE])
+    output, returnCode = system.runScript(command.split(COMMAND_PREFIX, 1)[1])
+    sys.stdout.write(output)
+    return returnCode
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
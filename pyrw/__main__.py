@@ -1,12 +1,22 @@
 
-from pyrw.rwe import ReadWriteEverything
+import sys
+
+if sys.platform.startswith('linux'):
+    from pyrw.linux import SysfsBackend
+    rwe = SysfsBackend()
+else:
+    from pyrw.rwe import ReadWriteEverything
+    rwe = ReadWriteEverything()
+
+if len(sys.argv) > 1 and sys.argv[1] == 'monitor':
+    from pyrw.sampler import main
+    sys.exit(main(sys.argv[2:], rwe))
 
-rwe = ReadWriteEverything()
 header='''
 | --------------------------------------------- |
 | rwe object has been created for your usage... |
 | %-45s |
-| --------------------------------------------- |''' % rwe.getRWEVersion()
+| --------------------------------------------- |''' % rwe.getVersion()
 print(header)
 
 try:
@@ -0,0 +1,328 @@
+'''
+Brief:
+    File for the asyncio API. Wraps a backend so many device polls can be in flight from one event loop.
+
+Author(s):
+    Charles Machalow
+'''
+import asyncio
+import functools
+import logging
+import struct
+
+from concurrent.futures import ThreadPoolExecutor
+
+from pyrw.backend import ProcessOutput, pciConfigsToDeviceInfos
+from pyrw.nvme import ControllerResetTimings, NVMeControllerRegisters, NVMeDevice, NVME_CLASS_CODE
+from pyrw.rwe import ReadWriteEverything
+from pyrw.rwe_parser import PCILocation, bytesToDWordList, getPCIBarAddressesFromConfig, getPCIClassCodeFromConfig, pciTreeTextToDict
+from pyrw.trace import PAYLOAD_LOAD, readPayloads
+from pyrw.wait import DEFAULT_BACKOFF_POLICY, WaitResult, monotonic
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONCURRENCY = 16
+
+class AsyncReadWriteEverything(object):
+    '''
+    Brief:
+        asyncio version of the backend API.
+            With the rw.exe backend, commands run as non-blocking subprocesses (ReadWriteEverything subclasses that
+                override callRWECommand/callRawCommand, like the fake and replay backends, have those run in the thread pool).
+            Other backends have their (blocking) calls run in a thread pool.
+            Either way, at most maxConcurrency operations are in flight at once.
+            The backend's write combining queue (if enabled) is used, with the same barriers as the blocking API.
+    '''
+    def __init__(self, backend=None, maxConcurrency=DEFAULT_MAX_CONCURRENCY):
+        '''
+        Brief:
+            Initializer for the object. Takes the backend to wrap (a ReadWriteEverything is created if None).
+        '''
+        if backend is None:
+            backend = ReadWriteEverything()
+
+        self.backend = backend
+        self.maxConcurrency = maxConcurrency
+        self._useSubprocess = isinstance(backend, ReadWriteEverything)
+        # only launch rw.exe directly if the backend would (its command hooks aren't overridden)
+        self._launchDirectly = self._useSubprocess and \
+            type(backend).callRWECommand is ReadWriteEverything.callRWECommand and \
+            type(backend).callRawCommand is ReadWriteEverything.callRawCommand
+        self._executor = ThreadPoolExecutor(max_workers=maxConcurrency)
+        self._semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, excType, excValue, traceback):
+        self.close()
+
+    def close(self):
+        '''
+        Brief:
+            Shuts down the thread pool
+        '''
+        self._executor.shutdown(wait=False)
+
+    def _getSemaphore(self):
+        '''
+        Brief:
+            Returns the semaphore limiting concurrency (created on first use so it belongs to the running loop)
+        '''
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.maxConcurrency)
+        return self._semaphore
+
+    async def _runInExecutor(self, func, *args):
+        '''
+        Brief:
+            Runs the given blocking function in the thread pool
+        '''
+        async with self._getSemaphore():
+            return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(func, *args))
+
+    async def _barrier(self, byteOffset=None, numBytes=None):
+        '''
+        Brief:
+            Flushes the backend's queued writes (in the thread pool) if the coming operation depends on them (see Backend._barrier)
+        '''
+        queue = self.backend.writeQueue
+        if queue is not None and queue.needsFlush(byteOffset, numBytes):
+            await self._runInExecutor(self.backend.flushWrites)
+
+    async def callRWECommand(self, cmd):
+        '''
+        Brief:
+            Calls an embeded RWE command on rw.exe without blocking the event loop. Returns a ProcessOutput.
+        '''
+        if not self._launchDirectly:
+            return await self._runInExecutor(self.backend.callRWECommand, cmd)
+
+        self.backend.validate()
+        loads = readPayloads(cmd, PAYLOAD_LOAD) if self.backend.recorder is not None else None
+        fullCmd = self.backend.getRawCommandLine(self.backend.getRWECommandArguments(cmd))
+        logger.debug("Calling raw command (async): %s" % fullCmd)
+        async with self._getSemaphore():
+            start = monotonic()
+            process = await asyncio.create_subprocess_shell(fullCmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+            output, _ = await process.communicate()
+            if self.backend.instrumentation is not None:
+                self.backend.instrumentation.recordSubprocessLaunch(monotonic() - start)
+
+        ret = ProcessOutput(Output=output.decode(), ReturnCode=process.returncode)
+        if self.backend.recorder is not None:
+            self.backend.recorder.record(cmd, ret, loads)
+        logger.debug("... Returned: %s" % str(ret))
+        return ret
+
+    async def executeBatch(self, batch):
+        '''
+        Brief:
+            Runs the given RWEBatch without blocking the event loop (after flushing queued writes). Returns the list of operations.
+        '''
+        await self._barrier()
+        return await self._executeBatch(batch)
+
+    async def _executeBatch(self, batch):
+        folder, scripts = batch.prepare()
+        try:
+            for script, ops in scripts:
+                batch.complete(folder, ops, await self.callRWECommand(script))
+        finally:
+            batch.cleanup(folder)
+
+        return batch.operations
+
+    async def _runOperation(self, name, *args):
+        '''
+        Brief:
+            Runs a single backend operation by name
+        '''
+        if self._useSubprocess:
+            batch = self.backend.batch()
+            op = getattr(batch, name)(*args)
+            await self._executeBatch(batch)
+            return op.Result
+
+        return await self._runInExecutor(getattr(self.backend, name), *args)
+
+    async def readMemory(self, byteOffset, numBytes):
+        '''
+        Brief:
+            Reads raw memory from a given offset for a given number of bytes
+        '''
+        await self._barrier(byteOffset, numBytes)
+        return await self._runOperation('readMemory', byteOffset, numBytes)
+
+    async def writeMemory(self, byteOffset, data):
+        '''
+        Brief:
+            Writes given data to the given offset of memory.
+                With write combining on, the write is queued on the backend (see Backend.enableWriteCombining()).
+        '''
+        if self.backend.writeQueue is not None:
+            return await self._runInExecutor(self.backend.writeMemory, byteOffset, data)
+        return await self._runOperation('writeMemory', byteOffset, data)
+
+    async def readPCI(self, bus, device, function):
+        '''
+        Brief:
+            Reads PCI header (configuration space) data from the given device
+        '''
+        await self._barrier()
+        cache = self.backend.configCache
+        if self._useSubprocess and cache is not None:
+            version = cache.getVersion((bus, device, function))
+            data = cache.get((bus, device, function))
+            if data is None:
+                data = await self._runOperation('readPCI', bus, device, function)
+                cache.prime((bus, device, function), data, version)
+            return data
+
+        return await self._runOperation('readPCI', bus, device, function)
+
+    async def writePCI(self, bus, device, function, data):
+        '''
+        Brief:
+            Writes given PCI (configuration space) data to a given device
+        '''
+        await self._barrier()
+        try:
+            return await self._runOperation('writePCI', bus, device, function, data)
+        finally:
+            if self._useSubprocess and self.backend.configCache is not None:
+                self.backend.configCache.invalidate((bus, device, function))
+
+    async def readPCIMany(self, addresses):
+        '''
+        Brief:
+            Reads config space for many devices. Returns a dict of PCILocation to data.
+        '''
+        if not self._useSubprocess:
+            return await self._runInExecutor(self.backend.readPCIMany, addresses)
+
+        addresses = [PCILocation(*a) for a in addresses]
+        cache = self.backend.configCache
+        versions = dict((a, cache.getVersion(a)) for a in addresses) if cache is not None else {}
+        batch = self.backend.batch()
+        ops = [batch.readPCI(*a) for a in addresses]
+        await self.executeBatch(batch)
+        ret = dict(zip(addresses, [op.Result for op in ops]))
+        if cache is not None:
+            for address, data in ret.items():
+                cache.prime(address, data, versions[address])
+        return ret
+
+    async def getPCITree(self):
+        '''
+        Brief:
+            Returns a dictionary of the system's PCI devices (PCILocation) to descriptions
+        '''
+        if not self._useSubprocess:
+            return await self._runInExecutor(self.backend.getPCITree)
+
+        await self._barrier()
+        n = await self.callRWECommand('PCITREE')
+        assert n.ReturnCode == 0, "Didn't return 0"
+        return pciTreeTextToDict(n.Output)
+
+    async def getPCIBarAddresses(self, bus, device, function):
+        '''
+        Brief:
+            Gets a list of BAR addresses for the given device
+        '''
+        return getPCIBarAddressesFromConfig(await self.readPCI(bus, device, function))
+
+    async def getPCIClassCode(self, bus, device, function):
+        '''
+        Brief:
+            Gets the PCI class code for a given device
+        '''
+        return getPCIClassCodeFromConfig(await self.readPCI(bus, device, function))
+
+    async def enumeratePCIDevices(self, classCode=None):
+        '''
+        Brief:
+            Returns a list of PCIDeviceInfo for all PCI devices on the system (optionally only ones with the given classCode)
+        '''
+        tree = await self.getPCITree()
+        return pciConfigsToDeviceInfos(await self.readPCIMany(sorted(tree.keys())), classCode)
+
+    async def getNVMeDevices(self):
+        '''
+        Brief:
+            Returns a list of all NVMe devices on the system. The devices use the wrapped (blocking) backend.
+        '''
+        return [NVMeDevice(self.backend, info.Address, configData=info.Config) for info in await self.enumeratePCIDevices(NVME_CLASS_CODE)]
+
+    async def waitFor(self, readCoroutineFunc, predicate, timeoutSeconds, policy=DEFAULT_BACKOFF_POLICY, description='the condition'):
+        '''
+        Brief:
+            Async version of pyrw.wait.waitFor: awaits readCoroutineFunc() until predicate(value) is True, sleeping per the BackoffPolicy.
+                Returns a WaitResult. Raises RuntimeError on timeout.
+        '''
+        start = monotonic()
+        deathTime = start + timeoutSeconds
+        delay = policy.InitialDelay
+        polls = 0
+        while True:
+            value = await readCoroutineFunc()
+            polls += 1
+            now = monotonic()
+            if predicate(value):
+                return WaitResult(Value=value, Elapsed=now - start, Polls=polls)
+
+            if now >= deathTime:
+                raise RuntimeError("Timed out after %.3f seconds waiting for %s" % (timeoutSeconds, description))
+
+            await asyncio.sleep(min(delay, deathTime - now))
+            delay = min(policy.MaxDelay, delay * policy.Multiplier)
+
+    async def controllerReset(self, nvmeDevice, policy=DEFAULT_BACKOFF_POLICY):
+        '''
+        Brief:
+            Performs a complete NVMe Controller Reset on the given NVMeDevice without blocking the event loop.
+                Returns ControllerResetTimings (in seconds) for each step:
+                CC.EN -> 0
+                CSTS.RDY -> 0
+                CC.EN -> 1
+                CSTS.RDY -> 1
+        '''
+        bar0 = (await self.getPCIBarAddresses(*nvmeDevice.address))[0]
+        CCAddr = bar0 + NVMeControllerRegisters.CC.offset
+        CSTSAddr = bar0 + NVMeControllerRegisters.CSTS.offset
+        readCSTS = lambda: self.readMemory(CSTSAddr, 4)
+
+        timeoutSeconds = (await self.readMemory(bar0 + 3, 1))[0] * .5 # CAP.TO is in 500ms units
+
+        start = monotonic()
+        CC0 = bytesToDWordList(await self.readMemory(CCAddr, 4))[0]
+        assert (await self.writeMemory(CCAddr, struct.pack('<I', (CC0 >> 1) << 1))).ReturnCode == 0 # set CC.EN to 0
+        ccDisabled = monotonic()
+
+        await self.waitFor(readCSTS, lambda csts: csts[0] & 1 == 0, timeoutSeconds, policy, 'CSTS.RDY to go to 0')
+        notReady = monotonic()
+
+        await self.writeMemory(CCAddr, struct.pack('<I', ((CC0 >> 1) << 1) | 1)) # set CC.EN to 1
+        ccEnabled = monotonic()
+
+        await self.waitFor(readCSTS, lambda csts: csts[0] & 1 == 1, timeoutSeconds, policy, 'CSTS.RDY to go back to 1')
+        ready = monotonic()
+
+        return ControllerResetTimings(
+            CCEnableCleared=ccDisabled - start,
+            ReadyCleared=notReady - ccDisabled,
+            CCEnableSet=ccEnabled - notReady,
+            ReadySet=ready - ccEnabled,
+            Total=ready - start,
+        )
+
+    async def subsystemReset(self, nvmeDevice):
+        '''
+        Brief:
+            Performs an NVMe Subsystem Reset on the given NVMeDevice
+        '''
+        # write 4E564D65h ("NVMe") to NSSR (0x20)
+        bar0 = (await self.getPCIBarAddresses(*nvmeDevice.address))[0]
+        if (await self.writeMemory(bar0 + 0x20, [0x4e, 0x56, 0x4d, 0x65])).ReturnCode != 0:
+            raise RuntimeError("Failed to write the NSSR")
@@ -0,0 +1,687 @@
+'''
+Brief:
+    File for the Backend base class. A backend is anything that can access physical memory and PCI configuration space.
+
+Author(s):
+    Charles Machalow
+'''
+import array
+import collections
+import struct
+
+from pyrw.rwe_parser import PCILocation, WIDTH_FORMATS, bytesToIntList, getPCIBarAddressesFromConfig, getPCIClassCodeFromConfig, getPCIIdsFromConfig
+from pyrw.capabilities import PCI_EXTENDED_CONFIG_SIZE, PCI_HEADER_SIZE
+from pyrw.combine import DEFAULT_MAX_PENDING_BYTES, WriteCombiningQueue
+from pyrw.dump import DEFAULT_BLOCK_SIZE as DEFAULT_DUMP_BLOCK_SIZE, DEFAULT_MAX_WORKERS as DEFAULT_DUMP_WORKERS, shardedDump
+from pyrw.instrumentation import Instrumentation, instrumented
+from pyrw.nvme import NVMeControllerRegisters, NVMeDevice, NVME_CLASS_CODE
+from pyrw.pci import PCIConfigCache, PCIDevice
+from pyrw.search import searchChunks
+from pyrw.snapshot import DEFAULT_BLOCK_SIZE, Snapshot
+from pyrw.topology import PCITopology, PCITopologyCache
+from pyrw.wait import DEFAULT_BACKOFF_POLICY, waitFor
+from pyrw.window import RegisterWindow
+
+ProcessOutput = collections.namedtuple("ProcessOutput", ["Output", "ReturnCode"])
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+def _getArrayTypecode(size):
+    '''
+    Brief:
+        Returns the array typecode of an unsigned int of the given size in bytes, or None if there isn't one
+            (Python 2 has no 'Q', and its 'L' is only 8 bytes on 64-bit non-Windows builds)
+    '''
+    for typecode in ('B', 'H', 'I', 'L', 'Q'):
+        try:
+            if array.array(typecode).itemsize == size:
+                return typecode
+        except ValueError:
+            pass
+    return None
+
+# width in bytes -> array typecode of an unsigned int of that size (None if the array module has none)
+ARRAY_TYPECODES = dict((size, _getArrayTypecode(size)) for size in (1, 2, 4, 8))
+PCIDeviceInfo = collections.namedtuple("PCIDeviceInfo", ['Address', 'VendorId', 'DeviceId', 'ClassCode', 'BarAddresses', 'Config'])
+
+def pciConfigsToDeviceInfos(configs, classCode=None):
+    '''
+    Brief:
+        Converts a dict of PCILocation to config space data to a list of PCIDeviceInfo (sorted by address).
+            If classCode is given, only devices with that class code are returned.
+    '''
+    ret = []
+    for address in sorted(configs.keys()):
+        config = configs[address]
+        testClassCode = getPCIClassCodeFromConfig(config)
+        if classCode is not None and testClassCode != classCode:
+            continue
+
+        vendorId, deviceId = getPCIIdsFromConfig(config)
+        ret.append(PCIDeviceInfo(address, vendorId, deviceId, testClassCode, getPCIBarAddressesFromConfig(config), config))
+
+    return ret
+
+class Backend(object):
+    '''
+    Brief:
+        Base class for all backends. Subclasses implement the underscore-prefixed raw access methods.
+            Everything built on top of those (BARs, class codes, NVMe discovery, etc.) lives here so every backend gets it.
+    '''
+    def __init__(self):
+        '''
+        Brief:
+            Initializer for the backend
+        '''
+        self.configCache = None
+        self.instrumentation = None
+        self.writeQueue = None
+        self.ecamBaseAddress = None
+        self.topologyCache = PCITopologyCache(self._scanPCITopology)
+
+    def enableInstrumentation(self):
+        '''
+        Brief:
+            Turns on per-operation counters, latency histograms and hooks. Returns the Instrumentation object.
+        '''
+        if self.instrumentation is None:
+            self.instrumentation = Instrumentation()
+        return self.instrumentation
+
+    def disableInstrumentation(self):
+        '''
+        Brief:
+            Turns off (and drops) instrumentation
+        '''
+        self.instrumentation = None
+
+    def enableConfigCache(self):
+        '''
+        Brief:
+            Turns on caching of PCI configuration space reads. Returns the PCIConfigCache (for hit/miss counters and refresh()).
+        '''
+        if self.configCache is None:
+            self.configCache = PCIConfigCache(self._readPCI)
+        return self.configCache
+
+    def disableConfigCache(self):
+        '''
+        Brief:
+            Turns off (and drops) the PCI configuration space cache
+        '''
+        self.configCache = None
+
+    def enableECAM(self, baseAddress):
+        '''
+        Brief:
+            Has extended (4 KiB) config space reads go through the PCIe memory mapped config space (ECAM) at the given base address.
+                The base comes from the ACPI MCFG table. Without it, backends that can't read past the 256 byte header only return the header.
+        '''
+        self.ecamBaseAddress = baseAddress
+
+    def disableECAM(self):
+        '''
+        Brief:
+            Stops reading extended config space through ECAM
+        '''
+        self.ecamBaseAddress = None
+
+    def getECAMAddress(self, bus, device, function, offset=0):
+        '''
+        Brief:
+            Returns the memory address of the given config space offset of the given device through ECAM
+        '''
+        if self.ecamBaseAddress is None:
+            raise RuntimeError("ECAM isn't enabled (see enableECAM())")
+        return self.ecamBaseAddress + ((bus << 20) | (device << 15) | (function << 12)) + offset
+
+    def enableWriteCombining(self, flushOnAnyRead=True, mergeAdjacent=False, maxPendingBytes=DEFAULT_MAX_PENDING_BYTES):
+        '''
+        Brief:
+            Turns on write combining: writeMemory() calls are queued and sent together, in order and each as its own access,
+                at the next barrier (flushWrites(), any read if flushOnAnyRead or an overlapping read otherwise, or any PCI operation).
+                A write overlapping a queued one flushes the queue first. mergeAdjacent joins back-to-back writes (only for plain memory).
+                The queue is also flushed once maxPendingBytes are queued (None for no limit).
+                Returns the WriteCombiningQueue (for per-flush stats). Failed writes raise at flush time and stay queued
+                    (see WriteCombiningQueue.discard()).
+                Note that mapped RegisterWindows write straight to hardware, so call flushWrites() before using one.
+        '''
+        if self.writeQueue is None:
+            self.writeQueue = WriteCombiningQueue(self._writeMemoryMany, flushOnAnyRead, mergeAdjacent, maxPendingBytes=maxPendingBytes)
+        return self.writeQueue
+
+    def disableWriteCombining(self):
+        '''
+        Brief:
+            Flushes pending writes then turns off write combining
+        '''
+        self.flushWrites()
+        self.writeQueue = None
+
+    @instrumented(lambda args, result: 0 if result is None else result.Bytes)
+    def flushWrites(self):
+        '''
+        Brief:
+            Sends all queued writes to the backend (an ordering barrier). Returns FlushStats, or None if nothing was queued.
+        '''
+        if self.writeQueue is None:
+            return None
+        return self.writeQueue.flush()
+
+    def _barrier(self, byteOffset=None, numBytes=None):
+        '''
+        Brief:
+            Flushes queued writes if the coming operation (a read of the given range, or anything else if None) depends on them
+        '''
+        if self.writeQueue is not None and self.writeQueue.needsFlush(byteOffset, numBytes):
+            self.flushWrites()
+
+    def getVersion(self):
+        '''
+        Brief:
+            Returns a string describing this backend and its version
+        '''
+        raise NotImplementedError
+
+    def _readMemory(self, byteOffset, numBytes):
+        raise NotImplementedError
+
+    def _writeMemory(self, byteOffset, data):
+        raise NotImplementedError
+
+    def _readPCI(self, bus, device, function):
+        raise NotImplementedError
+
+    def _writePCI(self, bus, device, function, data):
+        raise NotImplementedError
+
+    def _getPCITree(self):
+        raise NotImplementedError
+
+    def _readPCIExtended(self, bus, device, function):
+        '''
+        Brief:
+            Reads the full (4 KiB) extended config space through ECAM if it's enabled, otherwise just the header.
+                Backends that can read extended config space directly override this.
+        '''
+        if self.ecamBaseAddress is not None:
+            return self._readMemory(self.getECAMAddress(bus, device, function), PCI_EXTENDED_CONFIG_SIZE)
+        return self._readPCI(bus, device, function)
+
+    def _readPCIRange(self, bus, device, function, offset, numBytes):
+        '''
+        Brief:
+            Reads the given range of a device's config space.
+                By default this reads just the range through ECAM if enabled, otherwise it slices a full read.
+        '''
+        if self.ecamBaseAddress is not None:
+            return self._readMemory(self.getECAMAddress(bus, device, function, offset), numBytes)
+        data = self._readPCI(bus, device, function) if offset + numBytes <= PCI_HEADER_SIZE else self._readPCIExtended(bus, device, function)
+        return data[offset:offset + numBytes]
+
+    def _readPCIMany(self, addresses, maxWorkers=None):
+        '''
+        Brief:
+            Reads config space for many devices. Returns a list of data in the same order as addresses.
+                Backends that can do better than one read per device (or can't be used from many threads) override this.
+        '''
+        if maxWorkers and maxWorkers > 1:
+            # imported here so pyrw still imports on Python 2 (where concurrent.futures is only available as a backport)
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+                return list(executor.map(lambda a: self._readPCI(*a), addresses))
+
+        return [self._readPCI(*a) for a in addresses]
+
+    def _readMemoryMany(self, ranges):
+        '''
+        Brief:
+            Reads many (byteOffset, numBytes) ranges. Returns a list of data in the same order as ranges.
+                Backends that can do many reads in one operation override this.
+        '''
+        return [self._readMemory(byteOffset, numBytes) for byteOffset, numBytes in ranges]
+
+    def _writeMemoryMany(self, writes):
+        '''
+        Brief:
+            Writes many (byteOffset, data) pairs in order. Returns a list of ProcessOutputs.
+                Backends that can do many writes in one operation override this.
+        '''
+        return [self._writeMemory(byteOffset, data) for byteOffset, data in writes]
+
+    def _writePCIRange(self, bus, device, function, offset, data):
+        '''
+        Brief:
+            Writes data at the given offset of a device's config space (see _writePCIRanges()).
+                Backends that can write part of config space override this.
+        '''
+        return self._writePCIRanges(bus, device, function, [(offset, data)])[0]
+
+    def _writePCIRanges(self, bus, device, function, writes, baseConfig=None):
+        '''
+        Brief:
+            Writes many (offset, data) pairs to a device's config space. Returns a list of ProcessOutputs, one per write.
+                With ECAM enabled only the given bytes are written (as memory writes).
+                Otherwise _writePCI() can only write the whole header (rw.exe has no partial config write), so the writes are
+                    applied to one header image and sent in one write. The image starts from baseConfig (the header the writes are
+                    relative to) if given, otherwise from a fresh read. Bytes outside the writes are written back as they are in that
+                    image, so RW1C bits that read as 1 there are cleared.
+                Backends that can write part of config space override this.
+        '''
+        if self.ecamBaseAddress is not None:
+            return self._writeMemoryMany([(self.getECAMAddress(bus, device, function, offset), data) for offset, data in writes])
+
+        config = bytearray(self._readPCI(bus, device, function) if baseConfig is None else baseConfig[:PCI_HEADER_SIZE])
+        for offset, data in writes:
+            if offset + len(data) > len(config):
+                raise ValueError("Can't write 0x%X bytes at config offset 0x%X without ECAM (see enableECAM()): only the 0x%X byte header is writable" % (len(data), offset, len(config)))
+            config[offset:offset + len(data)] = bytearray(data)
+        return [self._writePCI(bus, device, function, config)] * len(writes)
+
+    @instrumented(lambda args, result: len(result))
+    def readMemory(self, byteOffset, numBytes):
+        '''
+        Brief:
+            Reads raw memory from a given offset for a given number of bytes
+        '''
+        self._barrier(byteOffset, numBytes)
+        return self._readMemory(byteOffset, numBytes)
+
+    @instrumented(lambda args, result: len(args[1]))
+    def writeMemory(self, byteOffset, data):
+        '''
+        Brief:
+            Writes given data to the given offset of memory. Returns a ProcessOutput.
+                With write combining on, the write is queued and a successful ProcessOutput is returned right away.
+        '''
+        if self.writeQueue is not None:
+            self.writeQueue.queue(byteOffset, data)
+            return ProcessOutput(Output='', ReturnCode=0)
+        return self._writeMemory(byteOffset, data)
+
+    @instrumented(lambda args, result: sum(len(d) for d in result))
+    def readMemoryMany(self, ranges):
+        '''
+        Brief:
+            Reads a list of (byteOffset, numBytes) ranges with as few operations as the backend allows.
+                Returns a list of data in the same order.
+        '''
+        ranges = list(ranges)
+        if not ranges:
+            return []
+        self._barrier()
+        return [bytes(d) for d in self._readMemoryMany(ranges)]
+
+    def readInt(self, byteOffset, width):
+        '''
+        Brief:
+            Reads the little-endian unsigned int of the given width (1, 2, 4 or 8 bytes) at the given offset
+        '''
+        return struct.unpack('<' + WIDTH_FORMATS[width], bytes(self.readMemory(byteOffset, width)))[0]
+
+    def writeInt(self, byteOffset, width, value):
+        '''
+        Brief:
+            Writes a little-endian unsigned int of the given width (1, 2, 4 or 8 bytes) to the given offset with one write
+        '''
+        ret = self.writeMemory(byteOffset, struct.pack('<' + WIDTH_FORMATS[width], value))
+        if ret.ReturnCode != 0:
+            raise RuntimeError("Failed to write 0x%X bytes at 0x%X" % (width, byteOffset))
+
+    read8 = lambda self, byteOffset: self.readInt(byteOffset, 1)
+    read16 = lambda self, byteOffset: self.readInt(byteOffset, 2)
+    read32 = lambda self, byteOffset: self.readInt(byteOffset, 4)
+    read64 = lambda self, byteOffset: self.readInt(byteOffset, 8)
+    write8 = lambda self, byteOffset, value: self.writeInt(byteOffset, 1, value)
+    write16 = lambda self, byteOffset, value: self.writeInt(byteOffset, 2, value)
+    write32 = lambda self, byteOffset, value: self.writeInt(byteOffset, 4, value)
+    write64 = lambda self, byteOffset, value: self.writeInt(byteOffset, 8, value)
+
+    def resolveRegisters(self, items):
+        '''
+        Brief:
+            Converts (address, width) or (device, register) pairs (see gather()) to (address, width) pairs. BAR0 of every device given is found with one bulk config space read.
+        '''
+        items = list(items)
+        devices = set(item[0].address for item in items if isinstance(item[0], PCIDevice))
+        bar0s = dict((a, getPCIBarAddressesFromConfig(c)[0]) for a, c in self.readPCIMany(sorted(devices)).items()) if devices else {}
+
+        ret = []
+        for target, register in items:
+            if not isinstance(target, PCIDevice):
+                ret.append((target, register))
+                continue
+
+            if isinstance(register, str):
+                field = getattr(NVMeControllerRegisters, register)
+                ret.append((bar0s[PCILocation(*target.address)] + field.offset, field.size))
+            else:
+                ret.append((bar0s[PCILocation(*target.address)] + register, 4))
+        return ret
+
+    def gather(self, items, asNumpy=False):
+        '''
+        Brief:
+            Reads many registers with as few backend operations as possible (see readMemoryMany).
+                items is a list of (address, width) pairs or (device, register) pairs, where device is a PCIDevice and register is
+                    an NVMeControllerRegisters field name or a DWORD offset into BAR0.
+                Returns an array.array (or numpy array if asNumpy) of the values in the same order, using the widest width given.
+                A list is returned instead of an array.array if there is no array typecode for that width (8 bytes on some Python 2 builds).
+        '''
+        resolved = self.resolveRegisters(items)
+        unique = sorted(set(resolved))
+        data = dict(zip(unique, self.readMemoryMany(unique)))
+
+        width = max([w for _, w in resolved] or [1])
+        values = [bytesToIntList(data[r], r[1])[0] for r in resolved]
+        if asNumpy:
+            return bytesToIntList(struct.pack('<%d%s' % (len(values), WIDTH_FORMATS[width]), *values), width, asNumpy=True)
+        if ARRAY_TYPECODES[width] is None:
+            return values
+        return array.array(ARRAY_TYPECODES[width], values)
+
+    @instrumented(lambda args, result: sum(len(d) for _, d in args[0]))
+    def writeMemoryMany(self, writes):
+        '''
+        Brief:
+            Writes a list of (byteOffset, data) pairs in order with as few operations as the backend allows.
+                Returns a list of ProcessOutputs (one per write).
+        '''
+        writes = list(writes)
+        if self.writeQueue is not None:
+            for byteOffset, data in writes:
+                self.writeQueue.queue(byteOffset, data)
+            return [ProcessOutput(Output='', ReturnCode=0)] * len(writes)
+        if not writes:
+            return []
+        return self._writeMemoryMany(writes)
+
+    def iterMemory(self, byteOffset, numBytes, chunkSize=DEFAULT_CHUNK_SIZE, prefetch=True):
+        '''
+        Brief:
+            Generator that reads the given range of memory in chunks of (at most) chunkSize bytes.
+                If prefetch is True, the next chunk is read in the background while the current one is being consumed.
+                At most two chunks are held in memory at once.
+        '''
+        ranges = [(offset, min(chunkSize, byteOffset + numBytes - offset)) for offset in range(byteOffset, byteOffset + numBytes, chunkSize)]
+        if not prefetch or len(ranges) < 2:
+            for offset, size in ranges:
+                yield self.readMemory(offset, size)
+            return
+
+        from concurrent.futures import ThreadPoolExecutor
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            future = executor.submit(self.readMemory, *ranges[0])
+            for nextRange in ranges[1:]:
+                data = future.result()
+                future = executor.submit(self.readMemory, *nextRange)
+                yield data
+            yield future.result()
+        finally:
+            executor.shutdown(wait=True)
+
+    def searchMemory(self, byteOffset, numBytes, patterns, maxHits=None, alignment=1, chunkSize=DEFAULT_CHUNK_SIZE, prefetch=True):
+        '''
+        Brief:
+            Generator of SearchMatches (Address, PatternIndex) for the given patterns in the given range of memory, in address order.
+                patterns is a list (or a single pattern) of bytes (exact), hex text with wildcards like '52 53 ?? 20' or (value, mask) tuples.
+                The range is streamed in chunks (see iterMemory) so memory use stays bounded and matches come back as they are found.
+                Stops after maxHits matches. Only addresses that are multiples of alignment are reported.
+        '''
+        if not isinstance(patterns, list):
+            patterns = [patterns]
+        return searchChunks(self.iterMemory(byteOffset, numBytes, chunkSize, prefetch), byteOffset, patterns, maxHits, alignment)
+
+    def dumpMemory(self, byteOffset, numBytes, sink, chunkSize=DEFAULT_CHUNK_SIZE, prefetch=True):
+        '''
+        Brief:
+            Streams the given range of memory to sink (a file path or a writable file-like object) without holding it all in memory.
+                Returns the number of bytes written.
+        '''
+        if not hasattr(sink, 'write'):
+            with open(sink, 'wb') as f:
+                return self.dumpMemory(byteOffset, numBytes, f, chunkSize, prefetch)
+
+        written = 0
+        for data in self.iterMemory(byteOffset, numBytes, chunkSize, prefetch):
+            sink.write(data)
+            written += len(data)
+        return written
+
+    def dumpMemorySharded(self, ranges, path, blockSize=DEFAULT_DUMP_BLOCK_SIZE, maxWorkers=DEFAULT_DUMP_WORKERS):
+        '''
+        Brief:
+            Dumps the given (byteOffset, numBytes) range(s) (or BarResources) to path, reading blocks in parallel with at most
+                maxWorkers at once into a memory mapped file. A per-block hash manifest is written to path + '.manifest.json';
+                re-dumping to the same path only rewrites blocks that changed. Returns a DumpResult (see pyrw.dump).
+        '''
+        return shardedDump(self, ranges, path, blockSize, maxWorkers)
+
+    def loadMemory(self, byteOffset, source, numBytes=None, chunkSize=DEFAULT_CHUNK_SIZE):
+        '''
+        Brief:
+            Streams data from source (a file path or a readable file-like object) into memory at the given offset, chunk by chunk.
+                If numBytes is given, at most that many bytes are loaded. Returns the number of bytes written.
+        '''
+        if not hasattr(source, 'read'):
+            with open(source, 'rb') as f:
+                return self.loadMemory(byteOffset, f, numBytes, chunkSize)
+
+        written = 0
+        while numBytes is None or written < numBytes:
+            toRead = chunkSize if numBytes is None else min(chunkSize, numBytes - written)
+            data = source.read(toRead)
+            if not data:
+                break
+
+            ret = self.writeMemory(byteOffset + written, data)
+            if ret.ReturnCode != 0:
+                raise RuntimeError("Failed to write 0x%X bytes at 0x%X" % (len(data), byteOffset + written))
+            written += len(data)
+
+        return written
+
+    def waitForMemory(self, byteOffset, mask, value, timeoutSeconds, numBytes=4, policy=DEFAULT_BACKOFF_POLICY):
+        '''
+        Brief:
+            Polls the little-endian int at the given offset until (int & mask) == value, backing off per the BackoffPolicy.
+                Returns a WaitResult (final value, elapsed seconds, number of reads). Raises RuntimeError on timeout.
+        '''
+        readFunc = lambda: bytesToIntList(self.readMemory(byteOffset, numBytes), numBytes)[0]
+        description = '(0x%X & 0x%X) == 0x%X' % (byteOffset, mask, value)
+        return waitFor(readFunc, lambda v: v & mask == value, timeoutSeconds, policy, description)
+
+    @instrumented(lambda args, result: len(result))
+    def readPCI(self, bus, device, function):
+        '''
+        Brief:
+            Reads PCI header (configuration space) data from the given device
+        '''
+        self._barrier()
+        if self.configCache is not None:
+            return self.configCache.read((bus, device, function))
+        return self._readPCI(bus, device, function)
+
+    @instrumented(lambda args, result: len(result))
+    def readPCIExtended(self, bus, device, function):
+        '''
+        Brief:
+            Reads the full 4 KiB (extended) configuration space of the given device.
+                Only the 256 byte header is returned if the backend can't read further (see enableECAM()).
+        '''
+        self._barrier()
+        return self._readPCIExtended(bus, device, function)
+
+    @instrumented(lambda args, result: len(result))
+    def readPCIRange(self, bus, device, function, offset, numBytes):
+        '''
+        Brief:
+            Reads just the given range of a device's (extended) configuration space (not cached)
+        '''
+        self._barrier()
+        return bytes(self._readPCIRange(bus, device, function, offset, numBytes))
+
+    @instrumented(lambda args, result: len(args[3]))
+    def writePCI(self, bus, device, function, data):
+        '''
+        Brief:
+            Writes given PCI (configuration space) data to a given device. Returns a ProcessOutput.
+        '''
+        self._barrier()
+        try:
+            return self._writePCI(bus, device, function, data)
+        finally:
+            if self.configCache is not None:
+                self.configCache.invalidate((bus, device, function))
+
+    @instrumented(lambda args, result: len(args[4]))
+    def writePCIRange(self, bus, device, function, offset, data):
+        '''
+        Brief:
+            Writes given data at the given offset of a device's PCI (configuration space). Returns a ProcessOutput.
+        '''
+        self._barrier()
+        try:
+            return self._writePCIRange(bus, device, function, offset, data)
+        finally:
+            if self.configCache is not None:
+                self.configCache.invalidate((bus, device, function))
+
+    @instrumented(lambda args, result: sum(len(d) for _, d in args[3]))
+    def writePCIRanges(self, bus, device, function, writes, baseConfig=None):
+        '''
+        Brief:
+            Writes many (offset, data) pairs to a device's PCI (configuration space) in as few operations as the backend allows.
+                Returns a list of ProcessOutputs, one per write.
+                On rw.exe without ECAM this is one write of the whole header: baseConfig (e.g. what the writes were diffed against)
+                    is used for the bytes that aren't written, or the header is read first if it isn't given.
+        '''
+        self._barrier()
+        try:
+            return self._writePCIRanges(bus, device, function, [(offset, data) for offset, data in writes], baseConfig)
+        finally:
+            if self.configCache is not None:
+                self.configCache.invalidate((bus, device, function))
+
+    @instrumented(lambda args, result: sum(len(d) for d in result.values()))
+    def readPCIMany(self, addresses, maxWorkers=None):
+        '''
+        Brief:
+            Reads PCI header (configuration space) data for many devices in as few operations as the backend allows.
+                Returns a dict of PCILocation to data. maxWorkers bounds the thread pool used by backends that read one device at a time.
+        '''
+        self._barrier()
+        addresses = [PCILocation(*a) for a in addresses]
+        ret = {}
+        versions = {}
+        if self.configCache is not None:
+            misses = []
+            for address in addresses:
+                versions[address] = self.configCache.getVersion(address)
+                data = self.configCache.get(address)
+                if data is None:
+                    misses.append(address)
+                else:
+                    ret[address] = data
+        else:
+            misses = addresses
+
+        if misses:
+            for address, data in zip(misses, self._readPCIMany(misses, maxWorkers)):
+                data = bytes(data)
+                if self.configCache is not None:
+                    self.configCache.prime(address, data, versions[address])
+                ret[address] = data
+
+        return ret
+
+    @instrumented()
+    def getPCITree(self):
+        '''
+        Brief:
+            Returns a dictionary of the system's PCI devices (PCILocation) to descriptions
+        '''
+        self._barrier()
+        return self._getPCITree()
+
+    def getMemoryView(self, byteOffset, numBytes):
+        '''
+        Brief:
+            Returns a writable memoryview directly over the given range of memory or None if this backend can't map memory
+        '''
+        return None
+
+    def getRegisterWindow(self, byteOffset, numBytes):
+        '''
+        Brief:
+            Returns a RegisterWindow over the given range of memory. It is mapped if the backend allows it, cached otherwise.
+        '''
+        return RegisterWindow(self, byteOffset, numBytes)
+
+    def snapshotMemory(self, byteOffset, numBytes, blockSize=DEFAULT_BLOCK_SIZE):
+        '''
+        Brief:
+            Returns a Snapshot of the given range of memory. Edit it locally then commit() to write back only what changed.
+        '''
+        return Snapshot.fromMemory(self, byteOffset, numBytes, blockSize)
+
+    def snapshotPCI(self, bus, device, function, blockSize=DEFAULT_BLOCK_SIZE):
+        '''
+        Brief:
+            Returns a Snapshot of the given device's config space. Edit it locally then commit() to write back only what changed.
+        '''
+        return Snapshot.fromPCI(self, bus, device, function, blockSize)
+
+    def getPCIBarAddresses(self, bus, device, function):
+        '''
+        Brief:
+            Gets a list of BAR addresses for the given device
+        '''
+        return getPCIBarAddressesFromConfig(self.readPCI(bus, device, function))
+
+    def getPCIClassCode(self, bus, device, function):
+        '''
+        Brief:
+            Gets the PCI class code for a given device
+        '''
+        return getPCIClassCodeFromConfig(self.readPCI(bus, device, function))
+
+    def enumeratePCIDevices(self, classCode=None, maxWorkers=None):
+        '''
+        Brief:
+            Returns a list of PCIDeviceInfo for all PCI devices on the system (sorted by address).
+                Config space for every device is read in one bulk pass (see readPCIMany).
+                If classCode is given, only devices with that class code are returned.
+        '''
+        configs = self.readPCIMany(sorted(self.getPCITree().keys()), maxWorkers)
+        return pciConfigsToDeviceInfos(configs, classCode)
+
+    def _scanPCITopology(self):
+        '''
+        Brief:
+            Does a full scan (PCI tree + bulk config space read) and returns a new PCITopology
+        '''
+        tree = self.getPCITree()
+        return PCITopology(pciConfigsToDeviceInfos(self.readPCIMany(sorted(tree.keys()))), tree)
+
+    def getPCITopology(self, rescan=False):
+        '''
+        Brief:
+            Returns the PCITopology of the system. It's scanned once then reused until it's older than
+                topologyCache.maxAgeSeconds (or rescan is True). Config space data in it is as of the scan.
+        '''
+        return self.topologyCache.get(rescan)
+
+    def rescanPCITopology(self):
+        '''
+        Brief:
+            Rescans the system's PCI devices and returns the new PCITopology
+        '''
+        return self.topologyCache.get(rescan=True)
+
+    def getNVMeDevices(self, maxWorkers=None):
+        '''
+        Brief:
+            Returns a list of all NVMe devices on the system
+        '''
+        return [NVMeDevice(self, info.Address, configData=info.Config) for info in self.enumeratePCIDevices(NVME_CLASS_CODE, maxWorkers)]
@@ -0,0 +1,240 @@
+'''
+Brief:
+    File for batching many RWE operations into a single rw.exe launch
+
+Author(s):
+    Charles Machalow
+'''
+import logging
+import os
+import shutil
+import tempfile
+
+from pyrw.rwe_parser import verifyAddresses
+from pyrw.wait import monotonic
+
+logger = logging.getLogger(__name__)
+
+# cmd.exe can't take a command line longer than 8191 characters. Leave some room for the exe path and flags.
+MAX_SCRIPT_LENGTH = 7000
+
+class BatchOperation(object):
+    '''
+    Brief:
+        A single queued operation in a RWEBatch. The Result is available once the batch has executed.
+    '''
+    def __init__(self, kind, args, address=None, writeData=None):
+        '''
+        Brief:
+            Initializer for the operation. kind is one of the RWEBatch operation names, args are the arguments for it.
+                address is the memory address RWE should report back for verification (if any).
+                writeData is the data to LOAD (for write operations).
+        '''
+        self.kind = kind
+        self.args = args
+        self.address = address
+        self.writeData = writeData
+        self.fileName = None
+        self.executed = False
+        self._result = None
+
+    @property
+    def Result(self):
+        '''
+        Brief:
+            Returns the result of this operation. Raises if the batch hasn't been executed yet.
+        '''
+        if not self.executed:
+            raise RuntimeError("The batch containing this %s operation has not been executed yet" % self.kind)
+        return self._result
+
+    def getCommand(self, folder):
+        '''
+        Brief:
+            Returns the RWE command for this operation using a scratch file in the given folder
+        '''
+        path = os.path.join(folder, self.fileName)
+        if self.kind == 'readMemory':
+            return 'SAVE "%s" Memory 0x%X %d' % (path, self.args[0], self.args[1])
+        elif self.kind == 'writeMemory':
+            return 'LOAD "%s" Memory %d' % (path, self.args[0])
+        elif self.kind == 'readPCI':
+            return 'SAVE "%s" PCI %d %d %d' % ((path,) + tuple(self.args))
+        elif self.kind == 'writePCI':
+            return 'LOAD "%s" PCI %d %d %d' % ((path,) + tuple(self.args))
+
+        raise ValueError("Unknown operation kind: %s" % self.kind)
+
+    def __repr__(self):
+        return '<BatchOperation %s%s executed=%s>' % (self.kind, self.args, self.executed)
+
+class RWEBatch(object):
+    '''
+    Brief:
+        Queues many RWE operations and runs them with as few rw.exe launches as possible.
+            Can be used as a context manager: the batch executes when the with block exits cleanly.
+    '''
+    def __init__(self, rwe, maxScriptLength=MAX_SCRIPT_LENGTH, scratchDir=None):
+        '''
+        Brief:
+            Initializer for the batch. Takes a ReadWriteEverything instance.
+                Scratch files for the batch go in a new folder under scratchDir (or the system temp folder).
+        '''
+        self.rwe = rwe
+        self.scratchDir = scratchDir
+        self.maxScriptLength = maxScriptLength
+        self.operations = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if excType is None:
+            self.execute()
+
+    def _queue(self, op):
+        '''
+        Brief:
+            Adds the given operation to the queue and returns it
+        '''
+        op.fileName = 'op_%d.bin' % len(self.operations)
+        self.operations.append(op)
+        return op
+
+    def readMemory(self, byteOffset, numBytes):
+        '''
+        Brief:
+            Queues a read of raw memory. The Result will be the bytes read.
+        '''
+        return self._queue(BatchOperation('readMemory', (byteOffset, numBytes), address=byteOffset))
+
+    def writeMemory(self, byteOffset, data):
+        '''
+        Brief:
+            Queues a write of data to memory. The Result will be the ProcessOutput of the launch that ran it.
+        '''
+        return self._queue(BatchOperation('writeMemory', (byteOffset,), address=byteOffset, writeData=bytearray(data)))
+
+    def readPCI(self, bus, device, function):
+        '''
+        Brief:
+            Queues a read of PCI header (configuration space) data. The Result will be the bytes read.
+        '''
+        return self._queue(BatchOperation('readPCI', (bus, device, function)))
+
+    def writePCI(self, bus, device, function, data):
+        '''
+        Brief:
+            Queues a write of PCI (configuration space) data. The Result will be the ProcessOutput of the launch that ran it.
+        '''
+        return self._queue(BatchOperation('writePCI', (bus, device, function), writeData=bytearray(data)))
+
+    def getScripts(self, folder):
+        '''
+        Brief:
+            Compiles the pending operations to a list of (script, operations) tuples.
+                Each script is a ;-separated command string short enough for a single rw.exe launch.
+        '''
+        scripts = []
+        commands = []
+        ops = []
+        length = 0
+        for op in self.operations:
+            if op.executed:
+                continue
+
+            cmd = op.getCommand(folder)
+            if commands and length + len(cmd) + 1 > self.maxScriptLength:
+                scripts.append((';'.join(commands), ops))
+                commands = []
+                ops = []
+                length = 0
+
+            commands.append(cmd)
+            ops.append(op)
+            length += len(cmd) + 1
+
+        if commands:
+            scripts.append((';'.join(commands), ops))
+
+        return scripts
+
+    def _record(self, name, start, numBytes=0):
+        '''
+        Brief:
+            Records the time since start under the given name if the backend has instrumentation enabled
+        '''
+        if self.rwe.instrumentation is not None:
+            self.rwe.instrumentation.record(name, monotonic() - start, numBytes)
+
+    def prepare(self):
+        '''
+        Brief:
+            Creates the scratch folder for the batch, writes the data for queued writes to it and compiles the scripts.
+                Returns (folder, scripts) where scripts is from getScripts(). Call cleanup(folder) when done.
+        '''
+        start = monotonic()
+        folder = tempfile.mkdtemp(prefix='pyrw_batch_', dir=self.scratchDir)
+        numBytes = 0
+        for op in self.operations:
+            if op.writeData is not None and not op.executed:
+                with open(os.path.join(folder, op.fileName), 'wb') as f:
+                    f.write(op.writeData)
+                numBytes += len(op.writeData)
+        self._record('scratchFileWrite', start, numBytes)
+
+        scripts = self.getScripts(folder)
+        logger.debug("Executing batch of %d operations in %d launch(es)" % (len(self.operations), len(scripts)))
+        return folder, scripts
+
+    def cleanup(self, folder):
+        '''
+        Brief:
+            Deletes the scratch folder from prepare()
+        '''
+        shutil.rmtree(folder, ignore_errors=True)
+
+    def execute(self):
+        '''
+        Brief:
+            Runs all pending operations and fills in their Results. Returns the list of operations.
+        '''
+        folder, scripts = self.prepare()
+        try:
+            for script, ops in scripts:
+                self.complete(folder, ops, self.rwe.callRWECommand(script))
+        finally:
+            self.cleanup(folder)
+
+        return self.operations
+
+    def complete(self, folder, ops, ret):
+        '''
+        Brief:
+            Verifies the output of a launch and fills in the Results of the operations it ran.
+                Config cache entries for any writePCI in the launch are invalidated first (even if the launch failed).
+        '''
+        cache = getattr(self.rwe, 'configCache', None)
+        if cache is not None:
+            for op in ops:
+                if op.kind == 'writePCI':
+                    cache.invalidate(op.args)
+
+        if any(op.kind in ('readMemory', 'readPCI') for op in ops):
+            assert ret.ReturnCode == 0, "Didn't return 0"
+
+        start = monotonic()
+        verifyAddresses([op.address for op in ops if op.address is not None], ret.Output)
+        self._record('verifyAddresses', start)
+
+        start = monotonic()
+        numBytes = 0
+        for op in ops:
+            if op.writeData is None:
+                with open(os.path.join(folder, op.fileName), 'rb') as f:
+                    op._result = f.read()
+                numBytes += len(op._result)
+            else:
+                op._result = ret
+            op.executed = True
+        self._record('scratchFileRead', start, numBytes)
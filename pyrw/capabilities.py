@@ -0,0 +1,218 @@
+'''
+Brief:
+    File for walking PCI capability lists (standard and PCIe extended) and decoding common capabilities
+
+Author(s):
+    Charles Machalow
+'''
+import collections
+import logging
+import struct
+
+logger = logging.getLogger(__name__)
+
+PCI_HEADER_SIZE = 256
+PCI_EXTENDED_CONFIG_SIZE = 4096
+
+# standard capability IDs
+CAP_ID_POWER_MANAGEMENT = 0x01
+CAP_ID_MSI = 0x05
+CAP_ID_VENDOR_SPECIFIC = 0x09
+CAP_ID_PCIE = 0x10
+CAP_ID_MSIX = 0x11
+
+# extended capability IDs
+EXT_CAP_ID_AER = 0x0001
+EXT_CAP_ID_DEVICE_SERIAL_NUMBER = 0x0003
+EXT_CAP_ID_LTR = 0x0018
+EXT_CAP_ID_SECONDARY_PCIE = 0x0019
+EXT_CAP_ID_L1_PM_SUBSTATES = 0x001E
+
+# link speed encoding -> GT/s
+PCIE_LINK_SPEEDS = {1: 2.5, 2: 5.0, 3: 8.0, 4: 16.0, 5: 32.0, 6: 64.0}
+
+# offsets within the PCIe capability
+PCIE_DEVICE_STATUS_OFFSET = 0x0A
+PCIE_LINK_CAPABILITIES_OFFSET = 0x0C
+PCIE_LINK_STATUS_OFFSET = 0x12
+PCIE_CAPABILITY_SIZE = 0x3C
+
+MSI_CAPABILITY_SIZE = 0x18
+MSIX_CAPABILITY_SIZE = 0x0C
+
+Capability = collections.namedtuple("Capability", ['Id', 'Offset', 'Version'])
+PCIeLinkStatus = collections.namedtuple("PCIeLinkStatus", ['Speed', 'Width', 'MaxSpeed', 'MaxWidth', 'Training', 'DataLinkLayerActive'])
+PCIeDeviceStatus = collections.namedtuple("PCIeDeviceStatus", ['CorrectableError', 'NonFatalError', 'FatalError', 'UnsupportedRequest', 'AuxPower', 'TransactionsPending'])
+PCIeCapability = collections.namedtuple("PCIeCapability", ['Version', 'DevicePortType', 'MaxPayloadSupported', 'MaxPayload', 'MaxReadRequest', 'DeviceStatus', 'LinkStatus'])
+MSICapability = collections.namedtuple("MSICapability", ['Enabled', 'VectorsCapable', 'VectorsEnabled', 'Is64Bit', 'PerVectorMasking', 'Address', 'Data'])
+MSIXCapability = collections.namedtuple("MSIXCapability", ['Enabled', 'FunctionMask', 'TableSize', 'TableBIR', 'TableOffset', 'PBABIR', 'PBAOffset'])
+
+class CapabilityIndex(object):
+    '''
+    Brief:
+        Offsets of every standard and extended capability in a device's config space, found with one walk of already-read data.
+            Pass the full 4 KiB extended config space to find extended capabilities (only standard ones are in the first 256 bytes).
+            If only the header is given (like rw.exe without ECAM reads), hasExtendedConfig is False and no extended capabilities are listed.
+    '''
+    def __init__(self, config):
+        '''
+        Brief:
+            Initializer for the index. Walks the capability lists in the given config space data.
+        '''
+        # a bytearray so indexing gives ints on Python 2 as well
+        config = bytearray(config)
+        self.configSize = len(config)
+        self.hasExtendedConfig = self.configSize > PCI_HEADER_SIZE
+        self.capabilities = _walkCapabilities(config)
+        if self.hasExtendedConfig:
+            self.extendedCapabilities = _walkExtendedCapabilities(config)
+        else:
+            logger.debug("Only 0x%X bytes of config space were read; not walking extended capabilities" % self.configSize)
+            self.extendedCapabilities = []
+
+        # first occurrence of each ID (a few capabilities, like vendor specific ones, can appear more than once)
+        self.byId = {}
+        for cap in self.capabilities:
+            self.byId.setdefault(cap.Id, cap.Offset)
+        self.byExtendedId = {}
+        for cap in self.extendedCapabilities:
+            self.byExtendedId.setdefault(cap.Id, cap.Offset)
+
+    def getOffset(self, capId):
+        '''
+        Brief:
+            Returns the offset of the given standard capability or None
+        '''
+        return self.byId.get(capId)
+
+    def getExtendedOffset(self, extCapId):
+        '''
+        Brief:
+            Returns the offset of the given extended capability or None
+        '''
+        return self.byExtendedId.get(extCapId)
+
+    def __repr__(self):
+        return '<CapabilityIndex capabilities=%s extended=%s>' % (
+            ['0x%02X@0x%X' % (c.Id, c.Offset) for c in self.capabilities],
+            ['0x%04X@0x%X' % (c.Id, c.Offset) for c in self.extendedCapabilities])
+
+def _walkCapabilities(config):
+    '''
+    Brief:
+        Returns a list of Capability for the standard capability list (empty if the device doesn't have one)
+    '''
+    ret = []
+    if len(config) < 0x40 or not struct.unpack_from('<H', config, 0x06)[0] & 0x10: # Status.CapabilitiesList
+        return ret
+
+    offset = config[0x34] & 0xFC
+    seen = set()
+    while offset >= 0x40 and offset + 2 <= min(len(config), PCI_HEADER_SIZE) and offset not in seen:
+        seen.add(offset)
+        ret.append(Capability(config[offset], offset, None))
+        offset = config[offset + 1] & 0xFC
+    return ret
+
+def _walkExtendedCapabilities(config):
+    '''
+    Brief:
+        Returns a list of Capability for the extended capability list (which starts at 0x100)
+    '''
+    ret = []
+    offset = PCI_HEADER_SIZE
+    seen = set()
+    while offset >= PCI_HEADER_SIZE and offset + 4 <= len(config) and offset not in seen:
+        seen.add(offset)
+        header = struct.unpack_from('<I', config, offset)[0]
+        if header in (0, 0xFFFFFFFF):
+            break
+        ret.append(Capability(header & 0xFFFF, offset, (header >> 16) & 0xF))
+        offset = (header >> 20) & 0xFFC
+    return ret
+
+def decodePCIeDeviceStatus(data):
+    '''
+    Brief:
+        Decodes the 2 byte PCIe Device Status register
+    '''
+    status = struct.unpack_from('<H', data)[0]
+    return PCIeDeviceStatus(
+        CorrectableError=bool(status & 0x1),
+        NonFatalError=bool(status & 0x2),
+        FatalError=bool(status & 0x4),
+        UnsupportedRequest=bool(status & 0x8),
+        AuxPower=bool(status & 0x10),
+        TransactionsPending=bool(status & 0x20),
+    )
+
+def decodePCIeLinkStatus(data):
+    '''
+    Brief:
+        Decodes PCIe Link Capabilities through Link Status (8 bytes starting at capability offset 0x0C).
+            Speeds are in GT/s (None for unknown encodings).
+    '''
+    linkCapabilities, _, linkStatus = struct.unpack_from('<IHH', data)
+    return PCIeLinkStatus(
+        Speed=PCIE_LINK_SPEEDS.get(linkStatus & 0xF),
+        Width=(linkStatus >> 4) & 0x3F,
+        MaxSpeed=PCIE_LINK_SPEEDS.get(linkCapabilities & 0xF),
+        MaxWidth=(linkCapabilities >> 4) & 0x3F,
+        Training=bool(linkStatus & 0x800),
+        DataLinkLayerActive=bool(linkStatus & 0x2000),
+    )
+
+def decodePCIeCapability(data):
+    '''
+    Brief:
+        Decodes a PCIe capability (data starts at the capability's offset). Payload/read request sizes are in bytes.
+    '''
+    capabilities, deviceCapabilities, deviceControl = struct.unpack_from('<2xHIH', data)
+    return PCIeCapability(
+        Version=capabilities & 0xF,
+        DevicePortType=(capabilities >> 4) & 0xF,
+        MaxPayloadSupported=128 << (deviceCapabilities & 0x7),
+        MaxPayload=128 << ((deviceControl >> 5) & 0x7),
+        MaxReadRequest=128 << ((deviceControl >> 12) & 0x7),
+        DeviceStatus=decodePCIeDeviceStatus(data[PCIE_DEVICE_STATUS_OFFSET:]),
+        LinkStatus=decodePCIeLinkStatus(data[PCIE_LINK_CAPABILITIES_OFFSET:]),
+    )
+
+def decodeMSICapability(data):
+    '''
+    Brief:
+        Decodes an MSI capability (data starts at the capability's offset)
+    '''
+    control = struct.unpack_from('<H', data, 2)[0]
+    is64Bit = bool(control & 0x80)
+    if is64Bit:
+        addressLow, addressHigh, messageData = struct.unpack_from('<IIH', data, 4)
+        address = (addressHigh << 32) | addressLow
+    else:
+        address, messageData = struct.unpack_from('<IH', data, 4)
+
+    return MSICapability(
+        Enabled=bool(control & 0x1),
+        VectorsCapable=1 << ((control >> 1) & 0x7),
+        VectorsEnabled=1 << ((control >> 4) & 0x7),
+        Is64Bit=is64Bit,
+        PerVectorMasking=bool(control & 0x100),
+        Address=address,
+        Data=messageData,
+    )
+
+def decodeMSIXCapability(data):
+    '''
+    Brief:
+        Decodes an MSI-X capability (data starts at the capability's offset)
+    '''
+    control, table, pba = struct.unpack_from('<2xHII', data)
+    return MSIXCapability(
+        Enabled=bool(control & 0x8000),
+        FunctionMask=bool(control & 0x4000),
+        TableSize=(control & 0x7FF) + 1,
+        TableBIR=table & 0x7,
+        TableOffset=table & ~0x7,
+        PBABIR=pba & 0x7,
+        PBAOffset=pba & ~0x7,
+    )
@@ -0,0 +1,165 @@
+'''
+Brief:
+    File for write combining: memory writes are queued and sent to the backend together, in program order
+
+Author(s):
+    Charles Machalow
+'''
+import collections
+import threading
+
+from pyrw.wait import monotonic
+
+# number of FlushStats kept in WriteCombiningQueue.history
+DEFAULT_FLUSH_HISTORY = 1024
+
+# the queue is flushed once this many bytes are pending (so streaming a large file through it doesn't buffer all of it)
+DEFAULT_MAX_PENDING_BYTES = 4 * 1024 * 1024
+
+FlushStats = collections.namedtuple("FlushStats", ['Writes', 'Extents', 'Bytes', 'Elapsed'])
+
+class WriteCombiningQueue(object):
+    '''
+    Brief:
+        Queue of pending memory writes for a backend (see Backend.enableWriteCombining()).
+            Every queued write reaches the backend as its own access, in program order (MMIO writes can have side effects,
+                so two writes to a register are never collapsed and neighboring registers are never written as one wider access).
+            A write that overlaps a pending one flushes the queue first, so the earlier write has fully gone out.
+            With mergeAdjacent, a write that starts exactly where the last queued write ends is appended to it (for plain memory).
+            The queue is flushed (with one writeMemoryMany call) at barriers: an explicit flush, any other backend operation,
+                and reads (any read if flushOnAnyRead, since MMIO reads can depend on earlier writes' side effects, otherwise only
+                reads that overlap a pending write). It is also flushed once maxPendingBytes are queued.
+            If a flush fails, the writes that didn't go out stay queued (in order) for the next flush; see discard().
+    '''
+    def __init__(self, writeManyFunc, flushOnAnyRead=True, mergeAdjacent=False, historySize=DEFAULT_FLUSH_HISTORY, maxPendingBytes=DEFAULT_MAX_PENDING_BYTES):
+        '''
+        Brief:
+            Initializer for the queue. writeManyFunc(writes) writes a list of (byteOffset, data) in order and returns a list of ProcessOutputs.
+        '''
+        self.writeManyFunc = writeManyFunc
+        self.flushOnAnyRead = flushOnAnyRead
+        self.mergeAdjacent = mergeAdjacent
+        self.maxPendingBytes = maxPendingBytes
+        self.history = collections.deque(maxlen=historySize)
+        self.totalWrites = 0
+        self.totalExtents = 0
+        self.flushes = 0
+        self._pending = []
+        self._pendingWrites = 0
+        self._pendingBytes = 0
+        self._lock = threading.Lock()
+        self._flushLock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def queue(self, byteOffset, data):
+        '''
+        Brief:
+            Queues a write. Flushes first if it overlaps a pending write.
+                With mergeAdjacent, it is appended to the last queued write if it starts right where that one ends.
+                Flushes afterwards if maxPendingBytes are now pending.
+        '''
+        data = bytearray(data)
+        while True:
+            # the overlap check and the append happen under one lock, so no write can be queued in between
+            with self._lock:
+                if not self._overlaps(byteOffset, len(data)):
+                    self._append(byteOffset, data)
+                    full = self.maxPendingBytes is not None and self._pendingBytes >= self.maxPendingBytes
+                    break
+            self.flush()
+
+        if full:
+            self.flush()
+
+    def _append(self, byteOffset, data):
+        self._pendingWrites += 1
+        self._pendingBytes += len(data)
+        if self.mergeAdjacent and self._pending:
+            tailStart, tailData = self._pending[-1]
+            if byteOffset == tailStart + len(tailData):
+                tailData += data
+                return
+
+        self._pending.append((byteOffset, data))
+
+    def _overlaps(self, byteOffset, numBytes):
+        return any(start < byteOffset + numBytes and byteOffset < start + len(data) for start, data in self._pending)
+
+    def overlaps(self, byteOffset, numBytes):
+        '''
+        Brief:
+            Returns True if any pending write overlaps the given range
+        '''
+        with self._lock:
+            return self._overlaps(byteOffset, numBytes)
+
+    def needsFlush(self, byteOffset=None, numBytes=None):
+        '''
+        Brief:
+            Returns True if there are pending writes that must go out before an operation.
+                For reads, give the range being read (only matters if flushOnAnyRead is False).
+        '''
+        if not self._pending:
+            return False
+        if self.flushOnAnyRead or byteOffset is None:
+            return True
+        return self.overlaps(byteOffset, numBytes)
+
+    def flush(self):
+        '''
+        Brief:
+            Sends all pending writes to the backend. Returns FlushStats (or None if nothing was pending).
+                Raises RuntimeError if any write failed. The failed write and everything queued after it stay queued
+                    (ahead of writes queued since), as do all of them if the backend raised; the error is re-raised.
+        '''
+        with self._flushLock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+                numWrites, self._pendingWrites = self._pendingWrites, 0
+                self._pendingBytes = 0
+
+            if not pending:
+                return None
+
+            start = monotonic()
+            try:
+                rets = self.writeManyFunc([(offset, bytes(data)) for offset, data in pending])
+            except Exception:
+                self._requeue(pending, numWrites)
+                raise
+
+            for idx, ((offset, data), ret) in enumerate(zip(pending, rets)):
+                if ret.ReturnCode != 0:
+                    self._requeue(pending[idx:], len(pending) - idx)
+                    raise RuntimeError("Failed to write 0x%X bytes at 0x%X (combined from queued writes)" % (len(data), offset))
+
+            stats = FlushStats(Writes=numWrites, Extents=len(pending), Bytes=sum(len(data) for _, data in pending), Elapsed=monotonic() - start)
+            self.history.append(stats)
+            self.flushes += 1
+            self.totalWrites += stats.Writes
+            self.totalExtents += stats.Extents
+            return stats
+
+    def _requeue(self, writes, numWrites):
+        '''
+        Brief:
+            Puts writes that didn't go out back at the front of the queue (they were queued before anything pending now)
+        '''
+        with self._lock:
+            self._pending[:0] = writes
+            self._pendingWrites += numWrites
+            self._pendingBytes += sum(len(data) for _, data in writes)
+
+    def discard(self):
+        '''
+        Brief:
+            Drops every pending write without sending it (e.g. after a failed flush). Returns the list of (byteOffset, data) dropped.
+        '''
+        with self._flushLock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+                self._pendingWrites = 0
+                self._pendingBytes = 0
+        return [(offset, bytes(data)) for offset, data in pending]
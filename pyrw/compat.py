@@ -0,0 +1,28 @@
+'''
+Brief:
+    File for small Python 2/3 compatibility helpers
+
+Author(s):
+    Charles Machalow
+'''
+import os
+
+def replaceFile(src, dst):
+    '''
+    Brief:
+        Renames src over dst, replacing dst if it exists.
+            Uses os.replace where it exists (atomic). Python 2 doesn't have it, so there dst is removed first
+                (os.rename won't overwrite on Windows); a reader can briefly see no file, but never a partial one.
+    '''
+    replace = getattr(os, 'replace', None)
+    if replace is not None:
+        replace(src, dst)
+        return
+
+    try:
+        os.rename(src, dst)
+    except OSError:
+        if not os.path.exists(dst):
+            raise
+        os.remove(dst)
+        os.rename(src, dst)
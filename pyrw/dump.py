@@ -0,0 +1,198 @@
+'''
+Brief:
+    File for sharded memory dumps: ranges are split into blocks that are read in parallel into a preallocated,
+        memory mapped output file, with a manifest of per-block hashes for skipping unchanged blocks and comparing dumps
+
+Author(s):
+    Charles Machalow
+'''
+import collections
+import hashlib
+import json
+import logging
+import mmap
+import multiprocessing
+import os
+
+from pyrw.compat import replaceFile
+from pyrw.wait import monotonic
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BLOCK_SIZE = 4 * 1024 * 1024
+DEFAULT_MAX_WORKERS = min(8, multiprocessing.cpu_count())
+DEFAULT_HASH = 'sha1'
+MANIFEST_VERSION = 1
+MANIFEST_SUFFIX = '.manifest.json'
+
+DumpBlock = collections.namedtuple("DumpBlock", ['Address', 'FileOffset', 'Size', 'Hash'])
+DumpResult = collections.namedtuple("DumpResult", ['Manifest', 'BlocksRead', 'BlocksWritten', 'BlocksSkipped', 'FailedBlocks', 'Bytes', 'Elapsed'])
+
+def getManifestPath(path):
+    '''
+    Brief:
+        Returns the path of the manifest for the given dump file
+    '''
+    return path + MANIFEST_SUFFIX
+
+def toRanges(ranges):
+    '''
+    Brief:
+        Normalizes a (byteOffset, numBytes) pair, a list of them or a list of BarResources (from SysfsBackend.getBarResources)
+            to a list of (byteOffset, numBytes)
+    '''
+    if isinstance(ranges, tuple) and len(ranges) == 2 and isinstance(ranges[0], int):
+        ranges = [ranges]
+
+    ret = []
+    for r in ranges:
+        if hasattr(r, 'Start') and hasattr(r, 'End'):
+            ret.append((r.Start, r.End - r.Start + 1))
+        else:
+            ret.append((r[0], r[1]))
+    return ret
+
+class DumpManifest(object):
+    '''
+    Brief:
+        The layout of a dump file (which memory ranges are where, split into blocks) and a hash of each block
+    '''
+    def __init__(self, ranges, blockSize=DEFAULT_BLOCK_SIZE, hashName=DEFAULT_HASH, blocks=None):
+        '''
+        Brief:
+            Initializer for the manifest. The ranges are laid out back to back in the file, in order.
+                blocks (a list of DumpBlock) is computed (with no hashes yet) if not given.
+        '''
+        self.ranges = toRanges(ranges)
+        self.blockSize = blockSize
+        self.hashName = hashName
+        if blocks is None:
+            blocks = []
+            fileOffset = 0
+            for byteOffset, numBytes in self.ranges:
+                for offset in range(0, numBytes, blockSize):
+                    size = min(blockSize, numBytes - offset)
+                    blocks.append(DumpBlock(byteOffset + offset, fileOffset + offset, size, None))
+                fileOffset += numBytes
+        self.blocks = blocks
+
+    @property
+    def totalSize(self):
+        return sum(numBytes for _, numBytes in self.ranges)
+
+    def hasSameLayout(self, other):
+        '''
+        Brief:
+            Returns True if the other manifest covers the same ranges with the same blocks and hash
+        '''
+        return other is not None and self.ranges == other.ranges and self.blockSize == other.blockSize and self.hashName == other.hashName
+
+    def toDict(self):
+        return {
+            'version': MANIFEST_VERSION,
+            'blockSize': self.blockSize,
+            'hash': self.hashName,
+            'ranges': [list(r) for r in self.ranges],
+            'blocks': [list(b) for b in self.blocks],
+        }
+
+    @classmethod
+    def fromDict(cls, d):
+        if d.get('version') != MANIFEST_VERSION:
+            raise ValueError("Unsupported dump manifest version: %s" % d.get('version'))
+        return cls([tuple(r) for r in d['ranges']], d['blockSize'], d['hash'], [DumpBlock(*b) for b in d['blocks']])
+
+    def save(self, path):
+        '''
+        Brief:
+            Writes the manifest as JSON (to a temp file that is then renamed over path, so path is never partially written)
+        '''
+        tmpPath = path + '.tmp'
+        with open(tmpPath, 'w') as f:
+            json.dump(self.toDict(), f)
+        replaceFile(tmpPath, path)
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Brief:
+            Reads a manifest from JSON. Returns None if there isn't one (or it can't be read).
+        '''
+        try:
+            with open(path, 'r') as f:
+                return cls.fromDict(json.load(f))
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return None
+
+def compareManifests(a, b):
+    '''
+    Brief:
+        Returns a list of (address, size) blocks whose hashes differ between the two manifests (no dump data is read).
+            Blocks that failed to dump (no hash) in either manifest count as different.
+            Raises ValueError if they don't have the same layout.
+    '''
+    if not a.hasSameLayout(b):
+        raise ValueError("Can only compare dumps of the same ranges, block size and hash")
+    return [(x.Address, x.Size) for x, y in zip(a.blocks, b.blocks) if x.Hash is None or x.Hash != y.Hash]
+
+def shardedDump(rwe, ranges, path, blockSize=DEFAULT_BLOCK_SIZE, maxWorkers=DEFAULT_MAX_WORKERS, hashName=DEFAULT_HASH):
+    '''
+    Brief:
+        Dumps the given memory ranges to path by reading blocks in parallel (at most maxWorkers reads, so rw.exe launches,
+            at once) into a preallocated memory mapped file. A manifest with each block's hash is written next to it.
+            If path already holds a dump of the same layout, blocks whose hash didn't change aren't rewritten.
+            The old manifest is removed before any block is written, so an interrupted dump never leaves a manifest that
+                doesn't match the file. Blocks where readMemory returns the wrong number of bytes aren't written; they are
+                listed in the result's FailedBlocks and have no hash in the manifest. Returns a DumpResult.
+    '''
+    start = monotonic()
+    manifest = DumpManifest(ranges, blockSize, hashName)
+    manifestPath = getManifestPath(path)
+    previous = DumpManifest.load(manifestPath)
+    if not (previous is not None and manifest.hasSameLayout(previous) and os.path.isfile(path) and os.path.getsize(path) == manifest.totalSize):
+        previous = None
+    if os.path.exists(manifestPath):
+        os.remove(manifestPath)
+
+    with open(path, 'r+b' if previous is not None else 'w+b') as f:
+        f.truncate(manifest.totalSize)
+        if manifest.totalSize == 0:
+            manifest.save(manifestPath)
+            return DumpResult(manifest, 0, 0, 0, [], 0, monotonic() - start)
+
+        output = mmap.mmap(f.fileno(), manifest.totalSize)
+        try:
+            def dumpBlock(idx):
+                block = manifest.blocks[idx]
+                data = rwe.readMemory(block.Address, block.Size)
+                if len(data) != block.Size:
+                    logger.warning("Read 0x%X bytes instead of 0x%X at 0x%X; not dumping that block" % (len(data), block.Size, block.Address))
+                    return block, None
+
+                digest = hashlib.new(hashName, data).hexdigest()
+                written = previous is None or previous.blocks[idx].Hash != digest
+                if written:
+                    output[block.FileOffset:block.FileOffset + block.Size] = data
+                return block._replace(Hash=digest), written
+
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+                results = list(executor.map(dumpBlock, range(len(manifest.blocks))))
+            output.flush()
+        finally:
+            output.close()
+
+    manifest.blocks = [block for block, _ in results]
+    manifest.save(manifestPath)
+
+    written = sum(1 for _, w in results if w)
+    failed = [block for block, w in results if w is None]
+    return DumpResult(
+        Manifest=manifest,
+        BlocksRead=len(results),
+        BlocksWritten=written,
+        BlocksSkipped=len(results) - written - len(failed),
+        FailedBlocks=failed,
+        Bytes=manifest.totalSize,
+        Elapsed=monotonic() - start,
+    )
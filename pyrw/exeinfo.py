@@ -0,0 +1,122 @@
+'''
+Brief:
+    File for facts about RW-Everything executables (architecture, version, validity) and an on-disk cache of them.
+        Cache entries are keyed by exe path and are only used while the exe's size and mtime still match.
+
+Author(s):
+    Charles Machalow
+'''
+import json
+import logging
+import os
+import struct
+import tempfile
+import threading
+
+from pyrw.compat import replaceFile
+
+logger = logging.getLogger(__name__)
+
+CACHE_FILE_NAME = 'exe_cache.json'
+
+# PE header machine types
+PE_MACHINE_TYPES = {
+    0x014C: 'x86',
+    0x8664: 'x64',
+    0xAA64: 'arm64',
+}
+
+_cacheLock = threading.Lock()
+
+def getCachePath():
+    '''
+    Brief:
+        Returns the path of the cache file. PYRW_CACHE_FILE overrides the default (under LOCALAPPDATA or ~/.cache).
+    '''
+    path = os.environ.get('PYRW_CACHE_FILE')
+    if path:
+        return path
+
+    base = os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'pyrw', CACHE_FILE_NAME)
+
+def getExeArchitecture(exePath):
+    '''
+    Brief:
+        Returns 'x86', 'x64' or 'arm64' by reading the exe's PE header (no subprocess needed)
+    '''
+    with open(exePath, 'rb') as f:
+        f.seek(0x3C)
+        peOffset = struct.unpack('<I', f.read(4))[0]
+        f.seek(peOffset)
+        signature, machine = struct.unpack('<4sH', f.read(6))
+
+    if signature != b'PE\x00\x00':
+        raise EnvironmentError("%s is not a PE executable" % exePath)
+
+    try:
+        return PE_MACHINE_TYPES[machine]
+    except KeyError:
+        raise EnvironmentError("%s has an unknown PE machine type: 0x%X" % (exePath, machine))
+
+def _getCacheKey(exePath):
+    '''
+    Brief:
+        Returns (key, size, mtime) for the given exe
+    '''
+    stat = os.stat(exePath)
+    return os.path.normcase(os.path.abspath(exePath)), stat.st_size, stat.st_mtime
+
+def _loadCache():
+    try:
+        with open(getCachePath(), 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+def _saveCache(cache):
+    path = getCachePath()
+    try:
+        folder = os.path.dirname(path)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+        # write then rename so a concurrent reader never sees a partial file
+        fd, tmpPath = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(cache, f, indent=1)
+        replaceFile(tmpPath, path)
+    except (IOError, OSError) as ex:
+        logger.debug("Unable to save the exe cache to %s: %s" % (path, ex))
+
+def getCachedExeInfo(exePath):
+    '''
+    Brief:
+        Returns the cached dict of facts for the given exe, or an empty dict if there is none (or the exe changed)
+    '''
+    try:
+        key, size, mtime = _getCacheKey(exePath)
+    except (IOError, OSError):
+        return {}
+
+    with _cacheLock:
+        entry = _loadCache().get(key)
+
+    if entry is None or entry.get('size') != size or entry.get('mtime') != mtime:
+        return {}
+    return entry.get('info', {})
+
+def updateCachedExeInfo(exePath, **info):
+    '''
+    Brief:
+        Adds the given facts to the cache entry for the given exe
+    '''
+    key, size, mtime = _getCacheKey(exePath)
+    with _cacheLock:
+        cache = _loadCache()
+        entry = cache.get(key)
+        if entry is None or entry.get('size') != size or entry.get('mtime') != mtime:
+            entry = {'size': size, 'mtime': mtime, 'info': {}}
+        entry['info'].update(info)
+        cache[key] = entry
+        _saveCache(cache)
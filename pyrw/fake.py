@@ -0,0 +1,240 @@
+'''
+Brief:
+    File for a fake rw.exe: a simulated system (physical memory + PCI topology) and a ReadWriteEverything that talks to it.
+        Lets pyrw run (and be benchmarked) without real hardware, Windows or admin rights.
+
+Author(s):
+    Charles Machalow
+'''
+import re
+import shlex
+import struct
+import threading
+import time
+
+from pyrw.backend import Backend, ProcessOutput
+from pyrw.nvme import NVME_CLASS_CODE, NVMeControllerRegisters
+from pyrw.rwe import ReadWriteEverything
+from pyrw.rwe_parser import PCILocation
+from pyrw.wait import monotonic
+
+PAGE_SIZE = 64 * 1024
+PCI_HEADER_SIZE = 256
+PCI_BRIDGE_CLASS_CODE = 0x060400
+RWE_COMMAND_REGEX = r'/Command="(.*)"$'
+
+class SimulatedSystem(object):
+    '''
+    Brief:
+        Sparse simulated physical memory and PCI topology that understands the RWE commands pyrw uses:
+            SAVE/LOAD (Memory and PCI), PCITREE, COUT and RWEXIT
+    '''
+    def __init__(self):
+        '''
+        Brief:
+            Initializer for the system. Starts with zeroed memory and no PCI devices.
+        '''
+        self.pages = {}
+        self.devices = {}
+        self.lock = threading.Lock()
+
+    def readMemory(self, address, numBytes):
+        '''
+        Brief:
+            Reads simulated physical memory
+        '''
+        ret = bytearray()
+        while numBytes:
+            page, offset = divmod(address, PAGE_SIZE)
+            size = min(numBytes, PAGE_SIZE - offset)
+            data = self.pages.get(page)
+            ret += data[offset:offset + size] if data is not None else bytearray(size)
+            address += size
+            numBytes -= size
+        return bytes(ret)
+
+    def writeMemory(self, address, data):
+        '''
+        Brief:
+            Writes simulated physical memory
+        '''
+        data = bytearray(data)
+        idx = 0
+        while idx < len(data):
+            page, offset = divmod(address + idx, PAGE_SIZE)
+            size = min(len(data) - idx, PAGE_SIZE - offset)
+            self.pages.setdefault(page, bytearray(PAGE_SIZE))[offset:offset + size] = data[idx:idx + size]
+            idx += size
+
+    def addDevice(self, location, description, config):
+        '''
+        Brief:
+            Adds a PCI device with the given (up to 256 byte) config space
+        '''
+        config = bytearray(config)
+        self.devices[PCILocation(*location)] = [description, config + bytearray(PCI_HEADER_SIZE - len(config))]
+
+    def addGenericDevice(self, location, vendorId=0x8086, deviceId=0x1234, classCode=0x020000, description='Simulated Device'):
+        '''
+        Brief:
+            Adds a PCI device with just IDs and a class code
+        '''
+        config = bytearray(PCI_HEADER_SIZE)
+        struct.pack_into('<HH', config, 0, vendorId, deviceId)
+        config[0x09:0x0C] = struct.pack('<I', classCode)[:3]
+        self.addDevice(location, description, config)
+
+    def addBridgeDevice(self, location, secondaryBus, subordinateBus=None, vendorId=0x8086, deviceId=0x1901, description='Simulated PCI Bridge'):
+        '''
+        Brief:
+            Adds a PCI-to-PCI bridge (header type 1) forwarding to the given bus range
+        '''
+        config = bytearray(PCI_HEADER_SIZE)
+        struct.pack_into('<HH', config, 0, vendorId, deviceId)
+        config[0x09:0x0C] = struct.pack('<I', PCI_BRIDGE_CLASS_CODE)[:3]
+        config[0x0E] = 0x01
+        config[0x18:0x1B] = bytearray([location[0], secondaryBus, secondaryBus if subordinateBus is None else subordinateBus])
+        self.addDevice(location, description, config)
+
+    def addNVMeDevice(self, location, bar0, adminQueueEntries=32, vendorId=0x144D, deviceId=0xA808, description='Simulated NVMe Controller'):
+        '''
+        Brief:
+            Adds an NVMe device with BAR0 at the given address, enabled/ready controller registers and admin queues right after them
+        '''
+        config = bytearray(PCI_HEADER_SIZE)
+        struct.pack_into('<HH', config, 0, vendorId, deviceId)
+        config[0x09:0x0C] = struct.pack('<I', NVME_CLASS_CODE)[:3]
+        struct.pack_into('<I', config, 0x10, bar0 | 0x4)
+        self.addDevice(location, description, config)
+
+        registers = NVMeControllerRegisters()
+        registers.CAP = (20 << 24) | 0xFFF # 10 second timeout, 4096 entries
+        registers.VS = 0x10400
+        registers.CC = 0x460001
+        registers.CSTS = 1
+        registers.AQA = ((adminQueueEntries - 1) << 16) | (adminQueueEntries - 1)
+        registers.ASQ = bar0 + 0x4000
+        registers.ACQ = bar0 + 0x8000
+        self.writeMemory(bar0, bytes(bytearray(registers)))
+
+    def _readPCI(self, location):
+        try:
+            return self.devices[location][1]
+        except KeyError:
+            raise ValueError("No device at %s" % str(location))
+
+    def _applyRegisterSideEffects(self, address):
+        '''
+        Brief:
+            Makes NVMe CSTS.RDY follow CC.EN right away for any device whose CC was just written
+        '''
+        for location, (description, config) in self.devices.items():
+            if config[0x09:0x0C] != bytearray(struct.pack('<I', NVME_CLASS_CODE)[:3]):
+                continue
+
+            bar0 = struct.unpack_from('<I', config, 0x10)[0] & ~0xF
+            ccAddr = bar0 + NVMeControllerRegisters.CC.offset
+            if ccAddr <= address < ccAddr + 4:
+                cc = struct.unpack('<I', self.readMemory(ccAddr, 4))[0]
+                cstsAddr = bar0 + NVMeControllerRegisters.CSTS.offset
+                csts = struct.unpack('<I', self.readMemory(cstsAddr, 4))[0]
+                self.writeMemory(cstsAddr, struct.pack('<I', (csts & ~1) | (cc & 1)))
+
+    def runCommand(self, command):
+        '''
+        Brief:
+            Runs a single RWE command. Returns the output text.
+        '''
+        args = shlex.split(command, posix=True)
+        if not args:
+            return ''
+
+        verb = args[0].upper()
+        if verb == 'COUT':
+            return ' '.join(args[1:])
+        elif verb == 'RWEXIT':
+            return 'RW Exit'
+        elif verb == 'PCITREE':
+            return '\n'.join('Bus %02X, Device %02X, Function %02X - %s' % (l.Bus, l.Device, l.Function, self.devices[l][0]) for l in sorted(self.devices))
+        elif verb in ('SAVE', 'LOAD') and len(args) >= 4:
+            path, kind = args[1], args[2].upper()
+            numbers = [int(a, 0) for a in args[3:]]
+            if kind == 'MEMORY':
+                if verb == 'SAVE':
+                    with open(path, 'wb') as f:
+                        f.write(self.readMemory(numbers[0], numbers[1]))
+                    return 'Save Memory Address=0x%X, Length=0x%X' % (numbers[0], numbers[1])
+
+                with open(path, 'rb') as f:
+                    data = f.read()
+                self.writeMemory(numbers[0], data)
+                self._applyRegisterSideEffects(numbers[0])
+                return 'Load Memory Address=0x%X, Length=0x%X' % (numbers[0], len(data))
+            elif kind == 'PCI':
+                config = self._readPCI(PCILocation(*numbers[:3]))
+                if verb == 'SAVE':
+                    with open(path, 'wb') as f:
+                        f.write(config)
+                    return 'Save PCI Bus %02X, Device %02X, Function %02X' % tuple(numbers[:3])
+
+                with open(path, 'rb') as f:
+                    data = f.read(PCI_HEADER_SIZE)
+                config[:len(data)] = data
+                return 'Load PCI Bus %02X, Device %02X, Function %02X' % tuple(numbers[:3])
+
+        raise ValueError("Unknown command: %s" % command)
+
+    def runScript(self, script):
+        '''
+        Brief:
+            Runs a ;-separated RWE command script. Returns (output, returnCode).
+        '''
+        output = []
+        with self.lock:
+            for command in script.split(';'):
+                try:
+                    output.append(self.runCommand(command.strip()))
+                except (ValueError, IndexError, IOError) as ex:
+                    output.append('Error: %s' % ex)
+                    return '\n'.join(output), 1
+        return '\n'.join(output), 0
+
+class FakeReadWriteEverything(ReadWriteEverything):
+    '''
+    Brief:
+        ReadWriteEverything that sends its commands to a SimulatedSystem instead of launching rw.exe.
+            Everything above callRawCommand (batching, scratch files, verification, parsing) is the real code.
+            latencySeconds is added to every 'launch' to mimic process startup.
+    '''
+    def __init__(self, system=None, latencySeconds=0, scratchDir=None):
+        '''
+        Brief:
+            Initializer for the fake. Doesn't need rw.exe or admin.
+        '''
+        Backend.__init__(self)
+        self.system = system if system is not None else SimulatedSystem()
+        self.latencySeconds = latencySeconds
+        self.scratchDir = scratchDir
+        self.recorder = None
+        self.exePath = None
+        self.version = 'RW - Read Write Utility (simulated)'
+        self._validated = True
+
+    def callRawCommand(self, cmd):
+        '''
+        Brief:
+            'Calls' a Raw command by running its embeded RWE command on the SimulatedSystem
+        '''
+        start = monotonic()
+        if self.latencySeconds:
+            time.sleep(self.latencySeconds)
+
+        m = re.search(RWE_COMMAND_REGEX, cmd)
+        if m is None:
+            ret = ProcessOutput(Output='', ReturnCode=0)
+        else:
+            ret = ProcessOutput(*self.system.runScript(m.group(1).replace('\\"', '"')))
+
+        if self.instrumentation is not None:
+            self.instrumentation.recordSubprocessLaunch(monotonic() - start)
+        return ret
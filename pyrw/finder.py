@@ -23,6 +23,18 @@ DEFAULT_INSTALL_LOCATIONS = [
     "/Program Files (x86)/RW-Everything/%s" % RW_EXE,
 ]
 
+def isValidRWEverything(exePath):
+    '''
+    Brief:
+        Returns True if the given exe appears to be a working RW-Everything.
+            Uses the on-disk exe cache, so an unchanged exe that was checked before doesn't need to be launched again.
+    '''
+    try:
+        ReadWriteEverything(exePath, validate=True)
+        return True
+    except EnvironmentError:
+        return False
+
 def findInstalledRWEverything():
     '''
     Brief:
@@ -31,12 +43,8 @@ def findInstalledRWEverything():
     drivePath = os.environ.get('SYSTEMDRIVE', 'C:')
     for defInstLoc in DEFAULT_INSTALL_LOCATIONS:
         fullPath = os.path.join(drivePath, defInstLoc)
-        if os.path.isfile(fullPath):
-            try:
-                ReadWriteEverything(fullPath)
-                return fullPath
-            except EnvironmentError:
-                continue
+        if os.path.isfile(fullPath) and isValidRWEverything(fullPath):
+            return fullPath
 
 def getEnvironmentVariableAsList(v):
     '''
@@ -53,12 +61,8 @@ def findPathedRWEverything():
     path = getEnvironmentVariableAsList('PATH')
     for p in path:
         possibleRw = os.path.join(p, RW_EXE)
-        if os.path.isfile(possibleRw):
-            try:
-                ReadWriteEverything(possibleRw)
-                return possibleRw
-            except EnvironmentError:
-                continue
+        if os.path.isfile(possibleRw) and isValidRWEverything(possibleRw):
+            return possibleRw
 
 def findCwdRWEverything():
     '''
@@ -66,12 +70,8 @@ def findCwdRWEverything():
         Searches the current working directory for RWE
     '''
     fullPath = os.path.join(os.getcwd(), RW_EXE)
-    if os.path.isfile(fullPath):
-        try:
-            ReadWriteEverything(fullPath)
-            return fullPath
-        except EnvironmentError:
-            pass
+    if os.path.isfile(fullPath) and isValidRWEverything(fullPath):
+        return fullPath
 
 def findPackagedRWEverything():
     '''
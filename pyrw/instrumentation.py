@@ -0,0 +1,245 @@
+'''
+Brief:
+    File for per-operation counters, latency histograms and pre/post hooks on a backend
+
+Author(s):
+    Charles Machalow
+'''
+import functools
+import inspect
+import json
+import logging
+import threading
+
+from pyrw.wait import monotonic
+
+logger = logging.getLogger(__name__)
+
+# histogram bucket upper bounds in microseconds: 1us, 2us, 4us ... ~67s, then everything else
+HISTOGRAM_BUCKETS_US = [2 ** i for i in range(27)]
+
+def instrumented(numBytesFunc=None):
+    '''
+    Brief:
+        Decorator for backend methods: if the backend has instrumentation enabled, the call is recorded (under the method name)
+            and hooks are run around it. numBytesFunc(args, result) returns how many bytes the call moved.
+            Keyword arguments are bound to their positions first, so args always holds every parameter (after self) in order.
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if self.instrumentation is None:
+                return func(self, *args, **kwargs)
+
+            if kwargs:
+                args = bindArguments(func, self, args, kwargs)
+            bytesFunc = None if numBytesFunc is None else (lambda result: numBytesFunc(args, result))
+            return self.instrumentation.call(func.__name__, lambda *a: func(self, *a), args, bytesFunc)
+        return wrapper
+    return decorator
+
+def bindArguments(func, self, args, kwargs):
+    '''
+    Brief:
+        Returns the positional arguments (after self) that func(self, *args, **kwargs) would get, with defaults filled in.
+            Raises TypeError (like the call itself would) if they don't match func's parameters.
+    '''
+    callArgs = inspect.getcallargs(func, self, *args, **kwargs)
+    code = func.__code__
+    return tuple(callArgs[name] for name in code.co_varnames[1:code.co_argcount])
+
+class LatencyHistogram(object):
+    '''
+    Brief:
+        Log2-bucketed latency histogram with count/total/min/max
+    '''
+    def __init__(self):
+        '''
+        Brief:
+            Initializer for the histogram
+        '''
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = [0] * (len(HISTOGRAM_BUCKETS_US) + 1)
+
+    def add(self, seconds):
+        '''
+        Brief:
+            Adds a latency (in seconds) to the histogram
+        '''
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+        us = seconds * 1e6
+        for idx, bound in enumerate(HISTOGRAM_BUCKETS_US):
+            if us <= bound:
+                self.buckets[idx] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def toDict(self):
+        '''
+        Brief:
+            Returns the histogram as a dict (times in seconds, bucket keys are upper bounds in microseconds)
+        '''
+        buckets = {}
+        for idx, count in enumerate(self.buckets):
+            if count:
+                buckets['<=%dus' % HISTOGRAM_BUCKETS_US[idx] if idx < len(HISTOGRAM_BUCKETS_US) else 'more'] = count
+
+        return {
+            'count': self.count,
+            'total': self.total,
+            'min': self.min,
+            'max': self.max,
+            'mean': self.total / self.count if self.count else None,
+            'buckets': buckets,
+        }
+
+class OperationStats(object):
+    '''
+    Brief:
+        Counters and a latency histogram for one kind of operation
+    '''
+    def __init__(self):
+        '''
+        Brief:
+            Initializer for the stats
+        '''
+        self.count = 0
+        self.errors = 0
+        self.bytes = 0
+        self.latency = LatencyHistogram()
+
+    def toDict(self):
+        '''
+        Brief:
+            Returns the stats as a dict
+        '''
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'bytes': self.bytes,
+            'latency': self.latency.toDict(),
+        }
+
+class Instrumentation(object):
+    '''
+    Brief:
+        Collects per-operation counters and latency histograms for a backend and calls user hooks around operations.
+            Operations are the public backend calls (readMemory, writeMemory, readPCI, writePCI, getPCITree, ...)
+                plus internal phases like subprocess launches, scratch file I/O and output parsing/verification.
+    '''
+    def __init__(self):
+        '''
+        Brief:
+            Initializer for the instrumentation
+        '''
+        self.preHooks = []
+        self.postHooks = []
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        '''
+        Brief:
+            Clears all counters and histograms
+        '''
+        with self._lock:
+            self.operations = {}
+            self.subprocessLaunches = 0
+
+    def addPreHook(self, hook):
+        '''
+        Brief:
+            Adds a hook called as hook(name, args) before each operation
+        '''
+        self.preHooks.append(hook)
+
+    def addPostHook(self, hook):
+        '''
+        Brief:
+            Adds a hook called as hook(name, args, result, elapsedSeconds, exception) after each operation
+                exception is None if the operation succeeded (result is None if it didn't).
+        '''
+        self.postHooks.append(hook)
+
+    def record(self, name, elapsedSeconds, numBytes=0, error=False):
+        '''
+        Brief:
+            Records one occurrence of the given operation
+        '''
+        with self._lock:
+            stats = self.operations.get(name)
+            if stats is None:
+                stats = self.operations[name] = OperationStats()
+
+            stats.count += 1
+            stats.bytes += numBytes
+            if error:
+                stats.errors += 1
+            stats.latency.add(elapsedSeconds)
+
+    def recordSubprocessLaunch(self, elapsedSeconds):
+        '''
+        Brief:
+            Records a subprocess launch (and how long it took to run)
+        '''
+        with self._lock:
+            self.subprocessLaunches += 1
+        self.record('subprocess', elapsedSeconds)
+
+    def call(self, name, func, args, numBytesFunc=None):
+        '''
+        Brief:
+            Calls func(*args), running hooks around it and recording its latency.
+                numBytesFunc(result) returns the number of bytes the operation moved (if given).
+                An error from numBytesFunc is logged, never raised: the operation has already completed.
+        '''
+        for hook in self.preHooks:
+            hook(name, args)
+
+        start = monotonic()
+        try:
+            result = func(*args)
+        except Exception as ex:
+            elapsed = monotonic() - start
+            self.record(name, elapsed, error=True)
+            for hook in self.postHooks:
+                hook(name, args, None, elapsed, ex)
+            raise
+
+        elapsed = monotonic() - start
+        numBytes = 0
+        if numBytesFunc:
+            try:
+                numBytes = numBytesFunc(result)
+            except Exception:
+                logger.exception("Couldn't count the bytes moved by %s" % name)
+        self.record(name, elapsed, numBytes)
+        for hook in self.postHooks:
+            hook(name, args, result, elapsed, None)
+        return result
+
+    def toDict(self):
+        '''
+        Brief:
+            Returns all counters and histograms as a dict
+        '''
+        with self._lock:
+            return {
+                'subprocessLaunches': self.subprocessLaunches,
+                'operations': dict((name, stats.toDict()) for name, stats in self.operations.items()),
+            }
+
+    def toJSON(self, **kwargs):
+        '''
+        Brief:
+            Returns all counters and histograms as a JSON string. kwargs go to json.dumps.
+        '''
+        return json.dumps(self.toDict(), **kwargs)
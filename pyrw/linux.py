@@ -0,0 +1,290 @@
+'''
+Brief:
+    File for the native Linux backend. Uses sysfs for PCI configuration space and mmap'd BAR resource files for memory.
+
+Author(s):
+    Charles Machalow
+'''
+import collections
+import logging
+import mmap
+import os
+import platform
+import re
+import threading
+
+from pyrw.backend import Backend, ProcessOutput
+from pyrw.capabilities import PCI_EXTENDED_CONFIG_SIZE
+from pyrw.rwe_parser import PCILocation
+from pyrw.window import SIZED_ACCESS_TYPES, readSized, writeSized
+
+logger = logging.getLogger(__name__)
+
+SYSFS_PCI_DEVICES = '/sys/bus/pci/devices'
+DEV_MEM = '/dev/mem'
+SYSFS_DEVICE_NAME_REGEX = r'^([0-9a-fA-F]{4}):([0-9a-fA-F]{2}):([0-9a-fA-F]{2})\.([0-7])$'
+PCI_HEADER_SIZE = 256
+NUM_BARS = 6
+IORESOURCE_MEM = 0x200
+
+BarResource = collections.namedtuple("BarResource", ['Index', 'Start', 'End', 'Flags', 'Path'])
+
+class SysfsBackend(Backend):
+    '''
+    Brief:
+        Backend that works on Linux without any external tools.
+            PCI config space comes from /sys/bus/pci/devices/*/config.
+            Memory inside a memory BAR goes through an mmap of that device's resourceN file. Anything else goes to /dev/mem.
+    '''
+    def __init__(self, sysfsRoot=SYSFS_PCI_DEVICES, memPath=DEV_MEM):
+        '''
+        Brief:
+            Initializer for the backend. sysfsRoot and memPath can be pointed at a fake tree for testing.
+        '''
+        Backend.__init__(self)
+        self.sysfsRoot = sysfsRoot
+        self.memPath = memPath
+        self._devicePaths = None
+        self._barResources = None
+        self._barMaps = {}
+        self._mapLock = threading.Lock()
+
+    def getVersion(self):
+        '''
+        Brief:
+            Returns a string describing this backend
+        '''
+        return 'Linux sysfs backend (kernel %s)' % platform.release()
+
+    def _getDevicePaths(self, rescan=False):
+        '''
+        Brief:
+            Returns a dict of PCILocation to sysfs device folder
+        '''
+        if self._devicePaths is None or rescan:
+            devicePaths = {}
+            # sorted so that domain 0000 wins if the same B/D/F exists in multiple domains
+            for name in sorted(os.listdir(self.sysfsRoot)):
+                m = re.match(SYSFS_DEVICE_NAME_REGEX, name)
+                if not m:
+                    continue
+
+                location = PCILocation(int(m.group(2), 16), int(m.group(3), 16), int(m.group(4), 16))
+                devicePaths.setdefault(location, os.path.join(self.sysfsRoot, name))
+
+            self._devicePaths = devicePaths
+            self._barResources = None
+
+        return self._devicePaths
+
+    def _getDevicePath(self, bus, device, function):
+        '''
+        Brief:
+            Returns the sysfs folder for the given device. Raises if it doesn't exist.
+        '''
+        try:
+            return self._getDevicePaths()[PCILocation(bus, device, function)]
+        except KeyError:
+            raise ValueError("No PCI device at Bus %d, Device %d, Function %d" % (bus, device, function))
+
+    def _readSysfsValue(self, devicePath, name):
+        '''
+        Brief:
+            Reads a hex value (like vendor or class) from a sysfs attribute file
+        '''
+        with open(os.path.join(devicePath, name), 'r') as f:
+            return int(f.read().strip(), 16)
+
+    def getBarResources(self, bus, device, function):
+        '''
+        Brief:
+            Returns a list of BarResources for the memory BARs of the given device (as reported by the kernel)
+        '''
+        return self._parseResourceFile(self._getDevicePath(bus, device, function))
+
+    def _parseResourceFile(self, devicePath):
+        '''
+        Brief:
+            Parses the sysfs resource file of a device to a list of BarResources (memory BARs only)
+        '''
+        ret = []
+        resourcePath = os.path.join(devicePath, 'resource')
+        if not os.path.isfile(resourcePath):
+            return ret
+
+        with open(resourcePath, 'r') as f:
+            lines = f.read().splitlines()
+
+        for idx, line in enumerate(lines[:NUM_BARS]):
+            start, end, flags = [int(x, 16) for x in line.split()]
+            if start and (flags & IORESOURCE_MEM):
+                ret.append(BarResource(idx, start, end, flags, os.path.join(devicePath, 'resource%d' % idx)))
+
+        return ret
+
+    def _findBar(self, byteOffset, numBytes):
+        '''
+        Brief:
+            Returns the BarResource containing the given range or None if no memory BAR contains all of it
+        '''
+        if self._barResources is None:
+            barResources = []
+            for devicePath in self._getDevicePaths().values():
+                barResources.extend(self._parseResourceFile(devicePath))
+            self._barResources = barResources
+
+        for bar in self._barResources:
+            if bar.Start <= byteOffset and byteOffset + numBytes - 1 <= bar.End:
+                return bar
+
+    def _getBarMap(self, bar):
+        '''
+        Brief:
+            Returns a (cached) writable mmap over the given BAR's resource file
+        '''
+        with self._mapLock:
+            m = self._barMaps.get(bar.Path)
+            if m is None:
+                size = os.path.getsize(bar.Path) or (bar.End - bar.Start + 1)
+                fd = os.open(bar.Path, os.O_RDWR)
+                try:
+                    m = mmap.mmap(fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+                finally:
+                    os.close(fd)
+                self._barMaps[bar.Path] = m
+                logger.debug("Mapped %s (0x%X bytes)" % (bar.Path, size))
+
+            return m
+
+    def close(self):
+        '''
+        Brief:
+            Unmaps all mapped BARs. Any RegisterWindows over them must be released first.
+        '''
+        with self._mapLock:
+            for m in self._barMaps.values():
+                m.close()
+            self._barMaps = {}
+
+    def getMemoryView(self, byteOffset, numBytes):
+        '''
+        Brief:
+            Returns a writable memoryview over the mapped BAR memory for the given range or None if it isn't inside a memory BAR
+        '''
+        bar = self._findBar(byteOffset, numBytes)
+        if bar is None:
+            return None
+
+        offset = byteOffset - bar.Start
+        return memoryview(self._getBarMap(bar))[offset:offset + numBytes]
+
+    def _readMemory(self, byteOffset, numBytes):
+        '''
+        Brief:
+            Reads raw memory from a given offset for a given number of bytes
+        '''
+        bar = self._findBar(byteOffset, numBytes)
+        if bar is None:
+            fd = os.open(self.memPath, os.O_RDONLY)
+            try:
+                os.lseek(fd, byteOffset, os.SEEK_SET)
+                return os.read(fd, numBytes)
+            finally:
+                os.close(fd)
+
+        m = self._getBarMap(bar)
+        offset = byteOffset - bar.Start
+        if numBytes in SIZED_ACCESS_TYPES and offset % numBytes == 0:
+            # do a single sized load so registers see one access of the expected width
+            return readSized(m, offset, numBytes)
+        return m[offset:offset + numBytes]
+
+    def _writeMemory(self, byteOffset, data):
+        '''
+        Brief:
+            Writes given data to the given offset of memory
+        '''
+        data = bytearray(data)
+        bar = self._findBar(byteOffset, len(data))
+        if bar is None:
+            fd = os.open(self.memPath, os.O_RDWR)
+            try:
+                os.lseek(fd, byteOffset, os.SEEK_SET)
+                os.write(fd, bytes(data))
+            finally:
+                os.close(fd)
+            return ProcessOutput(Output='', ReturnCode=0)
+
+        m = self._getBarMap(bar)
+        offset = byteOffset - bar.Start
+        if len(data) in SIZED_ACCESS_TYPES and offset % len(data) == 0:
+            writeSized(m, offset, data)
+        else:
+            m[offset:offset + len(data)] = bytes(data)
+        return ProcessOutput(Output='', ReturnCode=0)
+
+    def _readPCI(self, bus, device, function):
+        '''
+        Brief:
+            Reads PCI header (configuration space) data from the given device
+        '''
+        with open(os.path.join(self._getDevicePath(bus, device, function), 'config'), 'rb') as f:
+            return f.read(PCI_HEADER_SIZE)
+
+    def _readPCIExtended(self, bus, device, function):
+        '''
+        Brief:
+            Reads the full extended config space from sysfs (only root can read past the 64 byte header there)
+        '''
+        with open(os.path.join(self._getDevicePath(bus, device, function), 'config'), 'rb') as f:
+            return f.read(PCI_EXTENDED_CONFIG_SIZE)
+
+    def _readPCIRange(self, bus, device, function, offset, numBytes):
+        '''
+        Brief:
+            Reads just the given range of config space from sysfs
+        '''
+        with open(os.path.join(self._getDevicePath(bus, device, function), 'config'), 'rb') as f:
+            f.seek(offset)
+            return f.read(numBytes)
+
+    def _writePCI(self, bus, device, function, data):
+        '''
+        Brief:
+            Writes given PCI (configuration space) data to a given device
+        '''
+        with open(os.path.join(self._getDevicePath(bus, device, function), 'config'), 'r+b') as f:
+            f.write(bytes(bytearray(data)))
+        return ProcessOutput(Output='', ReturnCode=0)
+
+    def _writePCIRange(self, bus, device, function, offset, data):
+        '''
+        Brief:
+            Writes data at the given offset of a device's config space (only those bytes are written)
+        '''
+        with open(os.path.join(self._getDevicePath(bus, device, function), 'config'), 'r+b') as f:
+            f.seek(offset)
+            f.write(bytes(bytearray(data)))
+        return ProcessOutput(Output='', ReturnCode=0)
+
+    def _writePCIRanges(self, bus, device, function, writes, baseConfig=None):
+        '''
+        Brief:
+            Writes many (offset, data) pairs to a device's config space (only those bytes are written, baseConfig isn't needed)
+        '''
+        return [self._writePCIRange(bus, device, function, offset, data) for offset, data in writes]
+
+    def _getPCITree(self):
+        '''
+        Brief:
+            Returns a dict of PCILocation to a description built from sysfs vendor/device/class attributes
+        '''
+        ret = {}
+        for location, devicePath in self._getDevicePaths(rescan=True).items():
+            ret[location] = 'Vendor 0x%04X Device 0x%04X Class 0x%06X' % (
+                self._readSysfsValue(devicePath, 'vendor'),
+                self._readSysfsValue(devicePath, 'device'),
+                self._readSysfsValue(devicePath, 'class'),
+            )
+
+        return ret
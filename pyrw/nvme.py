@@ -7,21 +7,49 @@ Author(s):
 '''
 
 import collections
+import logging
+import struct
 import time
 from ctypes import *
 
 from pyrw.rwe_parser import *
 from pyrw.pci import PCIDevice
+from pyrw.wait import DEFAULT_BACKOFF_POLICY, monotonic, waitFor
+
+logger = logging.getLogger(__name__)
 
 COMPLETION_ENTRY_SIZE = 16
 SUBMISSION_ENTRY_SIZE = 64
 NVME_CLASS_CODE = 0x10802
+CONTROLLER_REGISTER_SIZE = 4096
 
 AdminQueueAddresses = collections.namedtuple("AdminQueueAddresses", ['AdminSubmissionQueueBase', 'AdminCompletionQueueBase'])
 AdminQueueAttributes = collections.namedtuple("AdminQueueAttributes", ['AdminCompletionQueueSize', 'AdminSubmissionQueueSize'])
 AdminQueueEntries = collections.namedtuple("AdminQueueEntries", ['AdminCompletionQueue', 'AdminSubmissionQueue'])
+AdminCompletion = collections.namedtuple("AdminCompletion", ['CommandIdentifier', 'SubmissionQueueIdentifier', 'SubmissionQueueHead', 'Status', 'DW0', 'Opcode', 'SubmissionEntry'])
+ControllerResetTimings = collections.namedtuple("ControllerResetTimings", ['CCEnableCleared', 'ReadyCleared', 'CCEnableSet', 'ReadySet', 'Total'])
 NVMeVersion = collections.namedtuple("NVMeVersion", ['Major', 'Minor', 'Tertiary'])
 
+class NVMeControllerRegisters(LittleEndianStructure):
+    '''
+    Brief:
+        The NVMe controller registers at the start of BAR0
+    '''
+    _pack_ = 1
+    _fields_ = [
+        ('CAP', c_uint64),   # 0x00 Controller Capabilities
+        ('VS', c_uint32),    # 0x08 Version
+        ('INTMS', c_uint32), # 0x0C Interrupt Mask Set
+        ('INTMC', c_uint32), # 0x10 Interrupt Mask Clear
+        ('CC', c_uint32),    # 0x14 Controller Configuration
+        ('Reserved', c_uint32),
+        ('CSTS', c_uint32),  # 0x1C Controller Status
+        ('NSSR', c_uint32),  # 0x20 NVM Subsystem Reset
+        ('AQA', c_uint32),   # 0x24 Admin Queue Attributes
+        ('ASQ', c_uint64),   # 0x28 Admin Submission Queue Base Address
+        ('ACQ', c_uint64),   # 0x30 Admin Completion Queue Base Address
+    ]
+
 def chunks(l, n):
     """Yield successive n-sized chunks from l."""
     for i in range(0, len(l), n):
@@ -32,29 +60,78 @@ class NVMeDevice(PCIDevice):
     Brief:
         Abstraction for an NVMe PCIe Device
     '''
-    def __init__(self, rwe, address):
+    def __init__(self, rwe, address, configData=None):
+        '''
+        Brief:
+            Initializer for the NVMe Device. If configData is given, it's used to check the class code instead of reading it.
+        '''
+        PCIDevice.__init__(self, rwe, address, configData)
+        if configData is not None:
+            classCode = getPCIClassCodeFromConfig(configData)
+        else:
+            classCode = self.getPCIClassCode()
+        assert classCode == NVME_CLASS_CODE, "This is not an NVMe device."
+        self._registerWindow = None
+        self._controllerRegisters = None
+
+    def getRegisterWindow(self):
+        '''
+        Brief:
+            Returns the RegisterWindow over the controller registers (created on first use)
+        '''
+        if self._registerWindow is None:
+            bar0 = self.getPCIBarAddresses()[0]
+            self._registerWindow = self.rwe.getRegisterWindow(bar0, CONTROLLER_REGISTER_SIZE)
+            self._controllerRegisters = self._registerWindow.getStructure(NVMeControllerRegisters)
+        return self._registerWindow
+
+    def getControllerRegisters(self, refresh=True):
+        '''
+        Brief:
+            Returns a NVMeControllerRegisters structure that shares memory with the register window (no copies).
+                If the window isn't mapped, refresh decides if the structure's bytes are re-read first.
+        '''
+        window = self.getRegisterWindow()
+        if refresh:
+            window.refresh(0, sizeof(NVMeControllerRegisters))
+        return self._controllerRegisters
+
+    def getControllerRegister(self, name):
         '''
         Brief:
-            Initializer for the NVMe Device
+            Returns the current value of the given controller register (by NVMeControllerRegisters field name).
+                Only the bytes for that register are re-read if the window isn't mapped.
         '''
-        PCIDevice.__init__(self, rwe, address)
-        assert self.getPCIClassCode() == NVME_CLASS_CODE, "This is not an NVMe device."
+        window = self.getRegisterWindow()
+        window.refreshField(NVMeControllerRegisters, name)
+        return getattr(self._controllerRegisters, name)
+
+    def setControllerRegister(self, name, value):
+        '''
+        Brief:
+            Writes the given value to the given controller register (by NVMeControllerRegisters field name) with one full-width write
+        '''
+        field = getattr(NVMeControllerRegisters, name)
+        self.getRegisterWindow().write(field.offset, struct.pack('<' + WIDTH_FORMATS[field.size], value))
 
     def getControllerRegisterData(self):
         '''
         Brief:
             Returns a copy of the first 4096 bytes of controller register data
         '''
-        bar0 = self.getPCIBarAddresses()[0]
-        return self.rwe.readMemory(bar0, 4096)
+        # a new window was just read, so only re-read an existing one
+        isNew = self._registerWindow is None
+        window = self.getRegisterWindow()
+        if not isNew:
+            window.refresh()
+        return window.tobytes()
 
     def getNVMeVersion(self):
         '''
         Brief:
             Returns the NVMe version from the controller registers
         '''
-        controllerRegisterData = self.getControllerRegisterData()
-        vs = bytesToDWordList(controllerRegisterData[0x8:])[0]
+        vs = self.getControllerRegister('VS')
         return NVMeVersion(Major=vs >> 16, Minor=((vs >> 8) & 0xFF), Tertiary=vs & 0xFF)
 
     def getAdminQueueAttributes(self):
@@ -62,8 +139,7 @@ class NVMeDevice(PCIDevice):
         Brief:
             Returns the admin queue sizes
         '''
-        controllerRegisterData = self.getControllerRegisterData()
-        aqa = bytesToDWordList(controllerRegisterData[0x24:])[0]
+        aqa = self.getControllerRegister('AQA')
         return AdminQueueAttributes(AdminCompletionQueueSize=(aqa >> 16) & 0xFFF, AdminSubmissionQueueSize=aqa & 0xFFF)
 
     def getAdminQueueBaseAddresses(self):
@@ -71,9 +147,8 @@ class NVMeDevice(PCIDevice):
         Brief:
             Returns the addresses of the admin submission and completion queues
         '''
-        controllerRegisterData = self.getControllerRegisterData()
-        asqb = ((c_uint64.from_buffer_copy(controllerRegisterData[0x28:]).value) >> 12) << 12
-        acqb = ((c_uint64.from_buffer_copy(controllerRegisterData[0x30:]).value) >> 12) << 12
+        asqb = (self.getControllerRegister('ASQ') >> 12) << 12
+        acqb = (self.getControllerRegister('ACQ') >> 12) << 12
         return AdminQueueAddresses(asqb, acqb)
 
     def getAdminQueueEntries(self):
@@ -89,43 +164,49 @@ class NVMeDevice(PCIDevice):
         cqDw = bytesToDWordList(completionQueue)
         return AdminQueueEntries(list(chunks(cqDw, 4)), list(chunks(sqDw, 16)))
 
-    def controllerReset(self):
+    def getAdminQueueWatcher(self, readAhead=4):
+        '''
+        Brief:
+            Returns an AdminQueueWatcher that yields new admin completions as they are posted
+        '''
+        return AdminQueueWatcher(self, readAhead)
+
+    def controllerReset(self, policy=DEFAULT_BACKOFF_POLICY):
         '''
         Brief:
-            Performs a complete NVMe Controller Reset.
+            Performs a complete NVMe Controller Reset. Returns ControllerResetTimings (in seconds) for each step:
                 CC.EN -> 0
                 CSTS.RDY -> 0
                 CC.EN -> 1
                 CSTS.RDY -> 1
+            CSTS.RDY is polled with the given BackoffPolicy.
         '''
-        bar0 = self.getPCIBarAddresses()[0]
-        CCAddr = bar0 + 0x14
-        CSTSAddr = bar0 + 0x1C
+        timeoutSeconds = ((self.getControllerRegister('CAP') >> 24) & 0xFF) * .5 # CAP.TO is in 500ms units
+        readCSTS = lambda: self.getControllerRegister('CSTS')
 
-        timeoutMs = self.getControllerRegisterData()[3] * 500
+        start = monotonic()
+        CC0 = self.getControllerRegister('CC')
+        self.setControllerRegister('CC', (CC0 >> 1) << 1) # set CC.EN to 0
+        ccDisabled = monotonic()
 
-        CC0 = self.rwe.readMemory(CCAddr, 1)[0]
-        CC0 = ((CC0 >> 1) << 1) # set CC.EN to 0
-        assert self.rwe.writeMemory(CCAddr, [CC0]).ReturnCode == 0
+        waitFor(readCSTS, lambda csts: csts & 1 == 0, timeoutSeconds, policy, 'CSTS.RDY to go to 0')
+        notReady = monotonic()
 
-        deathTime = time.time() + (timeoutMs / 1000.0)
-        while time.time() < deathTime:
-            CSTS0 = self.rwe.readMemory(CSTSAddr, 1)[0]
-            if CSTS0 & 1 == 0:
-                break
-        else:
-            raise RuntimeError("CSTS.RDY did not go to 0")
+        self.setControllerRegister('CC', ((CC0 >> 1) << 1) | 1) # set CC.EN to 1
+        ccEnabled = monotonic()
 
-        CC0 = CC0 + 1 # set CC.EN to 1
-        self.rwe.writeMemory(CCAddr, [CC0])
+        waitFor(readCSTS, lambda csts: csts & 1 == 1, timeoutSeconds, policy, 'CSTS.RDY to go back to 1')
+        ready = monotonic()
 
-        deathTime = time.time() + (timeoutMs / 1000.0)
-        while time.time() < deathTime:
-            CSTS0 = self.rwe.readMemory(CSTSAddr, 1)[0]
-            if CSTS0 & 1 == 1:
-                break
-        else:
-            raise RuntimeError("CSTS.RDY did not go back to 1")
+        timings = ControllerResetTimings(
+            CCEnableCleared=ccDisabled - start,
+            ReadyCleared=notReady - ccDisabled,
+            CCEnableSet=ccEnabled - notReady,
+            ReadySet=ready - ccEnabled,
+            Total=ready - start,
+        )
+        logger.debug("Controller reset timings: %s" % str(timings))
+        return timings
 
     def subsystemReset(self):
         '''
@@ -139,4 +220,130 @@ class NVMeDevice(PCIDevice):
         if self.rwe.writeMemory(NSSR, [0x4e, 0x56, 0x4d, 0x65]).ReturnCode != 0:
             raise RuntimeError("Failed to write the NSSR")
 
-        # todo: check if it worked?
\ No newline at end of file
+        # todo: check if it worked?
+
+class AdminQueueWatcher(object):
+    '''
+    Brief:
+        Watches the admin completion queue by tracking its head and phase tag.
+            Each poll only reads completion slots starting at the head (and the submission slots the controller consumed),
+                so the cost scales with new traffic instead of the queue depth.
+    '''
+    def __init__(self, nvmeDevice, readAhead=4):
+        '''
+        Brief:
+            Initializer for the watcher. Takes the NVMeDevice to watch.
+                readAhead is how many completion slots are read per memory read while new completions keep showing up.
+                Completions already in the queue when the watcher is created are skipped (the queue is read once to find its head).
+        '''
+        self.device = nvmeDevice
+        self.readAhead = readAhead
+
+        addresses = nvmeDevice.getAdminQueueBaseAddresses()
+        sizes = nvmeDevice.getAdminQueueAttributes()
+        self.completionQueueBase = addresses.AdminCompletionQueueBase
+        self.submissionQueueBase = addresses.AdminSubmissionQueueBase
+        # AQA sizes are 0's based
+        self.completionQueueEntries = sizes.AdminCompletionQueueSize + 1
+        self.submissionQueueEntries = sizes.AdminSubmissionQueueSize + 1
+
+        self.completionQueueHead = 0
+        self.phase = 1
+        self.submissionQueueHead = 0
+        self._submissions = {}
+        self._synchronize()
+
+    def _readCompletions(self, index, count):
+        '''
+        Brief:
+            Reads count completion entries starting at index (no wrapping). Returns a list of 4-DWord lists.
+        '''
+        data = self.device.rwe.readMemory(self.completionQueueBase + index * COMPLETION_ENTRY_SIZE, count * COMPLETION_ENTRY_SIZE)
+        return list(chunks(bytesToDWordList(data), 4))
+
+    def _synchronize(self):
+        '''
+        Brief:
+            Finds the current completion queue head/phase by looking for where the phase tag flips
+        '''
+        entries = self._readCompletions(0, self.completionQueueEntries)
+        phases = [(e[3] >> 16) & 1 for e in entries]
+        posted = any(any(e) for e in entries)
+
+        for idx in range(1, len(phases)):
+            if phases[idx] != phases[0]:
+                self.completionQueueHead = idx
+                self.phase = phases[0]
+                break
+        else:
+            # every slot has the same phase: either nothing was ever posted (phase 0) or we are right at a wrap
+            self.completionQueueHead = 0
+            self.phase = phases[0] ^ 1 if posted else 1
+
+        # the newest completion is right before the head (the last slot at a wrap, whichever phase the queue wrapped with)
+        if posted:
+            last = entries[self.completionQueueHead - 1]
+            self.submissionQueueHead = last[2] & 0xFFFF
+
+        logger.debug("Admin queue watcher synchronized: head=%d phase=%d sqHead=%d" % (self.completionQueueHead, self.phase, self.submissionQueueHead))
+
+    def _consumeSubmissions(self, newHead):
+        '''
+        Brief:
+            Reads the submission slots the controller consumed (from the last known SQ head up to newHead) and indexes them by CID
+        '''
+        head = self.submissionQueueHead
+        while head != newHead:
+            end = newHead if newHead > head else self.submissionQueueEntries
+            data = self.device.rwe.readMemory(self.submissionQueueBase + head * SUBMISSION_ENTRY_SIZE, (end - head) * SUBMISSION_ENTRY_SIZE)
+            for entry in chunks(bytesToDWordList(data), 16):
+                self._submissions[entry[0] >> 16] = entry
+            head = end % self.submissionQueueEntries
+
+        self.submissionQueueHead = newHead
+
+    def poll(self):
+        '''
+        Brief:
+            Returns a list of AdminCompletions posted since the last poll (oldest first)
+        '''
+        ret = []
+        while True:
+            count = min(self.readAhead, self.completionQueueEntries - self.completionQueueHead)
+            entries = self._readCompletions(self.completionQueueHead, count)
+            for entry in entries:
+                if (entry[3] >> 16) & 1 != self.phase:
+                    return ret
+
+                sqHead = entry[2] & 0xFFFF
+                if sqHead < self.submissionQueueEntries:
+                    self._consumeSubmissions(sqHead)
+
+                cid = entry[3] & 0xFFFF
+                submission = self._submissions.pop(cid, None)
+                ret.append(AdminCompletion(
+                    CommandIdentifier=cid,
+                    SubmissionQueueIdentifier=entry[2] >> 16,
+                    SubmissionQueueHead=sqHead,
+                    Status=entry[3] >> 17,
+                    DW0=entry[0],
+                    Opcode=None if submission is None else submission[0] & 0xFF,
+                    SubmissionEntry=submission,
+                ))
+
+                self.completionQueueHead += 1
+                if self.completionQueueHead == self.completionQueueEntries:
+                    self.completionQueueHead = 0
+                    self.phase ^= 1
+
+    def watch(self, intervalSeconds=.1, timeoutSeconds=None):
+        '''
+        Brief:
+            Generator that polls every intervalSeconds and yields AdminCompletions as they show up.
+                Stops after timeoutSeconds if given.
+        '''
+        deathTime = None if timeoutSeconds is None else monotonic() + timeoutSeconds
+        while deathTime is None or monotonic() < deathTime:
+            for completion in self.poll():
+                yield completion
+            time.sleep(intervalSeconds)
@@ -5,22 +5,197 @@ Brief:
 Author(s):
     Charles Machalow
 '''
+import threading
+
+from pyrw.capabilities import *
+from pyrw.rwe_parser import PCILocation
+
+class PCIConfigCache(object):
+    '''
+    Brief:
+        Cache of PCI configuration space data per PCILocation. Used by a backend once enableConfigCache() is called.
+            Entries are invalidated by writePCI on the same device or explicitly with refresh()/invalidate().
+            Each invalidation bumps a version, so data read before a concurrent write is never stored (see getVersion()/prime()).
+    '''
+    def __init__(self, readFunc):
+        '''
+        Brief:
+            Initializer for the cache. readFunc(bus, device, function) does an uncached config space read.
+        '''
+        self.readFunc = readFunc
+        self.hits = 0
+        self.misses = 0
+        self._data = {}
+        self._versions = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def read(self, address):
+        '''
+        Brief:
+            Returns the config space data for the given PCILocation, reading it on a miss
+        '''
+        version = self.getVersion(address)
+        data = self.get(address)
+        if data is None:
+            data = bytes(self.readFunc(*address))
+            self.prime(address, data, version)
+        return data
+
+    def getVersion(self, address):
+        '''
+        Brief:
+            Returns the current version of the given PCILocation's entry. Take it before an uncached read and pass it to prime().
+        '''
+        with self._lock:
+            return (self._epoch, self._versions.get(PCILocation(*address), 0))
+
+    def get(self, address):
+        '''
+        Brief:
+            Returns the cached config space data for the given PCILocation or None (counting the hit/miss) without reading
+        '''
+        with self._lock:
+            data = self._data.get(PCILocation(*address))
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return data
+
+    def prime(self, address, data, version=None):
+        '''
+        Brief:
+            Stores already-read config space data for the given PCILocation.
+                If version (from getVersion() before the read) is given and the entry was invalidated since, nothing is stored.
+        '''
+        address = PCILocation(*address)
+        with self._lock:
+            if version is not None and version != (self._epoch, self._versions.get(address, 0)):
+                return
+            self._data[address] = bytes(data)
+
+    def invalidate(self, address=None):
+        '''
+        Brief:
+            Drops the cached data for the given PCILocation (or everything if None)
+        '''
+        with self._lock:
+            if address is None:
+                self._data.clear()
+                self._epoch += 1
+            else:
+                address = PCILocation(*address)
+                self._data.pop(address, None)
+                self._versions[address] = self._versions.get(address, 0) + 1
+
+    def refresh(self, address=None):
+        '''
+        Brief:
+            Re-reads the config space data for the given PCILocation and returns it.
+                If address is None, drops everything so it's re-read on next use.
+        '''
+        self.invalidate(address)
+        if address is not None:
+            return self.read(address)
+
+    def resetCounters(self):
+        '''
+        Brief:
+            Resets the hit and miss counters
+        '''
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
 
 class PCIDevice(object):
     '''
     Brief:
         Abstraction of some things to do on a PCI device
     '''
-    def __init__(self, rwe, address):
+    def __init__(self, rwe, address, configData=None):
         '''
         Brief:
             Initializer for the object. Takes a RWE instance and the PCI Address (PCILocation)
+                configData is already-read config space data for the device (from bulk enumeration), if any.
+                It is given to the backend's config cache if that's enabled.
         '''
         self.rwe = rwe
         self.address = address
+        self.configData = configData
+        self._capabilityIndex = None
+        if configData is not None and rwe.configCache is not None:
+            rwe.configCache.prime(address, configData)
 
         # aliases
         self.readPCI = lambda : self.rwe.readPCI(self.address.Bus, self.address.Device, self.address.Function)
         self.writePCI = lambda data: rwe.writePCI(self.address.Bus, self.address.Device, self.address.Function, data)
         self.getPCIClassCode = lambda : self.rwe.getPCIClassCode(self.address.Bus, self.address.Device, self.address.Function)
-        self.getPCIBarAddresses = lambda : self.rwe.getPCIBarAddresses(self.address.Bus, self.address.Device, self.address.Function)
\ No newline at end of file
+        self.getPCIBarAddresses = lambda : self.rwe.getPCIBarAddresses(self.address.Bus, self.address.Device, self.address.Function)
+
+    def refresh(self):
+        '''
+        Brief:
+            Drops this device's cached config space data (if the backend has a config cache) so the next read goes to hardware
+        '''
+        if self.rwe.configCache is not None:
+            self.rwe.configCache.invalidate(self.address)
+        self._capabilityIndex = None
+
+    def getCapabilityIndex(self, refresh=False):
+        '''
+        Brief:
+            Returns the CapabilityIndex for this device, built from one read of the full extended config space (then reused)
+        '''
+        if self._capabilityIndex is None or refresh:
+            self._capabilityIndex = CapabilityIndex(self.rwe.readPCIExtended(*self.address))
+        return self._capabilityIndex
+
+    def _readCapability(self, capId, offset, numBytes, extended=False):
+        '''
+        Brief:
+            Reads numBytes at the given offset into the given capability. Raises ValueError if the device doesn't have it.
+                Raises RuntimeError for an extended capability if the backend could only read the header (rw.exe without ECAM).
+        '''
+        index = self.getCapabilityIndex()
+        if extended and not index.hasExtendedConfig:
+            raise RuntimeError("Only the config space header of %s could be read, so its extended capabilities can't be found (see enableECAM())" % str(self.address))
+        capOffset = index.getExtendedOffset(capId) if extended else index.getOffset(capId)
+        if capOffset is None:
+            raise ValueError("%s doesn't have %scapability 0x%X" % (str(self.address), 'extended ' if extended else '', capId))
+        return self.rwe.readPCIRange(self.address.Bus, self.address.Device, self.address.Function, capOffset + offset, numBytes)
+
+    def getPCIeCapability(self):
+        '''
+        Brief:
+            Returns the decoded PCIe capability (PCIeCapability) with fresh register values
+        '''
+        return decodePCIeCapability(self._readCapability(CAP_ID_PCIE, 0, PCIE_CAPABILITY_SIZE))
+
+    def getPCIeLinkStatus(self):
+        '''
+        Brief:
+            Returns the current PCIeLinkStatus (speed in GT/s and width) with one targeted register read
+        '''
+        return decodePCIeLinkStatus(self._readCapability(CAP_ID_PCIE, PCIE_LINK_CAPABILITIES_OFFSET, 8))
+
+    def getPCIeDeviceStatus(self):
+        '''
+        Brief:
+            Returns the current PCIeDeviceStatus with one targeted register read
+        '''
+        return decodePCIeDeviceStatus(self._readCapability(CAP_ID_PCIE, PCIE_DEVICE_STATUS_OFFSET, 2))
+
+    def getMSICapability(self):
+        '''
+        Brief:
+            Returns the decoded MSI capability (MSICapability)
+        '''
+        return decodeMSICapability(self._readCapability(CAP_ID_MSI, 0, MSI_CAPABILITY_SIZE))
+
+    def getMSIXCapability(self):
+        '''
+        Brief:
+            Returns the decoded MSI-X capability (MSIXCapability)
+        '''
+        return decodeMSIXCapability(self._readCapability(CAP_ID_MSIX, 0, MSIX_CAPABILITY_SIZE))
@@ -0,0 +1,240 @@
+'''
+Brief:
+    File for whole-system PCI config space snapshot files: save every device's config space, look devices up,
+        diff two snapshots and restore a snapshot (writing only what differs)
+
+    File layout (all little-endian):
+        Header: magic (8 bytes), version (u16), flags (u16), device count (u32)
+        Index (one entry per device, sorted by address): bus (u8), device (u8), function (u8), pad (u8),
+            data offset (u64), data length (u32), stored length (u32)
+        Data: each device's config space, zlib compressed on its own if the file is compressed (so lookups stay random-access)
+
+Author(s):
+    Charles Machalow
+'''
+import collections
+import struct
+import zlib
+
+from pyrw.rwe_parser import PCILocation, numpy
+from pyrw.snapshot import coalesceRanges, diffBytes
+
+SNAPSHOT_MAGIC = b'PYRWPCI\x00'
+SNAPSHOT_VERSION = 1
+FLAG_COMPRESSED = 0x1
+
+HEADER_FORMAT = '<8sHHI'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+INDEX_ENTRY_FORMAT = '<BBBxQII'
+INDEX_ENTRY_SIZE = struct.calcsize(INDEX_ENTRY_FORMAT)
+
+IndexEntry = collections.namedtuple("IndexEntry", ['Offset', 'Length', 'StoredLength'])
+PCIConfigDiff = collections.namedtuple("PCIConfigDiff", ['Added', 'Removed', 'Changed'])
+
+def writePCIConfigSnapshot(path, configs, compress=False):
+    '''
+    Brief:
+        Writes a dict of PCILocation to config space data to a snapshot file
+    '''
+    addresses = sorted(PCILocation(*a) for a in configs.keys())
+    stored = []
+    for address in addresses:
+        data = bytes(bytearray(configs[address]))
+        stored.append((len(data), zlib.compress(data) if compress else data))
+
+    offset = HEADER_SIZE + INDEX_ENTRY_SIZE * len(addresses)
+    with open(path, 'wb') as f:
+        f.write(struct.pack(HEADER_FORMAT, SNAPSHOT_MAGIC, SNAPSHOT_VERSION, FLAG_COMPRESSED if compress else 0, len(addresses)))
+        for address, (length, data) in zip(addresses, stored):
+            f.write(struct.pack(INDEX_ENTRY_FORMAT, address.Bus, address.Device, address.Function, offset, length, len(data)))
+            offset += len(data)
+        for _, data in stored:
+            f.write(data)
+
+def _readCurrentConfigs(rwe, addresses, maxWorkers):
+    '''
+    Brief:
+        Reads the config space of the given devices in one bulk pass, never from the config cache
+            (cached entries are dropped first, so what's returned is what the devices hold now)
+    '''
+    if rwe.configCache is not None:
+        for address in addresses:
+            rwe.configCache.invalidate(address)
+    return rwe.readPCIMany(addresses, maxWorkers)
+
+def savePCIConfigSnapshot(rwe, path, addresses=None, compress=False, maxWorkers=None):
+    '''
+    Brief:
+        Reads the config space of the given devices (every device on the system if None) in one bulk pass
+            (see Backend.readPCIMany, the config cache isn't used) and writes it to a snapshot file.
+            Returns the dict of PCILocation to data that was saved.
+    '''
+    if addresses is None:
+        addresses = sorted(rwe.getPCITree().keys())
+
+    configs = _readCurrentConfigs(rwe, addresses, maxWorkers)
+    writePCIConfigSnapshot(path, configs, compress)
+    return configs
+
+class PCIConfigSnapshot(object):
+    '''
+    Brief:
+        A PCI config space snapshot file opened for reading. Only the header and index are read up front;
+            each device's data is read (and decompressed) when it's looked up.
+    '''
+    def __init__(self, path):
+        '''
+        Brief:
+            Initializer for the snapshot. Opens the file and reads its index.
+        '''
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            magic, version, self.flags, count = struct.unpack(HEADER_FORMAT, self._file.read(HEADER_SIZE))
+            if magic != SNAPSHOT_MAGIC:
+                raise ValueError("%s is not a PCI config snapshot" % path)
+            if version != SNAPSHOT_VERSION:
+                raise ValueError("%s has unsupported snapshot version %d" % (path, version))
+
+            indexData = self._file.read(INDEX_ENTRY_SIZE * count)
+        except Exception:
+            self._file.close()
+            raise
+
+        self.index = collections.OrderedDict()
+        if len(indexData) != INDEX_ENTRY_SIZE * count:
+            self._file.close()
+            raise ValueError("%s is truncated: expected %d index entries" % (path, count))
+
+        for entryOffset in range(0, len(indexData), INDEX_ENTRY_SIZE):
+            bus, device, function, offset, length, storedLength = struct.unpack_from(INDEX_ENTRY_FORMAT, indexData, entryOffset)
+            self.index[PCILocation(bus, device, function)] = IndexEntry(offset, length, storedLength)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def close(self):
+        '''
+        Brief:
+            Closes the file
+        '''
+        self._file.close()
+
+    @property
+    def isCompressed(self):
+        return bool(self.flags & FLAG_COMPRESSED)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __contains__(self, address):
+        return PCILocation(*address) in self.index
+
+    def keys(self):
+        return list(self.index.keys())
+
+    def __getitem__(self, address):
+        '''
+        Brief:
+            Returns the saved config space data of the given PCILocation (raises KeyError if it wasn't saved)
+        '''
+        entry = self.index[PCILocation(*address)]
+        self._file.seek(entry.Offset)
+        data = self._file.read(entry.StoredLength)
+        return zlib.decompress(data) if self.isCompressed else data
+
+    def get(self, address, default=None):
+        try:
+            return self[address]
+        except KeyError:
+            return default
+
+    def toDict(self):
+        '''
+        Brief:
+            Returns a dict of every PCILocation to its saved config space data
+        '''
+        return collections.OrderedDict((address, self[address]) for address in self.index)
+
+def _diffConfigs(old, new, addresses, maxGap):
+    '''
+    Brief:
+        Returns a dict of PCILocation to a list of (start, end) ranges where the old and new data differ
+            With numpy, all same-length pairs are compared in one vectorized pass.
+    '''
+    ret = {}
+    if numpy is not None:
+        byLength = collections.defaultdict(list)
+        for address in addresses:
+            if len(old[address]) == len(new[address]):
+                byLength[len(old[address])].append(address)
+            elif old[address] != new[address]:
+                ret[address] = [(0, max(len(old[address]), len(new[address])))]
+
+        for length, group in byLength.items():
+            a = numpy.frombuffer(b''.join(old[x] for x in group), dtype=numpy.uint8).reshape(len(group), length)
+            b = numpy.frombuffer(b''.join(new[x] for x in group), dtype=numpy.uint8).reshape(len(group), length)
+            rows, columns = numpy.nonzero(a != b)
+            for row in numpy.unique(rows):
+                changed = columns[rows == row]
+                # split the changed byte offsets into consecutive runs
+                breaks = numpy.nonzero(numpy.diff(changed) != 1)[0] + 1
+                ranges = [(int(run[0]), int(run[-1]) + 1) for run in numpy.split(changed, breaks)]
+                ret[group[row]] = coalesceRanges(ranges, maxGap)
+        return ret
+
+    for address in addresses:
+        a, b = old[address], new[address]
+        if a == b:
+            continue
+        if len(a) != len(b):
+            ret[address] = [(0, max(len(a), len(b)))]
+        else:
+            ret[address] = diffBytes(bytearray(a), bytearray(b), maxGap=maxGap)
+    return ret
+
+def diffPCIConfigSnapshots(old, new, maxGap=0):
+    '''
+    Brief:
+        Diffs two snapshots (PCIConfigSnapshots or dicts of PCILocation to data). Returns a PCIConfigDiff:
+            Added: addresses only in new, Removed: addresses only in old,
+            Changed: dict of PCILocation to a list of (start, end) ranges that differ
+    '''
+    old = old.toDict() if isinstance(old, PCIConfigSnapshot) else dict((PCILocation(*a), bytes(d)) for a, d in old.items())
+    new = new.toDict() if isinstance(new, PCIConfigSnapshot) else dict((PCILocation(*a), bytes(d)) for a, d in new.items())
+
+    common = sorted(set(old) & set(new))
+    return PCIConfigDiff(
+        Added=sorted(set(new) - set(old)),
+        Removed=sorted(set(old) - set(new)),
+        Changed=_diffConfigs(old, new, common, maxGap),
+    )
+
+def restorePCIConfigSnapshot(rwe, snapshot, maxGap=0, maxWorkers=None):
+    '''
+    Brief:
+        Writes a snapshot back to the system. The current config space of the saved devices is read in one bulk pass
+            (bypassing the config cache) and only the differing byte ranges of differing devices are written, all of a device's
+            ranges at once (with writePCIRanges). Ranges aren't merged by default (maxGap=0) since rewriting unchanged bytes
+            would clear RW1C bits like Status; note rw.exe without ECAM can only write whole headers (see Backend.writePCIRanges).
+            Devices in the snapshot that aren't on the system anymore are skipped.
+            Returns a dict of PCILocation to the list of (start, end) ranges that were written.
+    '''
+    saved = snapshot.toDict() if isinstance(snapshot, PCIConfigSnapshot) else dict((PCILocation(*a), bytes(d)) for a, d in snapshot.items())
+    present = rwe.getPCITree()
+    current = _readCurrentConfigs(rwe, [a for a in sorted(saved) if a in present], maxWorkers)
+
+    changed = _diffConfigs(current, saved, sorted(current), maxGap)
+    for address, ranges in sorted(changed.items()):
+        data = saved[address]
+        rets = rwe.writePCIRanges(address.Bus, address.Device, address.Function, [(start, data[start:end]) for start, end in ranges], current[address])
+        for (start, end), ret in zip(ranges, rets):
+            if ret.ReturnCode != 0:
+                raise RuntimeError("Failed to restore 0x%X bytes at offset 0x%X of %s" % (end - start, start, str(address)))
+    return changed
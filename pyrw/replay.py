@@ -0,0 +1,75 @@
+'''
+Brief:
+    File for the replay backend: a ReadWriteEverything that serves RWE commands from a trace file instead of running rw.exe
+
+Author(s):
+    Charles Machalow
+'''
+import collections
+import threading
+
+from pyrw.backend import Backend, ProcessOutput
+from pyrw.rwe import ReadWriteEverything
+from pyrw.trace import PAYLOAD_LOAD, PAYLOAD_SAVE, TraceFile, getPayloadSlots, normalizeCommand, readPayloads
+
+class ReplayReadWriteEverything(ReadWriteEverything):
+    '''
+    Brief:
+        ReadWriteEverything that answers each RWE command with what rw.exe did when the trace was recorded.
+            Everything above callRWECommand (batching, scratch files, verification, parsing) is the real code.
+            Commands are matched on their text (with scratch paths normalized). A command that ran many times (like a status poll)
+                gets its recorded results in order, then the last one again if it runs more often than it did when recorded.
+            If strict is True, writes whose data differs from the recording raise ValueError.
+    '''
+    def __init__(self, tracePath, scratchDir=None, strict=False):
+        '''
+        Brief:
+            Initializer for the replay. Loads the whole trace into memory. Doesn't need rw.exe or admin.
+        '''
+        Backend.__init__(self)
+        self.tracePath = tracePath
+        self.scratchDir = scratchDir
+        self.recorder = None
+        self.strict = strict
+        self.exePath = None
+        self._validated = True
+        self._lock = threading.Lock()
+        self._records = collections.defaultdict(collections.deque)
+
+        with TraceFile(tracePath) as trace:
+            self.metadata = trace.metadata
+            for record in trace:
+                self._records[record.Command].append(record)
+
+        self.version = self.metadata.get('version', 'RW - Read Write Utility (replay of %s)' % tracePath)
+
+    def _getRecord(self, normalized):
+        '''
+        Brief:
+            Returns the next recorded result for the given normalized command
+        '''
+        with self._lock:
+            records = self._records.get(normalized)
+            if not records:
+                raise KeyError("The trace has no recording of: %s" % normalized)
+            return records.popleft() if len(records) > 1 else records[0]
+
+    def callRWECommand(self, cmd):
+        '''
+        Brief:
+            'Calls' an embeded RWE command by serving its recorded output, return code and SAVE files
+        '''
+        normalized, _ = normalizeCommand(cmd)
+        record = self._getRecord(normalized)
+
+        if self.strict:
+            for slot, data in readPayloads(cmd, PAYLOAD_LOAD).items():
+                if record.Loads.get(slot) != data:
+                    raise ValueError("Write data for slot %d of '%s' differs from the recording" % (slot, normalized))
+
+        for slot, kind, path in getPayloadSlots(cmd):
+            if kind == PAYLOAD_SAVE and slot in record.Saves:
+                with open(path, 'wb') as f:
+                    f.write(record.Saves[slot])
+
+        return ProcessOutput(Output=record.Output, ReturnCode=record.ReturnCode)
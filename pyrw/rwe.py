@@ -5,34 +5,36 @@ Brief:
 Author(s):
     Charles Machalow
 '''
-import collections
 import logging
-import os
 import subprocess
-import tempfile
 
 from ctypes import *
 
-from pyrw.rwe_parser import bytesToDWordList, pciTreeTextToDict, verifyAddress
-from pyrw.nvme import NVMeDevice, NVME_CLASS_CODE
+from pyrw.backend import Backend, ProcessOutput
+from pyrw.batch import RWEBatch
+from pyrw.exeinfo import getCachedExeInfo, getExeArchitecture, updateCachedExeInfo
+from pyrw.rwe_parser import pciTreeTextToDict
+from pyrw.trace import PAYLOAD_LOAD, TraceRecorder, readPayloads
+from pyrw.wait import monotonic
 
 logger = logging.getLogger(__name__)
 
-THIS_FOLDER = os.path.abspath(os.path.dirname(__file__))
-LOCAL_TMP_FILE = os.path.join(THIS_FOLDER, '__tmp.bin')
-ProcessOutput = collections.namedtuple("ProcessOutput", ["Output", "ReturnCode"])
-
-class ReadWriteEverything(object):
+class ReadWriteEverything(Backend):
     '''
     Brief:
-        Easy to use abstractions for RWE in Python
+        Easy to use abstractions for RWE in Python. This is the rw.exe (Windows) backend.
     '''
-    def __init__(self, exePath=None):
+    def __init__(self, exePath=None, scratchDir=None, validate=False):
         '''
         Brief:
             Initializer for the class. Takes the path to rw.exe
-                Ensures we have admin and that rw.exe seems to work
+                Ensures we have admin. Checking that rw.exe seems to work is deferred to the first command (or done now if validate is True).
+                scratchDir is where per-operation scratch files go (a RAM disk is a good choice). Defaults to the system temp folder.
         '''
+        Backend.__init__(self)
+        self.scratchDir = scratchDir
+        self.recorder = None
+        self._validated = False
 
         if exePath is None:
             # import here to prevent a circle
@@ -40,19 +42,33 @@ class ReadWriteEverything(object):
             exePath = findRWEverything()
 
         self.exePath = exePath
-        self.version = self.getRWEVersion()
 
         if not windll.shell32.IsUserAnAdmin():
             raise EnvironmentError("Please run as admin")
 
-        self._checkValidRWExe()
+        if validate:
+            self.validate()
+
+    def validate(self):
+        '''
+        Brief:
+            Makes sure rw.exe appears to work (once). A previous successful check of the same exe (same size and mtime) is reused from the on-disk cache.
+        '''
+        if self._validated:
+            return
+
+        if not getCachedExeInfo(self.exePath).get('valid'):
+            self._checkValidRWExe()
+            updateCachedExeInfo(self.exePath, valid=True)
+
+        self._validated = True
 
     def _checkValidRWExe(self):
         '''
         Brief:
             Does a stupidly silly check to see if rw.exe appears to work
         '''
-        r = self.callRWECommand("COUT Hello World;rwexit")
+        r = self.callRawCommand(self.getRWECommandArguments("COUT Hello World;rwexit"))
         if 'RW Exit' in r.Output and 'Hello World' in r.Output and r.ReturnCode:
             raise EnvironmentError("%s does not appear to be a valid RW-Everything exe" % self.exePath)
 
@@ -64,27 +80,45 @@ class ReadWriteEverything(object):
         if hasattr(self, 'version'):
             return self.version
 
-        version = subprocess.check_output('powershell "(Get-Item -path \\"%s\\").VersionInfo.FileVersion"' % self.exePath).strip().decode()
-        with open(self.exePath, 'rb') as f:
-            # https://superuser.com/questions/358434/how-to-check-if-a-binary-is-32-or-64-bit-on-windows
-            f.seek(0x204)
-            if f.read(1)[0] == 0x64:
-                b = 'x64'
-            else:
-                b = 'x86'
+        v = getCachedExeInfo(self.exePath).get('version')
+        if v is None:
+            version = subprocess.check_output('powershell "(Get-Item -path \\"%s\\").VersionInfo.FileVersion"' % self.exePath).strip().decode()
+            v = 'RW - Read Write Utility v%s %s' % (version, getExeArchitecture(self.exePath))
+            updateCachedExeInfo(self.exePath, version=v)
 
-        v = 'RW - Read Write Utility v%s %s' % (version, b)
         self.version = v
         logger.debug("RWE Version: %s" % v)
         return self.version
 
+    def getVersion(self):
+        '''
+        Brief:
+            Returns the RWE version string
+        '''
+        return self.getRWEVersion()
+
+    def getRawCommandLine(self, cmd):
+        '''
+        Brief:
+            Returns the full (shell) command line to call a Raw command on rw.exe
+        '''
+        return '\"%s\" %s' % (self.exePath, cmd)
+
+    def getRWECommandArguments(self, cmd):
+        '''
+        Brief:
+            Returns the rw.exe arguments to run an embeded RWE command
+        '''
+        return '/Min /Nologo /Stdout /Command="%s"' % (cmd.replace('\"', '\\"'))
+
     def callRawCommand(self, cmd):
         '''
         Brief:
             Calls a Raw command on rw.exe
         '''
-        fullCmd = '\"%s\" %s' % (self.exePath, cmd)
+        fullCmd = self.getRawCommandLine(cmd)
         logger.debug("Calling raw command: %s" % fullCmd)
+        start = monotonic()
         try:
             output = subprocess.check_output(fullCmd, shell=True, stderr=subprocess.STDOUT)
             retCode = 0
@@ -92,6 +126,9 @@ class ReadWriteEverything(object):
             output = ex.output
             retCode = ex.returncode
 
+        if self.instrumentation is not None:
+            self.instrumentation.recordSubprocessLaunch(monotonic() - start)
+
         ret = ProcessOutput(Output=output.decode(), ReturnCode=retCode)
         logger.debug("... Returned: %s" % str(ret))
         return ret
@@ -101,99 +138,121 @@ class ReadWriteEverything(object):
         Brief:
             Calls an embeded RWE command on rw.exe
         '''
-        fullCommand = '/Min /Nologo /Stdout /Command="%s"' % (cmd.replace('\"', '\\"'))
-        return self.callRawCommand(fullCommand)
+        self.validate()
+        if self.recorder is None:
+            return self.callRawCommand(self.getRWECommandArguments(cmd))
 
-    def readMemory(self, byteOffset, numBytes):
+        loads = readPayloads(cmd, PAYLOAD_LOAD)
+        ret = self.callRawCommand(self.getRWECommandArguments(cmd))
+        self.recorder.record(cmd, ret, loads)
+        return ret
+
+    def enableRecording(self, tracePath):
         '''
         Brief:
-            Reads raw memory from a given offset for a given number of bytes
+            Starts recording every RWE command (with its output, return code and SAVE/LOAD payloads) to the given trace file.
+                The trace can be served back with pyrw.replay.ReplayReadWriteEverything. Returns the TraceRecorder.
         '''
-        n = self.callRWECommand("SAVE \"%s\" Memory 0x%X %d" % (LOCAL_TMP_FILE, byteOffset, numBytes))
-        assert n.ReturnCode == 0, "Didn't return 0"
-        verifyAddress(byteOffset, n.Output)
+        self.disableRecording()
+        self.recorder = TraceRecorder(tracePath, {'version': self.getRWEVersion()})
+        return self.recorder
 
-        with open(LOCAL_TMP_FILE, 'rb') as f:
-            data = f.read()
-        os.remove(LOCAL_TMP_FILE)
-        return data
+    def disableRecording(self):
+        '''
+        Brief:
+            Stops recording and finishes the trace file
+        '''
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
 
-    def writeMemory(self, byteOffset, data):
+    def batch(self):
         '''
         Brief:
-            Writes given data to the given offset of memory
+            Returns a RWEBatch to queue many reads/writes into as few rw.exe launches as possible.
+                Use as a context manager; each queued operation's Result is filled in when the with block exits.
         '''
-        with open(LOCAL_TMP_FILE, 'wb') as f:
-            f.write(bytearray(data))
+        return RWEBatch(self, scratchDir=self.scratchDir)
 
-        ret = self.callRWECommand('LOAD "%s" Memory %d' % (LOCAL_TMP_FILE, byteOffset))
-        verifyAddress(byteOffset, ret.Output)
+    def _runOperation(self, name, *args):
+        '''
+        Brief:
+            Runs a single operation as a one-operation batch and returns its Result.
+                Each batch uses its own scratch folder, so operations from many threads don't clash.
+        '''
+        with self.batch() as b:
+            op = getattr(b, name)(*args)
+        return op.Result
 
-        os.remove(LOCAL_TMP_FILE)
-        return ret
+    def _readMemory(self, byteOffset, numBytes):
+        '''
+        Brief:
+            Reads raw memory from a given offset for a given number of bytes
+        '''
+        return self._runOperation('readMemory', byteOffset, numBytes)
 
-    def readPCI(self, bus, device, function):
+    def _writeMemory(self, byteOffset, data):
+        '''
+        Brief:
+            Writes given data to the given offset of memory
+        '''
+        return self._runOperation('writeMemory', byteOffset, data)
+
+    def _readPCI(self, bus, device, function):
         '''
         Brief:
             Reads PCI header (configuration space) data from the given device
         '''
-        n = self.callRWECommand("SAVE \"%s\" PCI %d %d %d" % (LOCAL_TMP_FILE, bus, device, function))
-        assert n.ReturnCode == 0, "Didn't return 0"
-        with open(LOCAL_TMP_FILE, 'rb') as f:
-            data = f.read()
-        os.remove(LOCAL_TMP_FILE)
-        return data
+        return self._runOperation('readPCI', bus, device, function)
 
-    def writePCI(self, bus, device, function, data):
+    def _writePCI(self, bus, device, function, data):
         '''
         Brief:
             Writes given PCI (configuration space) data to a given device
         '''
-        with open(LOCAL_TMP_FILE, 'wb') as f:
-            f.write(bytearray(data))
+        return self._runOperation('writePCI', bus, device, function, data)
 
-        ret = self.callRWECommand('LOAD "%s" Memory %d %d %d' % (LOCAL_TMP_FILE, bus, device, function))
-        os.remove(LOCAL_TMP_FILE)
-        return ret
-
-    def getPCIBarAddresses(self, bus, device, function):
+    def _readPCIMany(self, addresses, maxWorkers=None):
         '''
         Brief:
-            Gets a list of BAR addresses for the given device
+            Reads config space for many devices with a single batch (so usually a single rw.exe launch).
+                maxWorkers is ignored since there is only one launch to make.
         '''
-        pciRegisters = self.readPCI(bus, device, function)
-        pciRegistersAsDWords = bytesToDWordList(pciRegisters[0x10:])
-        return [((x >> 4) << 4) for x in pciRegistersAsDWords[:6]] # 6 bars max
+        with self.batch() as b:
+            ops = [b.readPCI(*a) for a in addresses]
+        return [op.Result for op in ops]
 
-    def getPCITree(self):
+    def _readMemoryMany(self, ranges):
         '''
         Brief:
-            Parses the system's PCI devices to a dictionary
+            Reads many (byteOffset, numBytes) ranges with a single batch (so usually a single rw.exe launch)
         '''
-        n = self.callRWECommand('PCITREE')
-        assert n.ReturnCode == 0, "Didn't return 0"
-        return pciTreeTextToDict(n.Output)
+        with self.batch() as b:
+            ops = [b.readMemory(byteOffset, numBytes) for byteOffset, numBytes in ranges]
+        return [op.Result for op in ops]
 
-    def getPCIClassCode(self, bus, device, function):
+    def _writeMemoryMany(self, writes):
         '''
         Brief:
-            Gets the PCI class code for a given device
+            Writes many (byteOffset, data) pairs with a single batch (so usually a single rw.exe launch)
         '''
-        d = self.readPCI(bus, device, function)
-        return bytesToDWordList(d[0x09:0x0D])[0] & 0xFFFFFF
+        with self.batch() as b:
+            ops = [b.writeMemory(byteOffset, data) for byteOffset, data in writes]
+        return [op.Result for op in ops]
 
-    def getNVMeDevices(self):
+    def _getPCITree(self):
         '''
         Brief:
-            Returns a list of all NVMe devices on the system
+            Parses the system's PCI devices to a dictionary
         '''
-        nvmeDevices = []
-        for address in self.getPCITree().keys():
-            testClassCode = self.getPCIClassCode(address.Bus, address.Device, address.Function)
-            if testClassCode == NVME_CLASS_CODE:
-                nvmeDevices.append(NVMeDevice(self, address))
+        n = self.callRWECommand('PCITREE')
+        assert n.ReturnCode == 0, "Didn't return 0"
 
-        return nvmeDevices
+        start = monotonic()
+        ret = pciTreeTextToDict(n.Output)
+        if self.instrumentation is not None:
+            self.instrumentation.record('parsePCITree', monotonic() - start)
+        return ret
 
 if __name__ == '__main__':
     rwe = ReadWriteEverything()
\ No newline at end of file
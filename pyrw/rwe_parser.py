@@ -7,11 +7,20 @@ Author(s):
 '''
 import collections
 import re
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 PCI_DEVICE_LINE_REGEX = r'Bus (\w*), Device (\w*), Function (\w*) \- (.*)'
 RWE_ADDRESS_REGEX = r' Address=(\w*?), '
 PCILocation = collections.namedtuple("PCILocation", ['Bus', 'Device', 'Function'])
 
+# width in bytes -> struct format character (used little-endian)
+WIDTH_FORMATS = {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}
+
 def getBinaryFromHexDump(hexDumpStr):
     '''
     Brief:
@@ -21,25 +30,88 @@ def getBinaryFromHexDump(hexDumpStr):
     lines = [line for line in lines if line[0] != ' '] # remove spaced lines
     lines = [line for line in lines if line[1] != 'u'] # remove dump lines
     lines = [line for line in lines if line[2] != 'r'] # remove parameter error lines
-    ret = []
-    for line in lines:
-        line = line.split(' ', 1)[1] # remove index
-        line = line.split('\t')[0]   # remove ascii
-        ret += [int(c, 16) for c in line.split()]
+    # remove index and ascii then let fromhex parse all the hex bytes in one go
+    return bytearray.fromhex(' '.join(line.split(' ', 1)[1].split('\t')[0] for line in lines))
+
+def bytesToIntList(b, width, asNumpy=False):
+    '''
+    Brief:
+        Convert bytes to a list of little-endian unsigned ints of the given width (1, 2, 4 or 8 bytes).
+            A partial trailing int is zero-padded instead of raising.
+            If asNumpy is True, returns a numpy array instead of a list (needs numpy).
+    '''
+    b = bytes(bytearray(b))
+    remainder = len(b) % width
+    if remainder:
+        b += b'\x00' * (width - remainder)
+
+    if asNumpy:
+        if numpy is None:
+            raise ImportError("numpy is needed for asNumpy=True")
+        return numpy.frombuffer(b, dtype='<u%d' % width)
 
-    return bytearray(ret)
+    return list(struct.unpack('<%d%s' % (len(b) // width, WIDTH_FORMATS[width]), b))
 
-def bytesToDWordList(b):
+def bytesToByteList(b, asNumpy=False):
+    '''
+    Brief:
+        Convert a list of bytes to a list of Bytes (ints)
+    '''
+    return bytesToIntList(b, 1, asNumpy)
+
+def bytesToWordList(b, asNumpy=False):
+    '''
+    Brief:
+        Convert a list of bytes to a list of Words
+    '''
+    return bytesToIntList(b, 2, asNumpy)
+
+def bytesToDWordList(b, asNumpy=False):
     '''
     Brief:
         Convert a list of bytes to a list of DWords
     '''
-    ret = []
-    for idx in range(0, len(b), 4):
-        d = b[idx] + (b[idx + 1] << 8) + (b[idx + 2] << 16) + (b[idx + 3] << 24)
-        ret.append(d)
+    return bytesToIntList(b, 4, asNumpy)
+
+def bytesToQWordList(b, asNumpy=False):
+    '''
+    Brief:
+        Convert a list of bytes to a list of QWords
+    '''
+    return bytesToIntList(b, 8, asNumpy)
 
-    return ret
+def getPCIClassCodeFromConfig(config):
+    '''
+    Brief:
+        Returns the class code from already-read PCI configuration space data
+    '''
+    return bytesToDWordList(config[0x09:0x0D])[0] & 0xFFFFFF
+
+def getPCIBarAddressesFromConfig(config):
+    '''
+    Brief:
+        Returns the list of (6) BAR addresses from already-read PCI configuration space data
+    '''
+    return [((x >> 4) << 4) for x in bytesToDWordList(config[0x10:0x28])]
+
+def getPCIIdsFromConfig(config):
+    '''
+    Brief:
+        Returns a (VendorId, DeviceId) tuple from already-read PCI configuration space data
+    '''
+    d = bytesToDWordList(config[0x00:0x04])[0]
+    return d & 0xFFFF, d >> 16
+
+def getPCIBridgeBusesFromConfig(config):
+    '''
+    Brief:
+        Returns a (SecondaryBus, SubordinateBus) tuple from already-read PCI configuration space data if the device is a
+            PCI-to-PCI bridge (header type 1), otherwise None
+    '''
+    if bytearray(config[0x0E:0x0F])[0] & 0x7F != 1:
+        return None
+    config = bytearray(config)
+    return config[0x19], config[0x1A]
 
 def pciTreeTextToDict(txt):
     '''
@@ -67,3 +139,17 @@ def verifyAddress(address, rweOutput):
     rweAddr = int(m[0], 16)
     if address != rweAddr:
         raise RuntimeError("RWE Didn't process the correct address! It processed: 0x%X instead of 0x%X" % (rweAddr, address))
+
+def verifyAddresses(addresses, rweOutput):
+    '''
+    Brief:
+        Verifies that the given addresses were all processed (in order) according to the RWE output of a multi-command script.
+            The Nth address in the output is compared with the Nth given address (only memory commands print one).
+            Raises if an address is missing or mismatched.
+    '''
+    rweAddrs = [int(m, 16) for m in re.findall(RWE_ADDRESS_REGEX, rweOutput)]
+    for idx, address in enumerate(addresses):
+        if idx >= len(rweAddrs):
+            raise RuntimeError("RWE Didn't process the correct address! It never processed: 0x%X" % address)
+        if rweAddrs[idx] != address:
+            raise RuntimeError("RWE Didn't process the correct address! It processed: 0x%X instead of 0x%X" % (rweAddrs[idx], address))
@@ -0,0 +1,406 @@
+'''
+Brief:
+    File for the register sampler: polls a set of registers at a target rate into per-signal ring buffers
+        and (optionally) a compact columnar sample file. Also the 'python -m pyrw monitor' command line.
+
+    Sample file layout (all little-endian):
+        Header: magic (8 bytes), metadata length (u32), metadata (UTF-8 JSON with the signals)
+        Chunks, each: signal index (u32), sample count (u32), timestamps (f64 each, seconds since the run started), values (width bytes each)
+
+Author(s):
+    Charles Machalow
+'''
+import argparse
+import array
+import collections
+import json
+import re
+import struct
+import sys
+import time
+
+from pyrw.backend import ARRAY_TYPECODES
+from pyrw.capabilities import CAP_ID_PCIE, PCIE_LINK_STATUS_OFFSET
+from pyrw.nvme import NVMeControllerRegisters
+from pyrw.pci import PCIDevice
+from pyrw.rwe_parser import PCILocation, WIDTH_FORMATS, bytesToIntList
+from pyrw.wait import monotonic
+
+SAMPLE_FILE_MAGIC = b'PYRWSMP\x00'
+DEFAULT_RING_CAPACITY = 4096
+
+# A register to sample. Memory signals have Location None and Address is a physical address.
+#   Config space signals have a PCILocation and Address is the offset into the device's config space.
+Signal = collections.namedtuple("Signal", ['Name', 'Address', 'Width', 'Location'])
+SamplerStats = collections.namedtuple("SamplerStats", ['Ticks', 'MissedDeadlines', 'Elapsed', 'TargetRate', 'AchievedRate', 'Stored'])
+
+def memorySignal(name, address, width=4):
+    '''
+    Brief:
+        Returns a Signal for a register in physical memory
+    '''
+    return Signal(name, address, width, None)
+
+def configSignal(name, location, offset, width=4):
+    '''
+    Brief:
+        Returns a Signal for a register in a device's config space
+    '''
+    return Signal(name, offset, width, PCILocation(*location))
+
+class RingBuffer(object):
+    '''
+    Brief:
+        Fixed-size, array-backed buffer of (timestamp, value) samples. Once full, new samples overwrite the oldest.
+    '''
+    def __init__(self, capacity, width):
+        '''
+        Brief:
+            Initializer for the buffer. width is the size of each value in bytes (1, 2, 4 or 8).
+        '''
+        self.capacity = capacity
+        self.timestamps = array.array('d', [0.0]) * capacity
+        self.values = _newValueArray(width, [0]) * capacity
+        self.start = 0
+        self.count = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self.count
+
+    def isFull(self):
+        return self.count == self.capacity
+
+    def append(self, timestamp, value):
+        '''
+        Brief:
+            Adds a sample (overwriting the oldest one if full)
+        '''
+        idx = (self.start + self.count) % self.capacity
+        self.timestamps[idx] = timestamp
+        self.values[idx] = value
+        if self.count < self.capacity:
+            self.count += 1
+        else:
+            self.start = (self.start + 1) % self.capacity
+            self.dropped += 1
+
+    def getArrays(self):
+        '''
+        Brief:
+            Returns (timestamps, values) arrays in order from oldest to newest
+        '''
+        end = self.start + self.count
+        if end <= self.capacity:
+            return self.timestamps[self.start:end], self.values[self.start:end]
+        wrap = end - self.capacity
+        return self.timestamps[self.start:] + self.timestamps[:wrap], self.values[self.start:] + self.values[:wrap]
+
+    def drain(self):
+        '''
+        Brief:
+            Returns (timestamps, values) like getArrays() and empties the buffer
+        '''
+        ret = self.getArrays()
+        self.start = 0
+        self.count = 0
+        return ret
+
+class SampleFileWriter(object):
+    '''
+    Brief:
+        Writes a columnar sample file: one chunk of timestamps and one of values per signal per flush
+    '''
+    def __init__(self, path, signals, metadata=None):
+        '''
+        Brief:
+            Initializer for the writer. Creates (or overwrites) the file.
+        '''
+        self.path = path
+        self.signals = signals
+        self._file = open(path, 'wb')
+
+        meta = dict(metadata or {})
+        meta['signals'] = [{'name': s.Name, 'address': s.Address, 'width': s.Width, 'location': s.Location} for s in signals]
+        meta = json.dumps(meta).encode('utf-8')
+        self._file.write(SAMPLE_FILE_MAGIC + struct.pack('<I', len(meta)) + meta)
+
+    def writeChunk(self, signalIndex, timestamps, values):
+        '''
+        Brief:
+            Writes a chunk of samples for one signal
+        '''
+        if not len(timestamps):
+            return
+        self._file.write(struct.pack('<II', signalIndex, len(timestamps)))
+        self._file.write(_arrayToBytes(_toLittleEndian(timestamps)))
+        width = self.signals[signalIndex].Width
+        if isinstance(values, array.array):
+            self._file.write(_arrayToBytes(_toLittleEndian(values)))
+        else:
+            self._file.write(struct.pack('<%d%s' % (len(values), WIDTH_FORMATS[width]), *values))
+
+    def close(self):
+        self._file.close()
+
+def _newValueArray(width, values=()):
+    '''
+    Brief:
+        Returns an array.array of unsigned ints of the given width holding values,
+            or a list if the array module has no typecode for that width (8 bytes on some Python 2 builds)
+    '''
+    typecode = ARRAY_TYPECODES[width]
+    return list(values) if typecode is None else array.array(typecode, values)
+
+def _arrayToBytes(a):
+    # array.tobytes is tostring on Python 2
+    return a.tobytes() if hasattr(a, 'tobytes') else a.tostring()
+
+def _arrayFromBytes(a, data):
+    # array.frombytes is fromstring on Python 2
+    if hasattr(a, 'frombytes'):
+        a.frombytes(data)
+    else:
+        a.fromstring(data)
+
+def _toLittleEndian(a):
+    if sys.byteorder == 'little':
+        return a
+    a = array.array(a.typecode, a)
+    a.byteswap()
+    return a
+
+def readSampleFile(path):
+    '''
+    Brief:
+        Reads a sample file. Returns (signals, data) where data is a dict of signal name to (timestamps, values) arrays.
+    '''
+    with open(path, 'rb') as f:
+        if f.read(len(SAMPLE_FILE_MAGIC)) != SAMPLE_FILE_MAGIC:
+            raise ValueError("%s is not a pyrw sample file" % path)
+        metaLength = struct.unpack('<I', f.read(4))[0]
+        meta = json.loads(f.read(metaLength).decode('utf-8'))
+
+        signals = [Signal(s['name'], s['address'], s['width'], None if s['location'] is None else PCILocation(*s['location'])) for s in meta['signals']]
+        data = collections.OrderedDict((s.Name, (array.array('d'), _newValueArray(s.Width))) for s in signals)
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                break
+
+            signalIndex, count = struct.unpack('<II', header)
+            signal = signals[signalIndex]
+            timestamps, values = data[signal.Name]
+            chunkTimestamps = array.array('d')
+            _arrayFromBytes(chunkTimestamps, f.read(8 * count))
+            if sys.byteorder != 'little':
+                chunkTimestamps.byteswap()
+            timestamps.extend(chunkTimestamps)
+
+            chunkData = f.read(signal.Width * count)
+            if isinstance(values, array.array):
+                chunkValues = array.array(values.typecode)
+                _arrayFromBytes(chunkValues, chunkData)
+                if sys.byteorder != 'little':
+                    chunkValues.byteswap()
+                values.extend(chunkValues)
+            else:
+                values.extend(bytesToIntList(chunkData, signal.Width))
+
+    return signals, data
+
+class Sampler(object):
+    '''
+    Brief:
+        Polls a list of Signals at a target rate. Each tick reads every memory signal with one readMemoryMany call
+            (one rw.exe launch) and each config space signal with readPCIRange.
+            Samples go into a RingBuffer per signal. If a writer is given, full buffers are flushed to it (nothing is lost),
+                otherwise the oldest samples are overwritten.
+            With edgeOnly, a sample is only stored when the value changed (the first sample is always stored).
+    '''
+    def __init__(self, rwe, signals, rateHz, capacity=DEFAULT_RING_CAPACITY, edgeOnly=False, writer=None):
+        '''
+        Brief:
+            Initializer for the sampler
+        '''
+        self.rwe = rwe
+        self.signals = list(signals)
+        self.rateHz = rateHz
+        self.edgeOnly = edgeOnly
+        self.writer = writer
+        self.buffers = [RingBuffer(capacity, s.Width) for s in self.signals]
+        self.ticks = 0
+        self.missedDeadlines = 0
+        self.stored = 0
+        self._lastValues = [None] * len(self.signals)
+        self._memoryIndexes = [i for i, s in enumerate(self.signals) if s.Location is None]
+        self._memoryRanges = [(self.signals[i].Address, self.signals[i].Width) for i in self._memoryIndexes]
+        self._configIndexes = [i for i, s in enumerate(self.signals) if s.Location is not None]
+        self._startTime = None
+
+    @property
+    def elapsed(self):
+        '''
+        Brief:
+            Returns the seconds since the first tick (0.0 before it), the time base of sample timestamps
+        '''
+        return 0.0 if self._startTime is None else monotonic() - self._startTime
+
+    def tick(self):
+        '''
+        Brief:
+            Reads every signal once and stores the samples. Returns the list of values read.
+        '''
+        if self._startTime is None:
+            self._startTime = monotonic()
+
+        values = [None] * len(self.signals)
+        for idx, data in zip(self._memoryIndexes, self.rwe.readMemoryMany(self._memoryRanges)):
+            values[idx] = bytesToIntList(data, self.signals[idx].Width)[0]
+        for idx in self._configIndexes:
+            signal = self.signals[idx]
+            values[idx] = bytesToIntList(self.rwe.readPCIRange(*(signal.Location + (signal.Address, signal.Width))), signal.Width)[0]
+
+        timestamp = monotonic() - self._startTime
+        for idx, value in enumerate(values):
+            if self.edgeOnly and value == self._lastValues[idx]:
+                continue
+
+            self._lastValues[idx] = value
+            buffer = self.buffers[idx]
+            if self.writer is not None and buffer.isFull():
+                self.writer.writeChunk(idx, *buffer.drain())
+            buffer.append(timestamp, value)
+            self.stored += 1
+
+        self.ticks += 1
+        return values
+
+    def flush(self):
+        '''
+        Brief:
+            Writes everything buffered to the writer (if there is one)
+        '''
+        if self.writer is not None:
+            for idx, buffer in enumerate(self.buffers):
+                self.writer.writeChunk(idx, *buffer.drain())
+
+    def run(self, durationSeconds=None, numTicks=None, callback=None):
+        '''
+        Brief:
+            Ticks at the target rate until durationSeconds pass or numTicks ticks are done (or forever if neither is given).
+                Ticks are scheduled on a fixed grid. If a tick runs past the next deadline, the missed deadlines are counted and skipped.
+                callback(sampler, values) is called after each tick. Returns SamplerStats.
+        '''
+        period = 1.0 / self.rateHz
+        start = monotonic()
+        startTicks = self.ticks
+        nextDeadline = start
+        try:
+            while (numTicks is None or self.ticks - startTicks < numTicks) and (durationSeconds is None or monotonic() - start < durationSeconds):
+                now = monotonic()
+                if now < nextDeadline:
+                    time.sleep(nextDeadline - now)
+
+                values = self.tick()
+                if callback is not None:
+                    callback(self, values)
+
+                nextDeadline += period
+                now = monotonic()
+                if now > nextDeadline:
+                    missed = int((now - nextDeadline) / period) + 1
+                    self.missedDeadlines += missed
+                    nextDeadline += missed * period
+        finally:
+            self.flush()
+
+        elapsed = monotonic() - start
+        ticks = self.ticks - startTicks
+        return SamplerStats(
+            Ticks=ticks,
+            MissedDeadlines=self.missedDeadlines,
+            Elapsed=elapsed,
+            TargetRate=self.rateHz,
+            AchievedRate=ticks / elapsed if elapsed else 0.0,
+            Stored=self.stored,
+        )
+
+def parseSignalSpec(rwe, spec):
+    '''
+    Brief:
+        Parses a command line signal spec to a list of Signals:
+            ADDRESS[:WIDTH]             physical memory (width defaults to 4)
+            BB:DD.F:REGISTER            NVMe controller register by name (e.g. 01:00.0:CSTS)
+            BB:DD.F:OFFSET[:WIDTH]      offset into BAR0 (e.g. 01:00.0:0x1000)
+            BB:DD.F:linkstatus          PCIe Link Status (config space)
+            nvme:REGISTER               the register on every NVMe device
+    '''
+    parts = spec.split(':')
+    if parts[0].lower() == 'nvme':
+        devices = rwe.getNVMeDevices()
+        return sum([parseSignalSpec(rwe, '%02X:%02X.%X:%s' % (tuple(d.address) + (parts[1],))) for d in devices], [])
+
+    m = re.match(r'^([0-9a-fA-F]{1,2}):([0-9a-fA-F]{1,2})\.([0-7]):(.*)$', spec)
+    if m is None:
+        width = int(parts[1], 0) if len(parts) > 1 else 4
+        return [memorySignal(spec, int(parts[0], 0), width)]
+
+    location = PCILocation(int(m.group(1), 16), int(m.group(2), 16), int(m.group(3), 16))
+    register = m.group(4).split(':')
+    if register[0].lower() == 'linkstatus':
+        offset = PCIDevice(rwe, location).getCapabilityIndex().getOffset(CAP_ID_PCIE)
+        if offset is None:
+            raise ValueError("%s doesn't have a PCIe capability" % spec)
+        return [configSignal(spec, location, offset + PCIE_LINK_STATUS_OFFSET, 2)]
+
+    bar0 = rwe.getPCIBarAddresses(*location)[0]
+    if hasattr(NVMeControllerRegisters, register[0]):
+        field = getattr(NVMeControllerRegisters, register[0])
+        return [memorySignal(spec, bar0 + field.offset, field.size)]
+
+    width = int(register[1], 0) if len(register) > 1 else 4
+    return [memorySignal(spec, bar0 + int(register[0], 0), width)]
+
+def main(argv, rwe):
+    '''
+    Brief:
+        Runs the 'monitor' command line mode with the given backend: samples signals headless and reports on them
+    '''
+    parser = argparse.ArgumentParser(prog='python -m pyrw monitor', description='Sample registers at a fixed rate')
+    parser.add_argument('signals', nargs='+', help='Signals to sample (ADDRESS[:WIDTH], BB:DD.F:REGISTER, BB:DD.F:OFFSET[:WIDTH], BB:DD.F:linkstatus or nvme:REGISTER)')
+    parser.add_argument('--rate', type=float, default=10.0, help='Target samples per second')
+    parser.add_argument('--duration', type=float, default=None, help='Seconds to run (default: until Ctrl+C)')
+    parser.add_argument('--output', default=None, help='Sample file to write')
+    parser.add_argument('--capacity', type=int, default=DEFAULT_RING_CAPACITY, help='Samples buffered per signal')
+    parser.add_argument('--edge', action='store_true', help='Only store samples whose value changed')
+    parser.add_argument('--quiet', action='store_true', help="Don't print changed values as they happen")
+    args = parser.parse_args(argv)
+
+    signals = sum([parseSignalSpec(rwe, s) for s in args.signals], [])
+    writer = SampleFileWriter(args.output, signals, {'rate': args.rate, 'edgeOnly': args.edge}) if args.output else None
+    sampler = Sampler(rwe, signals, args.rate, args.capacity, args.edge, writer)
+
+    lastValues = [None] * len(signals)
+
+    def printChanges(sampler, values):
+        for idx, value in enumerate(values):
+            if value != lastValues[idx]:
+                print('%12.6f %-32s 0x%X' % (sampler.elapsed, signals[idx].Name, value))
+                lastValues[idx] = value
+
+    try:
+        stats = sampler.run(args.duration, callback=None if args.quiet else printChanges)
+    except KeyboardInterrupt:
+        stats = None
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if stats is None:
+        elapsed = sampler.elapsed
+        stats = SamplerStats(sampler.ticks, sampler.missedDeadlines, elapsed, args.rate, sampler.ticks / elapsed if elapsed else 0.0, sampler.stored)
+
+    print('Ticks: %d, missed deadlines: %d, achieved rate: %.2f/s (target %.2f/s), samples stored: %d' % (
+        stats.Ticks, stats.MissedDeadlines, stats.AchievedRate, stats.TargetRate, stats.Stored))
+    return 0
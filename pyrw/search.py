@@ -0,0 +1,135 @@
+'''
+Brief:
+    File for searching memory for byte patterns (exact or with wildcard/masked bytes) while streaming it in chunks
+
+Author(s):
+    Charles Machalow
+'''
+import collections
+import re
+
+SearchMatch = collections.namedtuple("SearchMatch", ['Address', 'PatternIndex'])
+
+# hex text patterns are text: unicode on Python 2 (where str is bytes), str on Python 3
+TEXT_TYPE = type(u'')
+
+class BytePattern(object):
+    '''
+    Brief:
+        A byte pattern where each byte has a mask: only bits set in the mask have to match (mask 0 is a wildcard byte).
+            Matches are found with a compiled bytes regex (using a lookahead so overlapping matches are all found).
+    '''
+    def __init__(self, value, mask=None):
+        '''
+        Brief:
+            Initializer for the pattern. value is bytes. mask is bytes of the same length (all 0xFF, an exact match, if None).
+        '''
+        self.value = bytes(bytearray(value))
+        self.mask = b'\xff' * len(self.value) if mask is None else bytes(bytearray(mask))
+        if not self.value:
+            raise ValueError("Patterns can't be empty")
+        if len(self.mask) != len(self.value):
+            raise ValueError("The mask must be as long as the pattern")
+
+        self.regex = re.compile(b'(?=' + b''.join(_byteRegex(v, m) for v, m in zip(bytearray(self.value), bytearray(self.mask))) + b')', re.DOTALL)
+
+    @classmethod
+    def fromString(cls, text):
+        '''
+        Brief:
+            Makes a pattern from hex text like '52 53 44 ?? 50 3?' where ?? is any byte and ? is any nibble
+        '''
+        value = bytearray()
+        mask = bytearray()
+        for token in text.split():
+            if len(token) != 2:
+                raise ValueError("Bad pattern byte: %s" % token)
+            value.append(int(token.replace('?', '0'), 16))
+            mask.append((0x00 if token[0] == '?' else 0xF0) | (0x00 if token[1] == '?' else 0x0F))
+        return cls(value, mask)
+
+    def __len__(self):
+        return len(self.value)
+
+    def __repr__(self):
+        return '<BytePattern %s>' % ' '.join(_byteText(v, m) for v, m in zip(bytearray(self.value), bytearray(self.mask)))
+
+def _byteText(value, mask):
+    '''
+    Brief:
+        Returns the hex text for one pattern byte ('?' for a wildcard nibble, '..' for other partial masks)
+    '''
+    high = '?' if mask & 0xF0 == 0 else ('%X' % (value >> 4) if mask & 0xF0 == 0xF0 else None)
+    low = '?' if mask & 0x0F == 0 else ('%X' % (value & 0xF) if mask & 0x0F == 0x0F else None)
+    return '..' if high is None or low is None else high + low
+
+def _byteRegex(value, mask):
+    '''
+    Brief:
+        Returns the bytes regex matching one byte with the given value/mask
+    '''
+    if mask == 0xFF:
+        return re.escape(bytes(bytearray([value])))
+    if mask == 0:
+        return b'.'
+    return b'[' + b''.join(re.escape(bytes(bytearray([b]))) for b in range(256) if b & mask == value & mask) + b']'
+
+def toPattern(pattern):
+    '''
+    Brief:
+        Converts bytes, hex text (see BytePattern.fromString) or a (value, mask) tuple to a BytePattern.
+            On Python 2 a str is bytes; pass hex text as unicode there (u'44 53 ??').
+    '''
+    if isinstance(pattern, BytePattern):
+        return pattern
+    if isinstance(pattern, TEXT_TYPE):
+        return BytePattern.fromString(pattern)
+    if isinstance(pattern, tuple):
+        return BytePattern(*pattern)
+    return BytePattern(pattern)
+
+def searchChunks(chunks, byteOffset, patterns, maxHits=None, alignment=1):
+    '''
+    Brief:
+        Generator of SearchMatches (in address order) for the given patterns in a stream of consecutive chunks starting at byteOffset.
+            The end of each chunk is kept so matches spanning two chunks are found. Stops after maxHits matches.
+            Only matches at addresses that are multiples of alignment are reported.
+            Matches starting near the end of a chunk are held back until the next chunk is searched, since a longer pattern
+                spanning the boundary can still match before them.
+    '''
+    patterns = [toPattern(p) for p in patterns]
+    overlap = max(len(p) for p in patterns) - 1
+    hits = 0
+    tail = b''
+    tailAddress = byteOffset
+    heldBack = []
+    for chunk in chunks:
+        buffer = tail + bytes(chunk)
+        found = heldBack
+        for patternIndex, pattern in enumerate(patterns):
+            for m in pattern.regex.finditer(buffer):
+                start = m.start()
+                # matches that fit in the kept tail were found with the previous chunk
+                if start + len(pattern) > len(tail) and start + len(pattern) <= len(buffer):
+                    address = tailAddress + start
+                    if address % alignment == 0:
+                        found.append(SearchMatch(address, patternIndex))
+
+        # matches not found yet have to end past this buffer, so they start at or after safeAddress
+        keep = min(overlap, len(buffer))
+        safeAddress = tailAddress + len(buffer) - keep
+        heldBack = sorted(m for m in found if m.Address >= safeAddress)
+        for match in sorted(m for m in found if m.Address < safeAddress):
+            yield match
+            hits += 1
+            if maxHits is not None and hits >= maxHits:
+                return
+
+        tail = buffer[len(buffer) - keep:] if keep else b''
+        tailAddress = safeAddress
+
+    for match in heldBack:
+        yield match
+        hits += 1
+        if maxHits is not None and hits >= maxHits:
+            return
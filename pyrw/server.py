@@ -0,0 +1,614 @@
+'''
+Brief:
+    File for the pyrw server: a long-lived process that owns a backend and serves it to many scripts over a local socket,
+        and the client backend that talks to it.
+
+    Messages are a 4 byte little-endian length followed by that much UTF-8 JSON.
+        Requests: {"id": n, "method": name, "args": [...]}
+        Responses: {"id": n, "result": ...} or {"id": n, "error": [exceptionTypeName, message]}
+    Requests on one connection may be pipelined (sent without waiting); responses can come back in any order.
+        The server keeps each connection's writes in order with its other requests: a write starts once every earlier request
+        from that connection has completed, and a request sent after a write starts once that write has completed.
+        Reads between two writes run concurrently. A malformed request gets an error response; the connection stays open.
+
+    Unix sockets are only accessible to the user running the server. TCP (used where there are no Unix sockets) is
+        authenticated: the server writes a random token to a file only its user can read (see getTokenPath) and the
+        first message on a TCP connection must be {"auth": token}. The server answers {"auth": true} or closes the connection.
+
+    Run with: python -m pyrw.server [--address PATH_OR_PORT]
+
+Author(s):
+    Charles Machalow
+'''
+import argparse
+import base64
+import binascii
+import hmac
+import json
+import logging
+import os
+import socket
+import struct
+import sys
+import threading
+
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from pyrw.backend import Backend, ProcessOutput, pciConfigsToDeviceInfos
+from pyrw.rwe_parser import PCILocation
+from pyrw.topology import PCITopology
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET_PATH = os.path.join(os.environ.get('XDG_RUNTIME_DIR') or os.environ.get('TEMP') or '/tmp', 'pyrw.sock')
+DEFAULT_TCP_ADDRESS = ('127.0.0.1', 47823)
+DEFAULT_ADDRESS = DEFAULT_SOCKET_PATH if hasattr(socket, 'AF_UNIX') else DEFAULT_TCP_ADDRESS
+DEFAULT_MAX_WORKERS = 16
+
+LENGTH_FORMAT = '<I'
+LENGTH_SIZE = struct.calcsize(LENGTH_FORMAT)
+
+TOKEN_SIZE = 32
+
+# methods that only read, so identical concurrent calls can share one backend operation
+COALESCED_METHODS = frozenset(['readMemory', 'readMemoryMany', 'readPCI', 'readPCIExtended', 'readPCIRange', 'readPCIMany', 'getPCITree', 'getVersion', 'getPCITopology'])
+
+# methods the server exposes (all are Backend methods except getPCITopology, see PyRWServer._getPCITopology)
+SERVED_METHODS = COALESCED_METHODS | frozenset(['writeMemory', 'writeMemoryMany', 'writePCI', 'writePCIRange', 'writePCIRanges'])
+
+# exception types re-raised as-is on the client, anything else becomes a RuntimeError
+REMOTE_EXCEPTION_TYPES = dict((e.__name__, e) for e in (ValueError, KeyError, IndexError, TypeError, EnvironmentError, RuntimeError, AssertionError))
+
+def _encode(value):
+    '''
+    Brief:
+        Converts a value to something JSON can hold. bytes become {"$b": base64}, dicts with non-string keys become {"$d": [[key, value], ...]}.
+    '''
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {'$b': base64.b64encode(bytes(value)).decode('ascii')}
+    if isinstance(value, dict):
+        return {'$d': [[_encode(k), _encode(v)] for k, v in value.items()]}
+    if isinstance(value, (list, tuple)):
+        return [_encode(v) for v in value]
+    return value
+
+def _decode(value):
+    '''
+    Brief:
+        Undoes _encode(). Dict keys that are lists of 3 become PCILocations.
+    '''
+    if isinstance(value, dict):
+        if '$b' in value:
+            return base64.b64decode(value['$b'])
+        if '$d' in value:
+            ret = {}
+            for k, v in value['$d']:
+                k = _decode(k)
+                ret[PCILocation(*k) if isinstance(k, list) and len(k) == 3 else k] = _decode(v)
+            return ret
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    return value
+
+def _sendMessage(sock, message):
+    data = json.dumps(message, separators=(',', ':')).encode('utf-8')
+    sock.sendall(struct.pack(LENGTH_FORMAT, len(data)) + data)
+
+def _recvExactly(sock, numBytes):
+    chunks = []
+    while numBytes:
+        chunk = sock.recv(numBytes)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        numBytes -= len(chunk)
+    return b''.join(chunks)
+
+def _recvMessage(sock):
+    '''
+    Brief:
+        Returns the next message from the socket or None if it was closed
+    '''
+    header = _recvExactly(sock, LENGTH_SIZE)
+    if header is None:
+        return None
+    data = _recvExactly(sock, struct.unpack(LENGTH_FORMAT, header)[0])
+    return None if data is None else json.loads(data.decode('utf-8'))
+
+def getTokenPath(address):
+    '''
+    Brief:
+        Returns the path of the auth token file for a TCP server address
+    '''
+    return os.path.join(os.path.dirname(DEFAULT_SOCKET_PATH), 'pyrw-%d.token' % address[1])
+
+def _writeToken(path):
+    '''
+    Brief:
+        Writes a new random token to a file only the current user can read and returns the token
+    '''
+    token = binascii.hexlify(os.urandom(TOKEN_SIZE)).decode('ascii')
+    if os.path.exists(path):
+        os.remove(path)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write(token)
+    return token
+
+def _copyFutureResult(source, destination):
+    '''
+    Brief:
+        Sets the (done) source Future's result or exception on the destination Future
+    '''
+    try:
+        destination.set_result(source.result())
+    except Exception as ex:
+        destination.set_exception(ex)
+
+def _createSocket(address):
+    '''
+    Brief:
+        Returns a new stream socket for the given address (a path for a Unix socket or a (host, port) tuple for TCP)
+    '''
+    if isinstance(address, (tuple, list)):
+        return socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+class PyRWServer(object):
+    '''
+    Brief:
+        Serves a backend to many local clients at once.
+            Each request runs on a bounded thread pool, so pipelined reads from one client overlap
+                (writes are ordered with the rest of their connection's requests, see _handleConnection()).
+            Identical reads in flight at the same time (from any clients) share one backend operation,
+                but a read never joins one that started before a write completed.
+            Clients share the backend's config cache (if enabled) and PCITopology cache.
+    '''
+    def __init__(self, backend, address=DEFAULT_ADDRESS, maxWorkers=DEFAULT_MAX_WORKERS):
+        '''
+        Brief:
+            Initializer for the server. Takes the backend to serve and the address to listen on.
+        '''
+        self.backend = backend
+        self.address = tuple(address) if isinstance(address, (tuple, list)) else address
+        self.coalescedCount = 0
+        self._executor = ThreadPoolExecutor(max_workers=maxWorkers)
+        self._inFlight = {}
+        self._inFlightLock = threading.Lock()
+        # bumped when any write is submitted and when it completes; part of the key of in-flight reads
+        self._writeGeneration = 0
+        self._token = None
+        self._socket = None
+        self._stopped = threading.Event()
+
+    def _getPCITopology(self, rescan=False):
+        '''
+        Brief:
+            Returns the backend's (cached) topology as its PCI tree and config space data so clients can build their own PCITopology
+        '''
+        topology = self.backend.getPCITopology(rescan)
+        return [topology.descriptions, dict((address, info.Config) for address, info in topology.byAddress.items())]
+
+    def _run(self, method, args):
+        if method not in SERVED_METHODS:
+            raise ValueError("Unknown method: %s" % method)
+        if method == 'getPCITopology':
+            return self._getPCITopology(*args)
+        return getattr(self.backend, method)(*args)
+
+    def _submit(self, method, args):
+        '''
+        Brief:
+            Returns a Future for the given call, joining an identical in-flight read if there is one
+        '''
+        if method not in COALESCED_METHODS:
+            self._bumpWriteGeneration()
+            future = self._executor.submit(self._run, method, args)
+            future.add_done_callback(lambda f: self._bumpWriteGeneration())
+            return future
+
+        with self._inFlightLock:
+            key = (method, json.dumps(args, separators=(',', ':')), self._writeGeneration)
+            future = self._inFlight.get(key)
+            if future is not None:
+                self.coalescedCount += 1
+                return future
+
+            future = self._inFlight[key] = Future()
+
+        def runAndResolve():
+            try:
+                result = self._run(method, args)
+            except Exception as ex:
+                with self._inFlightLock:
+                    self._inFlight.pop(key, None)
+                future.set_exception(ex)
+            else:
+                with self._inFlightLock:
+                    self._inFlight.pop(key, None)
+                future.set_result(result)
+
+        self._executor.submit(runAndResolve)
+        return future
+
+    def _submitAfter(self, dependencies, method, args):
+        '''
+        Brief:
+            Returns a Future for the given call that is only submitted once every Future in dependencies is done
+                (whether it succeeded or not). No pool thread waits in the meantime.
+        '''
+        dependencies = [d for d in dependencies if not d.done()]
+        if not dependencies:
+            return self._submit(method, args)
+
+        future = Future()
+        remaining = [len(dependencies)]
+        remainingLock = threading.Lock()
+
+        def dependencyDone(_):
+            with remainingLock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            try:
+                inner = self._submit(method, args)
+            except Exception as ex:
+                future.set_exception(ex)
+                return
+            inner.add_done_callback(lambda f: _copyFutureResult(f, future))
+
+        for dependency in dependencies:
+            dependency.add_done_callback(dependencyDone)
+        return future
+
+    def _bumpWriteGeneration(self):
+        with self._inFlightLock:
+            self._writeGeneration += 1
+
+    def _authenticate(self, conn):
+        '''
+        Brief:
+            Checks the first message of a connection carries the token (if the server has one). Returns True if the client may continue.
+        '''
+        if self._token is None:
+            return True
+
+        request = _recvMessage(conn)
+        ok = isinstance(request, dict) and hmac.compare_digest(str(request.get('auth', '')).encode('utf-8'), self._token.encode('utf-8'))
+        if ok:
+            _sendMessage(conn, {'auth': True})
+        else:
+            logger.warning("Rejected a pyrw client with a bad auth token")
+        return ok
+
+    def _handleConnection(self, conn):
+        '''
+        Brief:
+            Reads requests from one client until it disconnects, replying to each as it completes.
+                A write waits for every earlier request of the connection and later requests wait for the write,
+                so a pipelined write then read of the same address reads the written data.
+                A malformed request gets an error response instead of ending the connection.
+        '''
+        sendLock = threading.Lock()
+        lastWrite = None
+        sinceLastWrite = []
+
+        def reply(requestId, future):
+            try:
+                message = {'id': requestId, 'result': _encode(future.result())}
+            except Exception as ex:
+                message = {'id': requestId, 'error': [type(ex).__name__, str(ex)]}
+
+            try:
+                with sendLock:
+                    _sendMessage(conn, message)
+            except (IOError, OSError) as ex:
+                logger.debug("Unable to reply to a client: %s" % ex)
+
+        try:
+            if not self._authenticate(conn):
+                return
+
+            while not self._stopped.is_set():
+                requestId = None
+                try:
+                    # a message that isn't JSON still had a valid length, so the next one can be read
+                    request = _recvMessage(conn)
+                    if request is None:
+                        break
+
+                    requestId = request.get('id') if isinstance(request, dict) else None
+                    if not isinstance(request, dict) or not isinstance(request.get('method'), (str, type(u''))):
+                        raise ValueError("Malformed request: %r" % (request,))
+                    method = request['method']
+                    if method not in SERVED_METHODS:
+                        raise ValueError("Unknown method: %s" % method)
+                    args = _decode(request.get('args', []))
+                    if not isinstance(args, list):
+                        raise ValueError("Malformed request args: %r" % (args,))
+                except (IOError, OSError):
+                    raise
+                except Exception as ex:
+                    future = Future()
+                    future.set_exception(ex)
+                    reply(requestId, future)
+                    continue
+
+                if method in COALESCED_METHODS:
+                    future = self._submitAfter([lastWrite] if lastWrite is not None else [], method, args)
+                    sinceLastWrite = [f for f in sinceLastWrite if not f.done()] + [future]
+                else:
+                    future = self._submitAfter(sinceLastWrite + ([lastWrite] if lastWrite is not None else []), method, args)
+                    lastWrite = future
+                    sinceLastWrite = []
+                future.add_done_callback(lambda f, requestId=requestId: reply(requestId, f))
+        except (IOError, OSError, ValueError) as ex:
+            logger.debug("Client connection ended: %s" % ex)
+        finally:
+            conn.close()
+
+    def serveForever(self):
+        '''
+        Brief:
+            Listens for clients until stop() is called
+        '''
+        if not isinstance(self.address, tuple) and os.path.exists(self.address):
+            os.remove(self.address)
+
+        self._socket = _createSocket(self.address)
+        if isinstance(self.address, tuple):
+            self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self._socket.bind(self.address)
+            self._token = _writeToken(getTokenPath(self.address))
+        else:
+            # create the socket file owner-only from the start (a chmod after bind would leave a window)
+            oldUmask = os.umask(0o177)
+            try:
+                self._socket.bind(self.address)
+            finally:
+                os.umask(oldUmask)
+        self._socket.listen(64)
+        logger.info("pyrw server listening on %s" % str(self.address))
+
+        try:
+            while not self._stopped.is_set():
+                try:
+                    conn, _ = self._socket.accept()
+                except (IOError, OSError):
+                    if self._stopped.is_set():
+                        break
+                    raise
+
+                thread = threading.Thread(target=self._handleConnection, args=(conn,))
+                thread.daemon = True
+                thread.start()
+        finally:
+            self._socket.close()
+            path = getTokenPath(self.address) if isinstance(self.address, tuple) else self.address
+            if os.path.exists(path):
+                os.remove(path)
+
+    def start(self):
+        '''
+        Brief:
+            Calls serveForever() on a background (daemon) thread. Returns the thread.
+        '''
+        thread = threading.Thread(target=self.serveForever)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def stop(self):
+        '''
+        Brief:
+            Stops accepting clients and shuts down the thread pool
+        '''
+        self._stopped.set()
+        if self._socket is not None:
+            try:
+                self._socket.shutdown(socket.SHUT_RDWR)
+            except (IOError, OSError):
+                pass
+            self._socket.close()
+        self._executor.shutdown(wait=False)
+
+class PyRWClient(Backend):
+    '''
+    Brief:
+        Backend that sends every operation to a PyRWServer. Since it's a Backend, PCIDevice/NVMeDevice/etc. work with it unchanged.
+            It is thread safe: calls from many threads are pipelined over the one connection.
+            Use callAsync() to pipeline from a single thread.
+    '''
+    def __init__(self, address=DEFAULT_ADDRESS, token=None):
+        '''
+        Brief:
+            Initializer for the client. Connects to the server at the given address.
+                For TCP, token is read from the server's token file (see getTokenPath) if not given.
+        '''
+        Backend.__init__(self)
+        self.address = tuple(address) if isinstance(address, (tuple, list)) else address
+        self._socket = _createSocket(self.address)
+        self._socket.connect(self.address)
+        if isinstance(self.address, tuple):
+            self._authenticate(token)
+        self._sendLock = threading.Lock()
+        self._pending = {}
+        self._pendingLock = threading.Lock()
+        self._nextId = 0
+        self._closed = False
+
+        self._readerThread = threading.Thread(target=self._readResponses)
+        self._readerThread.daemon = True
+        self._readerThread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def _authenticate(self, token):
+        '''
+        Brief:
+            Sends the auth token (the first message on a TCP connection) and waits for the server to accept it
+        '''
+        if token is None:
+            with open(getTokenPath(self.address), 'r') as f:
+                token = f.read().strip()
+
+        _sendMessage(self._socket, {'auth': token})
+        response = _recvMessage(self._socket)
+        if not response or response.get('auth') is not True:
+            self._socket.close()
+            raise EnvironmentError("The pyrw server at %s rejected the auth token" % str(self.address))
+
+    def close(self):
+        '''
+        Brief:
+            Disconnects from the server
+        '''
+        self._closed = True
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except (IOError, OSError):
+            pass
+        self._socket.close()
+
+    def _readResponses(self):
+        '''
+        Brief:
+            Matches responses from the server to the Futures of their requests
+        '''
+        try:
+            while True:
+                response = _recvMessage(self._socket)
+                if response is None:
+                    break
+
+                with self._pendingLock:
+                    future = self._pending.pop(response['id'], None)
+                if future is None:
+                    continue
+
+                if 'error' in response:
+                    typeName, message = response['error']
+                    future.set_exception(REMOTE_EXCEPTION_TYPES.get(typeName, RuntimeError)(message))
+                else:
+                    future.set_result(_decode(response['result']))
+        except (IOError, OSError, ValueError) as ex:
+            if not self._closed:
+                logger.debug("Lost the connection to the server: %s" % ex)
+        finally:
+            with self._pendingLock:
+                pending, self._pending = self._pending, {}
+            for future in pending.values():
+                future.set_exception(EnvironmentError("Lost the connection to the pyrw server"))
+
+    def callAsync(self, method, *args):
+        '''
+        Brief:
+            Sends a request without waiting for its response. Returns a Future for the (decoded) result.
+        '''
+        future = Future()
+        with self._pendingLock:
+            requestId = self._nextId
+            self._nextId += 1
+            self._pending[requestId] = future
+
+        with self._sendLock:
+            _sendMessage(self._socket, {'id': requestId, 'method': method, 'args': _encode(args)})
+        return future
+
+    def call(self, method, *args):
+        '''
+        Brief:
+            Calls the given method on the server's backend and returns the (decoded) result
+        '''
+        return self.callAsync(method, *args).result()
+
+    def getVersion(self):
+        return self.call('getVersion')
+
+    def _readMemory(self, byteOffset, numBytes):
+        return self.call('readMemory', byteOffset, numBytes)
+
+    def _writeMemory(self, byteOffset, data):
+        return ProcessOutput(*self.call('writeMemory', byteOffset, data))
+
+    def _readMemoryMany(self, ranges):
+        return self.call('readMemoryMany', ranges)
+
+    def _writeMemoryMany(self, writes):
+        return [ProcessOutput(*r) for r in self.call('writeMemoryMany', writes)]
+
+    def _readPCI(self, bus, device, function):
+        return self.call('readPCI', bus, device, function)
+
+    def _readPCIExtended(self, bus, device, function):
+        return self.call('readPCIExtended', bus, device, function)
+
+    def _readPCIRange(self, bus, device, function, offset, numBytes):
+        return self.call('readPCIRange', bus, device, function, offset, numBytes)
+
+    def _readPCIMany(self, addresses, maxWorkers=None):
+        configs = self.call('readPCIMany', [list(a) for a in addresses])
+        return [configs[PCILocation(*a)] for a in addresses]
+
+    def _writePCI(self, bus, device, function, data):
+        return ProcessOutput(*self.call('writePCI', bus, device, function, data))
+
+    def _writePCIRange(self, bus, device, function, offset, data):
+        return ProcessOutput(*self.call('writePCIRange', bus, device, function, offset, data))
+
+    def _writePCIRanges(self, bus, device, function, writes, baseConfig=None):
+        return [ProcessOutput(*r) for r in self.call('writePCIRanges', bus, device, function, [list(w) for w in writes], baseConfig)]
+
+    def _getPCITree(self):
+        return self.call('getPCITree')
+
+    def _scanPCITopology(self):
+        '''
+        Brief:
+            Builds the PCITopology from the server's (shared, cached) topology instead of scanning
+        '''
+        descriptions, configs = self.call('getPCITopology', False)
+        return PCITopology(pciConfigsToDeviceInfos(configs), descriptions)
+
+    def rescanPCITopology(self):
+        '''
+        Brief:
+            Has the server rescan (for all clients) and returns the new PCITopology
+        '''
+        self.call('getPCITopology', True)
+        return self.topologyCache.get(rescan=True)
+
+def main(argv=None):
+    '''
+    Brief:
+        Runs a server for the default backend of this platform
+    '''
+    parser = argparse.ArgumentParser(prog='python -m pyrw.server', description='Serve a pyrw backend to local clients')
+    parser.add_argument('--address', default=None, help='Unix socket path or TCP port on 127.0.0.1, which requires the token from the token file (default: %s)' % str(DEFAULT_ADDRESS))
+    parser.add_argument('--max-workers', type=int, default=DEFAULT_MAX_WORKERS, help='Maximum operations run at once')
+    args = parser.parse_args(argv)
+
+    address = DEFAULT_ADDRESS
+    if args.address is not None:
+        address = (DEFAULT_TCP_ADDRESS[0], int(args.address)) if args.address.isdigit() else args.address
+
+    if sys.platform.startswith('linux'):
+        from pyrw.linux import SysfsBackend
+        backend = SysfsBackend()
+    else:
+        from pyrw.rwe import ReadWriteEverything
+        backend = ReadWriteEverything()
+
+    logging.basicConfig(level=logging.INFO)
+    server = PyRWServer(backend, address, args.max_workers)
+    try:
+        server.serveForever()
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == '__main__':
+    main()
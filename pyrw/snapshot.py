@@ -0,0 +1,250 @@
+'''
+Brief:
+    File for snapshots: a local, editable copy of a range of memory or a device's config space that only writes back what changed
+
+Author(s):
+    Charles Machalow
+'''
+import collections
+import hashlib
+
+from pyrw.rwe_parser import PCILocation
+
+DEFAULT_BLOCK_SIZE = 64
+
+# memory writes closer together than this are merged into one (rewriting the unchanged bytes between them).
+# config space is never merged: it has RW1C bits (like Status) that rewriting an unchanged byte would clear.
+DEFAULT_MAX_GAP = 8
+
+Extent = collections.namedtuple("Extent", ['Offset', 'Data'])
+
+def _hashBlock(data):
+    return hashlib.sha1(data).digest()
+
+def coalesceRanges(ranges, maxGap=0):
+    '''
+    Brief:
+        Takes a sorted list of (start, end) ranges and merges ones that overlap or are at most maxGap bytes apart
+    '''
+    ret = []
+    for start, end in ranges:
+        if ret and start - ret[-1][1] <= maxGap:
+            ret[-1] = (ret[-1][0], max(ret[-1][1], end))
+        else:
+            ret.append((start, end))
+    return ret
+
+def diffBytes(a, b, start=0, end=None, maxGap=0):
+    '''
+    Brief:
+        Returns a list of (start, end) ranges where the two equal length buffers differ, limited to [start, end)
+            Ranges at most maxGap bytes apart are merged.
+    '''
+    if end is None:
+        end = len(a)
+
+    ranges = []
+    idx = start
+    while idx < end:
+        if a[idx] != b[idx]:
+            rangeStart = idx
+            while idx < end and a[idx] != b[idx]:
+                idx += 1
+            ranges.append((rangeStart, idx))
+        else:
+            idx += 1
+    return coalesceRanges(ranges, maxGap)
+
+class Snapshot(object):
+    '''
+    Brief:
+        A bytearray-like copy of a range of memory or a device's config space.
+            Changes are made locally (through item/slice assignment) and only written back on commit().
+            Modified blocks are tracked so commit() only compares (and writes) what was touched.
+            Per-block hashes are kept so two snapshots of the same region can be diffed quickly.
+    '''
+    def __init__(self, rwe, data, address=None, pciLocation=None, blockSize=DEFAULT_BLOCK_SIZE):
+        '''
+        Brief:
+            Initializer for the snapshot. Use fromMemory() or fromPCI() instead of calling this directly.
+                Exactly one of address (memory) or pciLocation (config space) is given.
+        '''
+        if (address is None) == (pciLocation is None):
+            raise ValueError("Exactly one of address or pciLocation must be given")
+
+        self.rwe = rwe
+        self.address = address
+        self.pciLocation = None if pciLocation is None else PCILocation(*pciLocation)
+        self.blockSize = blockSize
+        self._setData(data)
+
+    @classmethod
+    def fromMemory(cls, rwe, address, numBytes, blockSize=DEFAULT_BLOCK_SIZE):
+        '''
+        Brief:
+            Takes a snapshot of the given range of memory
+        '''
+        return cls(rwe, rwe.readMemory(address, numBytes), address=address, blockSize=blockSize)
+
+    @classmethod
+    def fromPCI(cls, rwe, bus, device, function, blockSize=DEFAULT_BLOCK_SIZE):
+        '''
+        Brief:
+            Takes a snapshot of the given device's config space
+        '''
+        return cls(rwe, rwe.readPCI(bus, device, function), pciLocation=(bus, device, function), blockSize=blockSize)
+
+    def _setData(self, data):
+        self.data = bytearray(data)
+        # a bytearray (never modified) so indexing gives ints on Python 2 as well, see diffBytes()
+        self._original = bytearray(self.data)
+        self._dirtyBlocks = set()
+        self._hashes = None
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self.data))
+            if step != 1:
+                raise ValueError("Snapshots only support contiguous slices")
+
+            value = bytearray(value)
+            if len(value) != stop - start:
+                raise ValueError("Snapshots can't change size")
+        else:
+            start = key + len(self.data) if key < 0 else key
+            stop = start + 1
+
+        self.data[key] = value
+        self._markDirty(start, stop)
+
+    def _markDirty(self, start, stop):
+        if stop <= start:
+            return
+
+        blocks = range(start // self.blockSize, (stop - 1) // self.blockSize + 1)
+        self._dirtyBlocks.update(blocks)
+        if self._hashes is not None:
+            for block in blocks:
+                self._hashes[block] = None
+
+    def write(self, offset, data):
+        '''
+        Brief:
+            Writes the given data at the given offset of the snapshot (locally, until commit())
+        '''
+        self[offset:offset + len(data)] = data
+
+    def tobytes(self):
+        '''
+        Brief:
+            Returns the snapshot's current contents as bytes
+        '''
+        return bytes(self.data)
+
+    def isDirty(self):
+        '''
+        Brief:
+            Returns True if anything differs from what was last read/committed
+        '''
+        return bool(self.getDirtyExtents())
+
+    def getDirtyExtents(self, maxGap=None):
+        '''
+        Brief:
+            Returns a list of Extents (offset, data) that differ from what was last read/committed.
+                Only touched blocks are compared. Ranges at most maxGap bytes apart are merged.
+                maxGap defaults to DEFAULT_MAX_GAP for memory and 0 for config space.
+        '''
+        if maxGap is None:
+            maxGap = 0 if self.pciLocation is not None else DEFAULT_MAX_GAP
+
+        ranges = []
+        for block in sorted(self._dirtyBlocks):
+            start = block * self.blockSize
+            end = min(start + self.blockSize, len(self.data))
+            if self.data[start:end] != self._original[start:end]:
+                ranges.extend(diffBytes(self.data, self._original, start, end))
+
+        return [Extent(start, bytes(self.data[start:end])) for start, end in coalesceRanges(ranges, maxGap)]
+
+    def commit(self, maxGap=None):
+        '''
+        Brief:
+            Writes only the changed ranges back. Returns the list of Extents that were written.
+                maxGap defaults to DEFAULT_MAX_GAP for memory and 0 for config space (see getDirtyExtents).
+                Config space changes go out together (see Backend.writePCIRanges()): on rw.exe without ECAM that is one write of
+                    the whole header built from what was last read/committed, since rw.exe can't write part of config space.
+        '''
+        extents = self.getDirtyExtents(maxGap)
+        if extents:
+            if self.pciLocation is not None:
+                rets = self.rwe.writePCIRanges(*(self.pciLocation + ([(e.Offset, e.Data) for e in extents], self._original)))
+                for extent, ret in zip(extents, rets):
+                    if ret.ReturnCode != 0:
+                        raise RuntimeError("Failed to write 0x%X bytes at offset 0x%X of %s" % (len(extent.Data), extent.Offset, str(self.pciLocation)))
+            else:
+                rets = self.rwe.writeMemoryMany([(self.address + e.Offset, e.Data) for e in extents])
+                for extent, ret in zip(extents, rets):
+                    if ret.ReturnCode != 0:
+                        raise RuntimeError("Failed to write 0x%X bytes at 0x%X" % (len(extent.Data), self.address + extent.Offset))
+
+        self._original = bytearray(self.data)
+        self._dirtyBlocks = set()
+        return extents
+
+    def discard(self):
+        '''
+        Brief:
+            Throws away local changes
+        '''
+        self.data[:] = self._original
+        for block in self._dirtyBlocks:
+            if self._hashes is not None:
+                self._hashes[block] = None
+        self._dirtyBlocks = set()
+
+    def recapture(self):
+        '''
+        Brief:
+            Returns a new snapshot of the same region (this one is left alone), useful with diff() to see what the hardware changed
+        '''
+        if self.pciLocation is not None:
+            return self.fromPCI(self.rwe, *self.pciLocation, blockSize=self.blockSize)
+        return self.fromMemory(self.rwe, self.address, len(self.data), blockSize=self.blockSize)
+
+    def getBlockHashes(self):
+        '''
+        Brief:
+            Returns a list of per-block digests of the current contents (only blocks changed since the last call are rehashed)
+        '''
+        numBlocks = (len(self.data) + self.blockSize - 1) // self.blockSize
+        if self._hashes is None:
+            self._hashes = [None] * numBlocks
+
+        view = memoryview(self.data)
+        for block in range(numBlocks):
+            if self._hashes[block] is None:
+                self._hashes[block] = _hashBlock(view[block * self.blockSize:(block + 1) * self.blockSize])
+        return list(self._hashes)
+
+    def diff(self, other, maxGap=0):
+        '''
+        Brief:
+            Returns a list of (start, end) offset ranges where this snapshot differs from another snapshot of the same size.
+                Block hashes are compared first so only differing blocks are compared byte by byte.
+        '''
+        if len(other) != len(self.data) or other.blockSize != self.blockSize:
+            raise ValueError("Can only diff snapshots of the same size and block size")
+
+        ranges = []
+        for block, (mine, theirs) in enumerate(zip(self.getBlockHashes(), other.getBlockHashes())):
+            if mine != theirs:
+                start = block * self.blockSize
+                ranges.extend(diffBytes(self.data, other.data, start, min(start + self.blockSize, len(self.data))))
+        return coalesceRanges(ranges, maxGap)
@@ -0,0 +1,203 @@
+'''
+Brief:
+    File for the PCITopology: an indexed, cached view of every PCI device on the system and the bridges between them
+
+Author(s):
+    Charles Machalow
+'''
+import collections
+import threading
+
+from pyrw.rwe_parser import PCILocation, getPCIBridgeBusesFromConfig
+from pyrw.wait import monotonic
+
+# how long a cached topology is used before Backend.getPCITopology() rescans
+DEFAULT_TOPOLOGY_MAX_AGE = 60.0
+
+class PCITopology(object):
+    '''
+    Brief:
+        Every PCI device on the system (as PCIDeviceInfo) with indexes by address, class code and vendor/device ID,
+            plus the bridge hierarchy (parent/children/all descendants). Everything is computed once when the topology is built,
+            so lookups (including 'all devices of a class behind this bridge') are dict hits.
+    '''
+    def __init__(self, deviceInfos, descriptions=None):
+        '''
+        Brief:
+            Initializer for the topology. Takes a list of PCIDeviceInfo and an optional dict of PCILocation to description.
+                Use Backend.getPCITopology() instead of calling this directly.
+        '''
+        self.descriptions = dict(descriptions or {})
+        self.scanTime = monotonic()
+
+        self.byAddress = collections.OrderedDict()
+        self.byClassCode = collections.defaultdict(list)
+        self.byIds = collections.defaultdict(list)
+        self.bridgeBuses = {}
+
+        for info in sorted(deviceInfos, key=lambda i: i.Address):
+            self.byAddress[info.Address] = info
+            self.byClassCode[info.ClassCode].append(info)
+            self.byIds[(info.VendorId, info.DeviceId)].append(info)
+
+            buses = getPCIBridgeBusesFromConfig(info.Config)
+            if buses is not None:
+                self.bridgeBuses[info.Address] = buses
+
+        self._buildHierarchy()
+
+    def _buildHierarchy(self):
+        '''
+        Brief:
+            Works out each device's parent bridge (the bridge whose secondary bus the device is on),
+                then each bridge's children and descendants (also indexed by class code).
+                Bridges whose secondary bus isn't above their own bus (like an unconfigured bridge's 0) aren't parents of anything.
+        '''
+        busToBridge = {}
+        for bridge, (secondary, subordinate) in self.bridgeBuses.items():
+            if secondary > bridge.Bus:
+                busToBridge[secondary] = bridge
+
+        self.parents = {}
+        self.children = collections.defaultdict(list)
+        for address in self.byAddress:
+            parent = busToBridge.get(address.Bus)
+            self.parents[address] = parent
+            if parent is not None:
+                self.children[parent].append(self.byAddress[address])
+
+        self.descendants = collections.defaultdict(list)
+        self._descendantsByClassCode = collections.defaultdict(list)
+        for address, info in self.byAddress.items():
+            parent = self.parents[address]
+            seen = set()
+            while parent is not None and parent not in seen:
+                seen.add(parent)
+                self.descendants[parent].append(info)
+                self._descendantsByClassCode[(parent, info.ClassCode)].append(info)
+                parent = self.parents[parent]
+
+    def __len__(self):
+        return len(self.byAddress)
+
+    def __iter__(self):
+        return iter(self.byAddress.values())
+
+    def __contains__(self, address):
+        return PCILocation(*address) in self.byAddress
+
+    def getAge(self):
+        '''
+        Brief:
+            Returns how many seconds ago the topology was scanned
+        '''
+        return monotonic() - self.scanTime
+
+    def getDevice(self, address):
+        '''
+        Brief:
+            Returns the PCIDeviceInfo at the given PCILocation (or None)
+        '''
+        return self.byAddress.get(PCILocation(*address))
+
+    def getDevicesByClassCode(self, classCode):
+        '''
+        Brief:
+            Returns a list of PCIDeviceInfo with the given class code
+        '''
+        return list(self.byClassCode.get(classCode, []))
+
+    def getDevicesByIds(self, vendorId, deviceId):
+        '''
+        Brief:
+            Returns a list of PCIDeviceInfo with the given vendor and device IDs
+        '''
+        return list(self.byIds.get((vendorId, deviceId), []))
+
+    def getBridges(self):
+        '''
+        Brief:
+            Returns a list of PCIDeviceInfo for all PCI-to-PCI bridges
+        '''
+        return [self.byAddress[a] for a in sorted(self.bridgeBuses)]
+
+    def getRootPorts(self):
+        '''
+        Brief:
+            Returns a list of PCIDeviceInfo for bridges that don't sit behind another bridge
+        '''
+        return [self.byAddress[a] for a in sorted(self.bridgeBuses) if self.parents[a] is None]
+
+    def getParent(self, address):
+        '''
+        Brief:
+            Returns the PCIDeviceInfo of the bridge the given device is behind (or None)
+        '''
+        parent = self.parents.get(PCILocation(*address))
+        return None if parent is None else self.byAddress[parent]
+
+    def getChildren(self, address):
+        '''
+        Brief:
+            Returns a list of PCIDeviceInfo directly behind the given bridge
+        '''
+        return list(self.children.get(PCILocation(*address), []))
+
+    def getDescendants(self, address, classCode=None):
+        '''
+        Brief:
+            Returns a list of PCIDeviceInfo anywhere behind the given bridge (optionally only ones with the given class code)
+        '''
+        address = PCILocation(*address)
+        if classCode is None:
+            return list(self.descendants.get(address, []))
+        return list(self._descendantsByClassCode.get((address, classCode), []))
+
+    def getPath(self, address):
+        '''
+        Brief:
+            Returns the list of bridges (PCIDeviceInfo) from the root down to the given device's parent
+        '''
+        ret = []
+        parent = self.parents.get(PCILocation(*address))
+        while parent is not None and len(ret) < len(self.bridgeBuses):
+            ret.insert(0, self.byAddress[parent])
+            parent = self.parents[parent]
+        return ret
+
+class PCITopologyCache(object):
+    '''
+    Brief:
+        Holds a backend's PCITopology and rebuilds it when it's older than maxAgeSeconds or a rescan is asked for
+    '''
+    def __init__(self, buildFunc, maxAgeSeconds=DEFAULT_TOPOLOGY_MAX_AGE):
+        '''
+        Brief:
+            Initializer for the cache. buildFunc() does a full scan and returns a PCITopology.
+                maxAgeSeconds of None means the topology never expires (only rescan() rebuilds it).
+        '''
+        self.buildFunc = buildFunc
+        self.maxAgeSeconds = maxAgeSeconds
+        self.scans = 0
+        self._topology = None
+        self._lock = threading.Lock()
+
+    def get(self, rescan=False):
+        '''
+        Brief:
+            Returns the cached PCITopology, scanning first if there is none, it expired or rescan is True
+        '''
+        with self._lock:
+            topology = self._topology
+            if rescan or topology is None or (self.maxAgeSeconds is not None and topology.getAge() > self.maxAgeSeconds):
+                topology = self._topology = self.buildFunc()
+                self.scans += 1
+            return topology
+
+    def invalidate(self):
+        '''
+        Brief:
+            Drops the cached topology so the next get() rescans
+        '''
+        with self._lock:
+            self._topology = None
@@ -0,0 +1,240 @@
+'''
+Brief:
+    File for rw.exe trace files: every RWE command run, its output, return code and SAVE/LOAD file payloads.
+        Written by ReadWriteEverything.enableRecording() and served back by pyrw.replay.ReplayReadWriteEverything.
+
+    File layout (all little-endian):
+        Header: magic (8 bytes), version (u16), flags (u16), metadata length (u32), metadata (UTF-8 JSON)
+        Records, each: record length (u32), command length (u32), output length (u32), return code (i32), payload count (u16),
+            command (UTF-8, scratch paths replaced by slot numbers), output (UTF-8),
+            payloads, each: slot (u16), kind (u8, 0 = LOAD, 1 = SAVE), compressed (u8), length (u32), data
+        Index (written on close): record offsets (u64 each), then magic (8 bytes), index offset (u64), record count (u32)
+    A trace that wasn't closed (no index) can still be read; its records are found by scanning.
+
+Author(s):
+    Charles Machalow
+'''
+import collections
+import json
+import os
+import re
+import struct
+import threading
+import zlib
+
+TRACE_MAGIC = b'PYRWTRC\x00'
+INDEX_MAGIC = b'PYRWIDX\x00'
+TRACE_VERSION = 1
+
+HEADER_FORMAT = '<8sHHI'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+RECORD_HEADER_FORMAT = '<IIiH'
+RECORD_HEADER_SIZE = struct.calcsize(RECORD_HEADER_FORMAT)
+PAYLOAD_HEADER_FORMAT = '<HBBI'
+PAYLOAD_HEADER_SIZE = struct.calcsize(PAYLOAD_HEADER_FORMAT)
+FOOTER_FORMAT = '<8sQI'
+FOOTER_SIZE = struct.calcsize(FOOTER_FORMAT)
+
+PAYLOAD_LOAD = 0
+PAYLOAD_SAVE = 1
+
+# payloads at least this big are zlib compressed if that makes them smaller
+MIN_COMPRESS_SIZE = 64
+
+# matches the scratch file path of a SAVE/LOAD command
+SCRATCH_PATH_REGEX = r'((?:SAVE|LOAD) )"([^"]*)"'
+
+TraceRecord = collections.namedtuple("TraceRecord", ['Command', 'Output', 'ReturnCode', 'Loads', 'Saves'])
+
+def normalizeCommand(cmd):
+    '''
+    Brief:
+        Returns (normalizedCommand, paths): the command with each SAVE/LOAD scratch path replaced by its slot number,
+            and the list of paths (indexed by slot). Scratch folders differ every run so this is what traces are keyed by.
+    '''
+    paths = []
+
+    def replace(m):
+        paths.append(m.group(2))
+        return '%s"%d"' % (m.group(1), len(paths) - 1)
+
+    return re.sub(SCRATCH_PATH_REGEX, replace, cmd, flags=re.IGNORECASE), paths
+
+def getPayloadSlots(cmd):
+    '''
+    Brief:
+        Returns a list of (slot, kind, path) for each SAVE/LOAD in the (unnormalized) command
+    '''
+    return [(slot, PAYLOAD_SAVE if m.group(1).strip().upper() == 'SAVE' else PAYLOAD_LOAD, m.group(2))
+            for slot, m in enumerate(re.finditer(SCRATCH_PATH_REGEX, cmd, flags=re.IGNORECASE))]
+
+def readPayloads(cmd, kind):
+    '''
+    Brief:
+        Returns a dict of slot to file contents for the SAVE (or LOAD) files of the given command that exist
+    '''
+    ret = {}
+    for slot, payloadKind, path in getPayloadSlots(cmd):
+        if payloadKind == kind and os.path.isfile(path):
+            with open(path, 'rb') as f:
+                ret[slot] = f.read()
+    return ret
+
+def _packPayload(slot, kind, data):
+    compressed = 0
+    if len(data) >= MIN_COMPRESS_SIZE:
+        packed = zlib.compress(data)
+        if len(packed) < len(data):
+            data, compressed = packed, 1
+    return struct.pack(PAYLOAD_HEADER_FORMAT, slot, kind, compressed, len(data)) + data
+
+class TraceRecorder(object):
+    '''
+    Brief:
+        Appends records to a trace file. Thread safe.
+    '''
+    def __init__(self, path, metadata=None):
+        '''
+        Brief:
+            Initializer for the recorder. Creates (or overwrites) the trace file. metadata is a JSON-able dict (rw.exe version, etc.).
+        '''
+        self.path = path
+        self.offsets = []
+        self._lock = threading.Lock()
+        self._file = open(path, 'wb')
+
+        meta = json.dumps(metadata or {}).encode('utf-8')
+        self._file.write(struct.pack(HEADER_FORMAT, TRACE_MAGIC, TRACE_VERSION, 0, len(meta)) + meta)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def record(self, cmd, ret, loads=None, saves=None):
+        '''
+        Brief:
+            Records one RWE command and its ProcessOutput. loads/saves are dicts of slot to payload.
+                If saves is None, the command's SAVE files are read now (so call this right after the command ran).
+        '''
+        normalized, _ = normalizeCommand(cmd)
+        if saves is None:
+            saves = readPayloads(cmd, PAYLOAD_SAVE)
+
+        command = normalized.encode('utf-8')
+        output = ret.Output.encode('utf-8')
+        payloads = [_packPayload(slot, PAYLOAD_LOAD, data) for slot, data in sorted((loads or {}).items())]
+        payloads += [_packPayload(slot, PAYLOAD_SAVE, data) for slot, data in sorted(saves.items())]
+
+        body = struct.pack(RECORD_HEADER_FORMAT, len(command), len(output), ret.ReturnCode, len(payloads)) + command + output + b''.join(payloads)
+        with self._lock:
+            self.offsets.append(self._file.tell())
+            self._file.write(struct.pack('<I', len(body)) + body)
+
+    def close(self):
+        '''
+        Brief:
+            Writes the index and closes the file
+        '''
+        with self._lock:
+            if self._file.closed:
+                return
+            indexOffset = self._file.tell()
+            self._file.write(struct.pack('<%dQ' % len(self.offsets), *self.offsets))
+            self._file.write(struct.pack(FOOTER_FORMAT, INDEX_MAGIC, indexOffset, len(self.offsets)))
+            self._file.close()
+
+class TraceFile(object):
+    '''
+    Brief:
+        A trace file opened for reading. Records are read on demand through the index.
+    '''
+    def __init__(self, path):
+        '''
+        Brief:
+            Initializer for the trace. Reads the header, metadata and index.
+        '''
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            magic, version, self.flags, metaLength = struct.unpack(HEADER_FORMAT, self._file.read(HEADER_SIZE))
+            if magic != TRACE_MAGIC:
+                raise ValueError("%s is not a pyrw trace" % path)
+            if version != TRACE_VERSION:
+                raise ValueError("%s has unsupported trace version %d" % (path, version))
+
+            self.metadata = json.loads(self._file.read(metaLength).decode('utf-8'))
+            self.offsets = self._readIndex()
+        except Exception:
+            self._file.close()
+            raise
+
+    def _readIndex(self):
+        '''
+        Brief:
+            Returns the list of record offsets from the index, or by scanning if the trace has no index
+        '''
+        dataStart = self._file.tell()
+        self._file.seek(0, os.SEEK_END)
+        size = self._file.tell()
+        if size - dataStart >= FOOTER_SIZE:
+            self._file.seek(size - FOOTER_SIZE)
+            magic, indexOffset, count = struct.unpack(FOOTER_FORMAT, self._file.read(FOOTER_SIZE))
+            if magic == INDEX_MAGIC:
+                self._file.seek(indexOffset)
+                return list(struct.unpack('<%dQ' % count, self._file.read(8 * count)))
+
+        offsets = []
+        offset = dataStart
+        while offset + 4 <= size:
+            self._file.seek(offset)
+            length = struct.unpack('<I', self._file.read(4))[0]
+            if offset + 4 + length > size:
+                break # partially written record
+            offsets.append(offset)
+            offset += 4 + length
+        return offsets
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __iter__(self):
+        for idx in range(len(self.offsets)):
+            yield self[idx]
+
+    def __getitem__(self, idx):
+        '''
+        Brief:
+            Returns the TraceRecord at the given index
+        '''
+        self._file.seek(self.offsets[idx])
+        length = struct.unpack('<I', self._file.read(4))[0]
+        body = self._file.read(length)
+
+        commandLength, outputLength, returnCode, numPayloads = struct.unpack_from(RECORD_HEADER_FORMAT, body)
+        offset = RECORD_HEADER_SIZE
+        command = body[offset:offset + commandLength].decode('utf-8')
+        offset += commandLength
+        output = body[offset:offset + outputLength].decode('utf-8')
+        offset += outputLength
+
+        loads = {}
+        saves = {}
+        for _ in range(numPayloads):
+            slot, kind, compressed, dataLength = struct.unpack_from(PAYLOAD_HEADER_FORMAT, body, offset)
+            offset += PAYLOAD_HEADER_SIZE
+            data = body[offset:offset + dataLength]
+            offset += dataLength
+            (saves if kind == PAYLOAD_SAVE else loads)[slot] = zlib.decompress(data) if compressed else data
+
+        return TraceRecord(command, output, returnCode, loads, saves)
@@ -0,0 +1,46 @@
+'''
+Brief:
+    File for waiting on register values with adaptive backoff
+
+Author(s):
+    Charles Machalow
+'''
+import collections
+import time
+
+# time.monotonic isn't in Python 2
+monotonic = getattr(time, 'monotonic', time.time)
+
+BackoffPolicy = collections.namedtuple("BackoffPolicy", ['InitialDelay', 'MaxDelay', 'Multiplier'])
+WaitResult = collections.namedtuple("WaitResult", ['Value', 'Elapsed', 'Polls'])
+
+# re-read almost right away at first (most things finish fast), then back off to at most 10ms between reads
+DEFAULT_BACKOFF_POLICY = BackoffPolicy(InitialDelay=.00005, MaxDelay=.01, Multiplier=2.0)
+
+# never sleep between reads
+SPIN_POLICY = BackoffPolicy(InitialDelay=0, MaxDelay=0, Multiplier=1.0)
+
+def waitFor(readFunc, predicate, timeoutSeconds, policy=DEFAULT_BACKOFF_POLICY, description='the condition'):
+    '''
+    Brief:
+        Calls readFunc until predicate(value) is True, sleeping between reads per the BackoffPolicy.
+            Returns a WaitResult with the final value, the elapsed (monotonic) seconds and the number of reads.
+            Raises RuntimeError if timeoutSeconds pass first.
+    '''
+    start = monotonic()
+    deathTime = start + timeoutSeconds
+    delay = policy.InitialDelay
+    polls = 0
+    while True:
+        value = readFunc()
+        polls += 1
+        now = monotonic()
+        if predicate(value):
+            return WaitResult(Value=value, Elapsed=now - start, Polls=polls)
+
+        if now >= deathTime:
+            raise RuntimeError("Timed out after %.3f seconds waiting for %s" % (timeoutSeconds, description))
+
+        if delay:
+            time.sleep(min(delay, deathTime - now))
+        delay = min(policy.MaxDelay, delay * policy.Multiplier)
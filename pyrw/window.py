@@ -0,0 +1,129 @@
+'''
+Brief:
+    File for the RegisterWindow: a writable view over a range of memory (usually a BAR)
+
+Author(s):
+    Charles Machalow
+'''
+import struct
+
+from ctypes import *
+
+# width -> ctypes type used to do a single sized access to a mapped register
+SIZED_ACCESS_TYPES = {1: c_uint8, 2: c_uint16, 4: c_uint32, 8: c_uint64}
+SIZED_ACCESS_FORMATS = {1: '<B', 2: '<H', 4: '<I', 8: '<Q'}
+
+def readSized(buffer, offset, size):
+    '''
+    Brief:
+        Reads size (1, 2, 4 or 8) bytes at offset of a writable buffer (like an mmap) with one load of that width.
+            Reading .value is what does the load; copying the ctypes object's bytes would be a memcpy of unknown widths.
+    '''
+    return struct.pack(SIZED_ACCESS_FORMATS[size], SIZED_ACCESS_TYPES[size].from_buffer(buffer, offset).value)
+
+def writeSized(buffer, offset, data):
+    '''
+    Brief:
+        Writes data (1, 2, 4 or 8 bytes) at offset of a writable buffer with one store of that width
+    '''
+    SIZED_ACCESS_TYPES[len(data)].from_buffer(buffer, offset).value = struct.unpack(SIZED_ACCESS_FORMATS[len(data)], bytes(bytearray(data)))[0]
+
+class RegisterWindow(object):
+    '''
+    Brief:
+        A writable memoryview over a range of memory.
+            If the backend can map the memory (see Backend.getMemoryView) reads/writes on the view go straight to the hardware.
+            Otherwise the view is over a cached buffer that must be explicitly refreshed and writes go through writeMemory.
+    '''
+    def __init__(self, rwe, address, size):
+        '''
+        Brief:
+            Initializer for the window. Takes a backend instance, the address of the window and its size in bytes.
+        '''
+        self.rwe = rwe
+        self.address = address
+        self.size = size
+
+        view = rwe.getMemoryView(address, size)
+        self.isMapped = view is not None
+        if self.isMapped:
+            self.view = view
+        else:
+            self.view = memoryview(bytearray(size))
+            self.refresh()
+
+    def refresh(self, offset=0, size=None):
+        '''
+        Brief:
+            Re-reads the given range of the window (the whole window by default) into the cached buffer. Returns the view.
+                Does nothing for mapped windows since they are always live.
+        '''
+        if not self.isMapped:
+            if size is None:
+                size = self.size - offset
+            self.view[offset:offset + size] = self.rwe.readMemory(self.address + offset, size)
+
+        return self.view
+
+    def read(self, offset, size):
+        '''
+        Brief:
+            Returns a copy of the given range of the window (as of the last refresh for unmapped windows)
+        '''
+        if self.isMapped and size in SIZED_ACCESS_TYPES and offset % size == 0:
+            # single sized load so registers see one access of the expected width
+            return readSized(self.view, offset, size)
+        return self.view[offset:offset + size].tobytes()
+
+    def tobytes(self, offset=0, size=None):
+        '''
+        Brief:
+            Returns a copy of the given range of the window (the whole window by default).
+                Mapped windows are read in aligned 4 byte units (not a byte at a time), unmapped ones come from the cached buffer.
+        '''
+        if size is None:
+            size = self.size - offset
+        if not self.isMapped:
+            return self.view[offset:offset + size].tobytes()
+
+        ret = bytearray()
+        idx = offset
+        end = offset + size
+        while idx < end:
+            width = 4 if idx % 4 == 0 and end - idx >= 4 else 1
+            ret += readSized(self.view, idx, width)
+            idx += width
+        return bytes(ret)
+
+    def write(self, offset, data):
+        '''
+        Brief:
+            Writes the given data at the given offset of the window (and to the cached buffer for unmapped windows)
+        '''
+        data = bytearray(data)
+        if self.isMapped:
+            if len(data) in SIZED_ACCESS_TYPES and offset % len(data) == 0:
+                writeSized(self.view, offset, data)
+            else:
+                self.view[offset:offset + len(data)] = data
+            return
+
+        ret = self.rwe.writeMemory(self.address + offset, data)
+        if ret.ReturnCode != 0:
+            raise RuntimeError("Failed to write 0x%X bytes at 0x%X" % (len(data), self.address + offset))
+        self.view[offset:offset + len(data)] = data
+
+    def getStructure(self, structureType, offset=0):
+        '''
+        Brief:
+            Returns an instance of the given ctypes structure type that shares memory with the window (no copies)
+        '''
+        return structureType.from_buffer(self.view, offset)
+
+    def refreshField(self, structureType, fieldName, offset=0):
+        '''
+        Brief:
+            Refreshes just the bytes behind the given field of a structure placed at the given offset of the window
+        '''
+        field = getattr(structureType, fieldName)
+        self.refresh(offset + field.offset, field.size)
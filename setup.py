@@ -9,6 +9,8 @@ setup(
     packages=['pyrw'],
     license='MIT License',
     python_requires='>=2.7',
+    # the thread pools (parallel enumeration, prefetching, sharded dumps) need the concurrent.futures backport on Python 2
+    install_requires=['futures; python_version < "3.2"'],
     long_description=open('README.md').read(),
     long_description_content_type='text/markdown',
     classifiers=[
@@ -0,0 +1,35 @@
+'''
+Brief:
+    Tests for pyrw.instrumentation
+
+Author(s):
+    Charles Machalow
+'''
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pyrw.fake import FakeReadWriteEverything, SimulatedSystem
+
+def test_keyword_arguments_are_counted():
+    rwe = FakeReadWriteEverything(SimulatedSystem())
+    instrumentation = rwe.enableInstrumentation()
+    hookArgs = []
+    instrumentation.addPostHook(lambda name, args, result, elapsed, ex: hookArgs.append((name, args)))
+
+    rwe.writeMemory(0x1000, data=b'\x01\x02\x03\x04')
+    assert rwe.readMemory(byteOffset=0x1000, numBytes=4) == b'\x01\x02\x03\x04'
+
+    operations = instrumentation.toDict()['operations']
+    assert operations['writeMemory']['bytes'] == 4
+    assert operations['readMemory']['bytes'] == 4
+    assert hookArgs == [('writeMemory', (0x1000, b'\x01\x02\x03\x04')), ('readMemory', (0x1000, 4))]
+
+def test_byte_counting_never_raises_out_of_an_operation():
+    rwe = FakeReadWriteEverything(SimulatedSystem())
+    instrumentation = rwe.enableInstrumentation()
+    # readPCI of a missing device returns None, which len() can't count
+    rwe._readPCI = lambda bus, device, function: None
+    assert rwe.readPCI(3, 0, 0) is None
+    assert instrumentation.toDict()['operations']['readPCI']['bytes'] == 0
@@ -0,0 +1,110 @@
+'''
+Brief:
+    Tests for pyrw.linux's SysfsBackend against a fake sysfs tree (and a file standing in for /dev/mem)
+
+Author(s):
+    Charles Machalow
+'''
+import os
+import struct
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pyrw.linux import SysfsBackend
+from pyrw.nvme import NVME_CLASS_CODE
+
+pytestmark = pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs POSIX mmap')
+
+BAR0 = 0xFE000000
+BAR0_SIZE = 0x4000
+MEM_SIZE = 0x10000
+
+def _addDevice(root, name, vendorId, deviceId, classCode, config, resources):
+    device = root.mkdir(name)
+    device.join('config').write_binary(bytes(config))
+    device.join('vendor').write('0x%04x\n' % vendorId)
+    device.join('device').write('0x%04x\n' % deviceId)
+    device.join('class').write('0x%06x\n' % classCode)
+    lines = ['0x%016x 0x%016x 0x%016x' % r for r in resources]
+    lines += ['0x%016x 0x%016x 0x%016x' % (0, 0, 0)] * (13 - len(resources))
+    device.join('resource').write('\n'.join(lines) + '\n')
+    return device
+
+@pytest.fixture
+def backend(tmpdir):
+    '''
+    Brief:
+        A SysfsBackend over a fake tree with one NVMe device (BAR0 backed by resource0) and a generic device
+    '''
+    root = tmpdir.mkdir('devices')
+
+    config = bytearray(256)
+    struct.pack_into('<HH', config, 0, 0x144D, 0xA808)
+    config[0x09:0x0C] = bytearray([0x02, 0x08, 0x01])
+    struct.pack_into('<I', config, 0x10, BAR0 | 0x4)
+    nvme = _addDevice(root, '0000:01:00.0', 0x144D, 0xA808, NVME_CLASS_CODE, config, [(BAR0, BAR0 + BAR0_SIZE - 1, 0x140204)])
+    registers = bytearray(BAR0_SIZE)
+    struct.pack_into('<I', registers, 0x08, 0x10400)
+    nvme.join('resource0').write_binary(bytes(registers))
+
+    config = bytearray(256)
+    struct.pack_into('<HH', config, 0, 0x8086, 0x1234)
+    config[0x09:0x0C] = bytearray([0x00, 0x00, 0x02])
+    _addDevice(root, '0000:00:1f.0', 0x8086, 0x1234, 0x020000, config, [])
+
+    mem = tmpdir.join('mem')
+    mem.write_binary(bytes(bytearray(MEM_SIZE)))
+
+    rwe = SysfsBackend(str(root), str(mem))
+    yield rwe
+    rwe.close()
+
+def test_pci_tree_and_config(backend):
+    assert sorted(backend.getPCITree()) == [(0, 0x1F, 0), (1, 0, 0)]
+    assert struct.unpack('<HH', backend.readPCI(1, 0, 0)[:4]) == (0x144D, 0xA808)
+    assert backend.getPCIClassCode(1, 0, 0) == NVME_CLASS_CODE
+    assert [info.Address for info in backend.enumeratePCIDevices(NVME_CLASS_CODE)] == [(1, 0, 0)]
+
+def test_write_pci(backend):
+    config = bytearray(backend.readPCI(0, 0x1F, 0))
+    config[0x3C] = 0x0B
+    assert backend.writePCI(0, 0x1F, 0, config).ReturnCode == 0
+    assert bytearray(backend.readPCI(0, 0x1F, 0))[0x3C] == 0x0B
+
+def test_bar_reads_and_writes(backend):
+    bar = backend.getBarResources(1, 0, 0)[0]
+    assert (bar.Start, bar.End) == (BAR0, BAR0 + BAR0_SIZE - 1)
+
+    assert backend.read32(BAR0 + 0x08) == 0x10400
+    backend.write32(BAR0 + 0x14, 0x460001)
+    backend.writeMemory(BAR0 + 0x101, b'abc')    # unaligned, not a register width
+    assert backend.readMemory(BAR0 + 0x100, 5) == b'\x00abc\x00'
+    backend.write64(BAR0 + 0x28, 0x123456789ABCDEF0)
+    assert backend.read64(BAR0 + 0x28) == 0x123456789ABCDEF0
+
+    backend.close()
+    with open(bar.Path, 'rb') as f:
+        registers = f.read()
+    assert struct.unpack_from('<I', registers, 0x14)[0] == 0x460001
+    assert registers[0x101:0x104] == b'abc'
+
+def test_memory_outside_bars(backend):
+    backend.writeMemory(0x1000, b'\x01\x02\x03\x04')
+    assert backend.readMemory(0x1000, 4) == b'\x01\x02\x03\x04'
+    assert backend.read32(0x1000) == 0x04030201
+
+def test_register_window_is_mapped(backend):
+    window = backend.getRegisterWindow(BAR0, 0x1000)
+    assert window.isMapped
+    assert struct.unpack('<I', window.read(0x08, 4))[0] == 0x10400
+    window.write(0x20, struct.pack('<I', 0xDEADBEEF))
+    assert backend.read32(BAR0 + 0x20) == 0xDEADBEEF
+
+def test_register_window_tobytes(backend):
+    window = backend.getRegisterWindow(BAR0, 0x10)
+    backend.writeMemory(BAR0, b'0123456789abcdef')
+    assert window.tobytes() == b'0123456789abcdef'
+    assert window.tobytes(3, 7) == b'3456789'
@@ -0,0 +1,58 @@
+'''
+Brief:
+    Tests for pyrw.pci's PCIConfigCache
+
+Author(s):
+    Charles Machalow
+'''
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pyrw.fake import FakeReadWriteEverything, SimulatedSystem
+from pyrw.pci import PCIConfigCache
+
+LOCATION = (1, 0, 0)
+
+def test_cache_read_doesnt_store_data_invalidated_during_the_read():
+    reads = []
+    def readFunc(bus, device, function):
+        reads.append((bus, device, function))
+        if len(reads) == 1:
+            # a concurrent writePCI lands while this (now stale) read is in flight
+            cache.invalidate(LOCATION)
+            return b'old'
+        return b'new'
+
+    cache = PCIConfigCache(readFunc)
+    assert cache.read(LOCATION) == b'old'
+    assert cache.get(LOCATION) is None
+    assert cache.read(LOCATION) == b'new'
+    assert cache.get(LOCATION) == b'new'
+
+def test_cache_prime_with_old_version_is_dropped():
+    cache = PCIConfigCache(None)
+    version = cache.getVersion(LOCATION)
+    cache.invalidate()
+    cache.prime(LOCATION, b'stale', version)
+    assert cache.get(LOCATION) is None
+    cache.prime(LOCATION, b'fresh', cache.getVersion(LOCATION))
+    assert cache.get(LOCATION) == b'fresh'
+
+def test_batched_write_pci_invalidates_cache():
+    system = SimulatedSystem()
+    system.addGenericDevice(LOCATION)
+    rwe = FakeReadWriteEverything(system)
+    rwe.enableConfigCache()
+
+    before = rwe.readPCI(*LOCATION)
+    data = bytearray(before)
+    data[0x40] = 0x5A
+
+    batch = rwe.batch()
+    batch.writePCI(*(LOCATION + (data,)))
+    batch.execute()
+
+    assert rwe.configCache.get(LOCATION) is None
+    assert bytearray(rwe.readPCI(*LOCATION))[0x40] == 0x5A
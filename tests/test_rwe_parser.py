@@ -0,0 +1,29 @@
+'''
+Brief:
+    Tests for pyrw.rwe_parser
+
+Author(s):
+    Charles Machalow
+'''
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pyrw.rwe_parser import verifyAddresses
+
+OUTPUT = 'Save Memory Address=0x2000, Length=0x4\nSave PCI Bus 01, Device 00, Function 00\nLoad Memory Address=0x1000, Length=0x4'
+
+def test_verify_addresses_in_order():
+    verifyAddresses([0x2000, 0x1000], OUTPUT)
+
+def test_verify_addresses_compares_by_position():
+    # 0x1000 shows up later in the output, but the first memory command processed 0x2000
+    with pytest.raises(RuntimeError):
+        verifyAddresses([0x1000, 0x1000], OUTPUT)
+
+def test_verify_addresses_missing():
+    with pytest.raises(RuntimeError):
+        verifyAddresses([0x2000, 0x1000, 0x3000], OUTPUT)
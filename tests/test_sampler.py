@@ -0,0 +1,42 @@
+'''
+Brief:
+    Tests for pyrw.sampler
+
+Author(s):
+    Charles Machalow
+'''
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pyrw.backend import ARRAY_TYPECODES
+from pyrw.fake import FakeReadWriteEverything, SimulatedSystem
+from pyrw.sampler import SampleFileWriter, Sampler, memorySignal, readSampleFile
+
+@pytest.mark.parametrize('has8ByteTypecode', [True, False])
+def test_sample_file_round_trip(tmpdir, monkeypatch, has8ByteTypecode):
+    if not has8ByteTypecode:
+        # like Python 2 builds whose array module has no 8 byte typecode
+        monkeypatch.setitem(ARRAY_TYPECODES, 8, None)
+
+    rwe = FakeReadWriteEverything(SimulatedSystem())
+    rwe.writeMemory(0x100, b'\x01\x02\x03\x04\x05\x06\x07\x88')
+    rwe.writeMemory(0x200, b'\xAA\xBB')
+    signals = [memorySignal('wide', 0x100, 8), memorySignal('narrow', 0x200, 2)]
+
+    path = str(tmpdir.join('samples.bin'))
+    writer = SampleFileWriter(path, signals)
+    sampler = Sampler(rwe, signals, 1000, capacity=3, writer=writer)
+    assert sampler.elapsed == 0.0
+    stats = sampler.run(numTicks=7)
+    writer.close()
+    assert stats.Ticks == 7 and sampler.elapsed > 0
+
+    readSignals, data = readSampleFile(path)
+    assert readSignals == signals
+    timestamps, values = data['wide']
+    assert len(timestamps) == 7 and list(values) == [0x8807060504030201] * 7
+    assert list(data['narrow'][1]) == [0xBBAA] * 7
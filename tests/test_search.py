@@ -0,0 +1,54 @@
+'''
+Brief:
+    Tests for pyrw.search
+
+Author(s):
+    Charles Machalow
+'''
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pyrw.search import SearchMatch, searchChunks, toPattern
+
+BASE = 0x10000
+
+def _chunks(data, chunkSize):
+    return [data[idx:idx + chunkSize] for idx in range(0, len(data), chunkSize)]
+
+def _bruteForce(data, patterns, alignment=1):
+    patterns = [toPattern(p) for p in patterns]
+    ret = []
+    for start in range(len(data)):
+        for patternIndex, pattern in enumerate(patterns):
+            window = bytearray(data[start:start + len(pattern)])
+            if len(window) == len(pattern) and all(b & m == v & m for b, v, m in zip(window, bytearray(pattern.value), bytearray(pattern.mask))):
+                if (BASE + start) % alignment == 0:
+                    ret.append(SearchMatch(BASE + start, patternIndex))
+    return sorted(ret)
+
+def test_mixed_length_patterns_across_a_chunk_boundary():
+    # 'ABCD' starts at 0x1000E (spanning the 16 byte chunk boundary), 'B' at 0x1000F is inside the first chunk
+    data = b'.' * 14 + b'ABCD' + b'.' * 14
+    matches = list(searchChunks(_chunks(data, 16), BASE, [b'ABCD', b'B']))
+    assert matches == [SearchMatch(0x1000E, 0), SearchMatch(0x1000F, 1)]
+    assert list(searchChunks(_chunks(data, 16), BASE, [b'ABCD', b'B'], maxHits=1)) == [SearchMatch(0x1000E, 0)]
+
+def test_matches_brute_force_in_address_order():
+    rng = random.Random(1234)
+    data = bytes(bytearray(rng.choice(b'ABC') for _ in range(2000)))
+    patterns = [b'ABCA', b'C', '41 ?? 43', b'BB']
+    expected = _bruteForce(data, patterns)
+    for chunkSize in (1, 3, 16, 37, 4096):
+        assert list(searchChunks(_chunks(data, chunkSize), BASE, patterns)) == expected
+        assert list(searchChunks(_chunks(data, chunkSize), BASE, patterns, alignment=4)) == _bruteForce(data, patterns, 4)
+        assert list(searchChunks(_chunks(data, chunkSize), BASE, patterns, maxHits=25)) == expected[:25]
+
+def test_to_pattern_text_and_bytes():
+    assert toPattern(u'44 ?? 5?').value == b'\x44\x00\x50'
+    assert toPattern(u'44 ?? 5?').mask == b'\xff\x00\xf0'
+    # bytes are always the literal pattern (on Python 2 as well, where str is bytes)
+    assert toPattern(b'44 ?').value == b'44 ?'
+    assert toPattern(b'44 ?').mask == b'\xff' * 4
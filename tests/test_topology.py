@@ -0,0 +1,28 @@
+'''
+Brief:
+    Tests for pyrw.topology
+
+Author(s):
+    Charles Machalow
+'''
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pyrw.fake import FakeReadWriteEverything, SimulatedSystem
+
+def test_unconfigured_bridge_isnt_a_parent():
+    system = SimulatedSystem()
+    system.addGenericDevice((0, 0, 0))
+    system.addBridgeDevice((0, 1, 0), secondaryBus=1)
+    system.addBridgeDevice((0, 2, 0), secondaryBus=0, subordinateBus=0)
+    system.addBridgeDevice((2, 0, 0), secondaryBus=2, subordinateBus=2)
+    system.addGenericDevice((1, 0, 0))
+    topology = FakeReadWriteEverything(system).getPCITopology()
+
+    assert topology.getParent((1, 0, 0)).Address == (0, 1, 0)
+    for address in ((0, 0, 0), (0, 1, 0), (0, 2, 0), (2, 0, 0)):
+        assert topology.getParent(address) is None
+    assert topology.getChildren((0, 2, 0)) == []
+    assert topology.getChildren((2, 0, 0)) == []